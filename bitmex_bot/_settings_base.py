@@ -83,6 +83,8 @@ POST_ONLY = False
 DRY_RUN = False
 
 # How often to re-check and replace orders.
+# The bot re-checks as soon as our orders, fills, position or the MACD bar change, so this is only the
+# longest it will go without checking (and how often status is printed).
 # Generally, it's safe to make this short because we're fetching from websockets. But if too many
 # order amend/replaces are done, you may hit a ratelimit. If so, email BitMEX if you feel you need a higher limit.
 LOOP_INTERVAL = 5
@@ -91,6 +93,64 @@ LOOP_INTERVAL = 5
 API_REST_INTERVAL = 1
 API_ERROR_INTERVAL = 10
 
+# REST requests are paced client side to stay inside the BitMEX ratelimit (tracked from the X-RateLimit-*
+# response headers), and block instead of getting a 429. This many requests are kept back for cancels.
+API_RATELIMIT_RESERVE = 5
+
+# REST connections are kept alive and reused. HTTP_POOL_SIZE is how many are kept open per host (raise it if
+# you send more requests at once), HTTP_RETRIES how often to retry failing to connect, and with HTTP_PREWARM
+# the connection is opened at startup rather than by the first order.
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 2
+HTTP_PREWARM = True
+
+# Record every websocket frame, REST response and seed candle to this file, to replay the session offline
+# later with `python -m bitmex_bot.replay`. Leave as None to not record.
+CAPTURE_FILE = None
+
+# Time every stage from a websocket frame arriving to our order's REST response into latency histograms,
+# and log them every TRACE_INTERVAL seconds, on SIGUSR1, and at exit. See bitmex_bot.utils.trace.
+TRACE = False
+TRACE_INTERVAL = 300
+
+# How many rows to keep for the append-only websocket streams. Once a table is full, each new row
+# replaces the oldest one. Tables not listed here keep BitMEXWebsocket.MAX_TABLE_LEN rows.
+TABLE_CAPACITY = {
+    'trade': 1000,
+    'quote': 1000,
+    'execution': 200,
+}
+
+# How many ticks per symbol to keep in the NumPy column stores that indicator code reads from.
+COLUMN_CAPACITY = {
+    'trade': 50000,
+    'quote': 50000,
+}
+
+# Order book table to subscribe to for each symbol: 'orderBookL2_25' (the top 25 levels a side) or
+# 'orderBookL2' (full depth). It gives the ticker its bid and ask, and an estimate of the slippage of our
+# market orders before we send them. None to not subscribe.
+ORDERBOOK_TABLE = 'orderBookL2_25'
+
+# Bar sizes the live candle aggregator builds from the trade stream, and how many bars of each to keep.
+# They are seeded from trade/bucketed once at startup. TICK_INTERVAL must be one of these.
+CANDLE_BIN_SIZES = ['1m', '5m', '1h', '1d']
+CANDLE_HISTORY = 400
+
+# EMA used by the MACD signal: 'recursive' (standard EMA) or 'legacy' (the original finite kernel).
+MACD_EMA_METHOD = 'recursive'
+
+# Run the MACD on Heikin-Ashi closes instead of plain closes.
+MACD_HEIKIN_ASHI = False
+
+# MACD fast and slow EMA periods, and the period of its signal line. See bitmex_bot.sweep for tuning them.
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+
+# Where downloaded candles are cached between runs, so restarts only fetch the bars they missed.
+CANDLE_CACHE_DIR = 'candle_cache'
+
 # If we're doing a dry run, use these numbers for BTC balances
 DRY_BTC = 50
 
@@ -116,3 +176,7 @@ WATCHED_FILES = [join("bitmex_bot", f) for f in ["bitmex_bot.py", "bitmex_histor
 
 # Specify the contracts that you hold. These will be used in portfolio calculations.
 CONTRACTS = ['XBTUSD']
+
+# Trade every symbol in CONTRACTS from this one process, each with its own MACD state, over one websocket
+# and one REST session. If False only SYMBOL (or the symbol given on the command line) is traded.
+TRADE_CONTRACTS = False
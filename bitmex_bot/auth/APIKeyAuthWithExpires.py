@@ -1,16 +1,17 @@
 from requests.auth import AuthBase
 import time
-from bitmex_bot.auth.APIKeyAuth import generate_signature
+from bitmex_bot.auth.RequestSigner import RequestSigner
 
 
 class APIKeyAuthWithExpires(AuthBase):
 
     """Attaches API Key Authentication to the given Request object. This implementation uses `expires`."""
 
-    def __init__(self, apiKey, apiSecret):
-        """Init with Key & Secret."""
+    def __init__(self, apiKey, apiSecret, signer=None):
+        """Init with Key & Secret. Reuse one instance (or pass a RequestSigner) to avoid re-keying the HMAC."""
         self.apiKey = apiKey
         self.apiSecret = apiSecret
+        self.signer = signer or RequestSigner(apiSecret)
 
     def __call__(self, r):
         """
@@ -23,6 +24,6 @@ class APIKeyAuthWithExpires(AuthBase):
         expires = int(round(time.time()) + 5)  # 5s grace period in case of clock skew
         r.headers['api-expires'] = str(expires)
         r.headers['api-key'] = self.apiKey
-        r.headers['api-signature'] = generate_signature(self.apiSecret, r.method, r.url, expires, r.body or '')
+        r.headers['api-signature'] = self.signer.sign(r.method, r.path_url, expires, r.body or b'')
 
         return r
@@ -1,3 +1,4 @@
 from bitmex_bot.auth.AccessTokenAuth import *
 from bitmex_bot.auth.APIKeyAuth import *
 from bitmex_bot.auth.APIKeyAuthWithExpires import *
+from bitmex_bot.auth.RequestSigner import *
@@ -0,0 +1,306 @@
+"""Backtest of the OrderManager strategy over stored candles.
+
+The rules are the ones sanity_check trades live:
+
+  - the signal is the sign of the MACD histogram over completed TICK_INTERVAL bars (optionally on
+    Heikin-Ashi closes), re-evaluated as each bar completes;
+  - with no position and a signal, enter `quantity` contracts at market in its direction, with a stop
+    loss STOP_LOSS_FACTOR and a take profit STOP_PROFIT_FACTOR away from the entry price;
+  - the first leg to fill closes the trade, and the next check re-enters on the current signal;
+  - an opposite signal closes the position at market, and the next check enters the other way.
+
+The signal series is computed for the whole history at once. Only fill resolution is a loop, with one
+iteration per trade: each trade scans the base bars after its entry in growing chunks for the first
+one whose range reaches a leg, up to the next opposite signal. Base bars are the stored bars (usually
+1m); TICK_INTERVAL bars are resampled from them.
+
+Fill model: market orders (entries, reversals) fill at the bar close as takers; the take profit fills
+at its price as a maker; the stop fills at its price as a taker, or at the bar open if the bar opened
+through it. A bar that reaches both legs is counted as a stop. PnL is that of an inverse contract
+(XBTUSD), in XBT.
+
+    python -m bitmex_bot.backtest history/XBTUSD-1m --tick 5m --stop 0.007 --profit 0.01
+"""
+import os
+import time
+import logging
+import argparse
+import numpy as np
+from bitmex_bot import indicators
+from bitmex_bot.bulk_download import load_candles
+from bitmex_bot.candle_cache import CANDLE_DTYPE
+from bitmex_bot.candles import BIN_SECONDS, NS_PER_SECOND
+
+logger = logging.getLogger('root')
+
+# How a trade ended
+STOP = 0
+PROFIT = 1
+REVERSAL = 2
+END = 3
+EXIT_NAMES = ('stop', 'profit', 'reversal', 'end')
+
+TRADE_DTYPE = np.dtype([
+    ('entry_time', np.int64),  # ns since epoch, end of the bar we entered on
+    ('exit_time', np.int64),
+    ('side', np.int8),  # 1 long, -1 short
+    ('entry', np.float64),
+    ('exit', np.float64),
+    ('pnl', np.float64),  # XBT, before fees
+    ('fees', np.float64),  # XBT, negative for rebates
+    ('reason', np.int8),  # STOP, PROFIT, REVERSAL or END
+    ('gap', np.bool_),  # stop filled at a worse open
+    ('ambiguous', np.bool_),  # the exit bar reached both legs
+])
+
+# Bars a trade's first exit scan looks at; each further scan looks at four times as many.
+_FIRST_CHUNK = 64
+
+
+def load_bars(path):
+    """Bars from a BulkDownloader store (a directory) or a CandleCache file (.bin), oldest first.
+
+    Either way the result is indexed by column name, and is memory mapped rather than read in.
+    """
+    if os.path.isdir(path):
+        return load_candles(path)
+    size = os.path.getsize(path) // CANDLE_DTYPE.itemsize
+    return np.memmap(path, dtype=CANDLE_DTYPE, mode='r', shape=(size,))
+
+
+def bar_width(timestamps):
+    """Bin width of bars (ns), going by the most common spacing."""
+    steps = np.diff(np.asarray(timestamps[:10000]))
+    if not len(steps):
+        raise ValueError("Need at least two bars to tell their width")
+    values, counts = np.unique(steps, return_counts=True)
+    return int(values[np.argmax(counts)])
+
+
+def resample(bars, binSize):
+    """Aggregate bars into `binSize` bins. Returns (columns, last), where last[i] is the index of the
+    last input bar in output bar i. A trailing bin the input doesn't reach the end of is left out.
+    """
+    timestamps = np.asarray(bars['timestamp'])
+    width = BIN_SECONDS[binSize] * NS_PER_SECOND
+    base = bar_width(timestamps)
+    if width < base or width % base:
+        raise ValueError("Can't build %s bars from bars %d seconds wide" % (binSize, base // NS_PER_SECOND))
+    if width == base:
+        return dict((name, np.asarray(bars[name])) for name in ('timestamp', 'open', 'high', 'low', 'close',
+                                                                 'volume')), np.arange(len(timestamps))
+    # Timestamps are bin ends, so a bar ending at t belongs to the bin ending at the next multiple of width
+    ends = (timestamps + width - 1) // width * width
+    starts = np.flatnonzero(np.r_[True, ends[1:] != ends[:-1]])
+    last = np.r_[starts[1:] - 1, len(ends) - 1]
+    if len(last) and timestamps[last[-1]] != ends[last[-1]]:
+        starts, last = starts[:-1], last[:-1]
+    if not len(starts):
+        empty = np.zeros(0)
+        return dict(timestamp=empty.astype(np.int64), open=empty, high=empty, low=empty, close=empty,
+                    volume=empty.astype(np.int64)), last
+    stop = last[-1] + 1
+    return {
+        'timestamp': ends[last],
+        'open': np.asarray(bars['open'])[starts],
+        'high': np.maximum.reduceat(np.asarray(bars['high'][:stop]), starts),
+        'low': np.minimum.reduceat(np.asarray(bars['low'][:stop]), starts),
+        'close': np.asarray(bars['close'])[last],
+        'volume': np.add.reduceat(np.asarray(bars['volume'][:stop]), starts),
+    }, last
+
+
+def signals(bars, method='recursive', heikin_ashi=False, fast=12, slow=26, signal=9):
+    """The MACD signal after each bar: 1 up, -1 down, 0 none (histogram zero, or not enough bars yet)."""
+    closes = bars['close']
+    if heikin_ashi:
+        closes = indicators.heikin_ashi(bars['open'], bars['high'], bars['low'], bars['close'])[3]
+    hist = indicators.macd(np.asarray(closes, dtype=np.float64), fast, slow, signal, method)
+    if hist is None:
+        return np.zeros(len(closes), dtype=np.int8)
+    return (np.sign(np.nan_to_num(hist)) * (~np.isnan(hist))).astype(np.int8)
+
+
+def _next_index(mask):
+    """For every i, the smallest j >= i where mask[j] is set, or len(mask) if there's none."""
+    n = len(mask)
+    idx = np.where(mask, np.arange(n), n)
+    return np.minimum.accumulate(idx[::-1])[::-1]
+
+
+def run(bars, signal, last, stop_loss=0.007, take_profit=0.01, quantity=1000, taker_fee=0.00075,
+        maker_fee=-0.00025):
+    """Trade `signal` (one value per decision bar, whose last base bar index is `last`) over base `bars`.
+
+    stop_loss and take_profit are fractions of the entry price; None leaves that leg out. Returns the
+    trades as a TRADE_DTYPE array.
+    """
+    times = np.asarray(bars['timestamp'])
+    opens, highs, lows, closes = [np.asarray(bars[name], dtype=np.float64) for name in ('open', 'high', 'low',
+                                                                                         'close')]
+    # What a long is stopped and taken profit on; a short's are the same with the signs flipped
+    sides = {1: (lows, highs), -1: (-highs, -lows)}
+    count = len(signal)
+    nonzero = _next_index(signal != 0)
+    opposite = {1: _next_index(signal == -1), -1: _next_index(signal == 1)}
+    exits = []  # (entry bar, exit bar, side, exit price, reason, gap, ambiguous) per trade
+
+    decision = nonzero[0] if count else count  # index into signal of the check we're acting on
+    while decision < count:
+        # Flat: enter on the signal of the current check
+        side = int(signal[decision])
+        start = int(last[decision])
+        while True:
+            entry = closes.item(start)
+            stop = entry - side * entry * stop_loss if stop_loss is not None else None
+            profit = entry + side * entry * take_profit if take_profit is not None else None
+            flip = opposite[side][decision + 1] if decision + 1 < count else count
+            until = int(last[flip]) if flip < count else len(closes) - 1
+            against, favour = sides[side]
+            hit = _first_exit(against, favour, start + 1, until, side * stop if stop is not None else -np.inf,
+                              side * profit if profit is not None else np.inf)
+            if hit is None:
+                reason = REVERSAL if flip < count else END
+                exit_at, price, gap, ambiguous = until, closes.item(until), False, False
+            else:
+                exit_at, reason, ambiguous = hit
+                if reason == PROFIT:
+                    price, gap = profit, False
+                else:
+                    gap = (opens.item(exit_at) - stop) * side < 0
+                    price = opens.item(exit_at) if gap else stop
+            exits.append((start, exit_at, side, price, reason, gap, ambiguous))
+            if reason == END:
+                break
+            if reason == REVERSAL:
+                decision = flip
+            else:
+                # The check after the exit re-enters on whatever the last completed bar says
+                decision = int(np.searchsorted(last, exit_at, 'right')) - 1
+                if decision < 0 or not signal[decision]:
+                    break
+            side = int(signal[decision])
+            start = exit_at
+        if exits and exits[-1][4] == END:
+            break
+        decision = nonzero[decision + 1] if decision + 1 < count else count
+
+    trades = np.zeros(len(exits), dtype=TRADE_DTYPE)
+    if not exits:
+        return trades
+    starts, ends, side, price, reason, gap, ambiguous = [np.array(column) for column in zip(*exits)]
+    entry = closes[starts]
+    trades['entry_time'] = times[starts]
+    trades['exit_time'] = times[ends]
+    trades['side'] = side
+    trades['entry'] = entry
+    trades['exit'] = price
+    trades['pnl'] = side * quantity * (1. / entry - 1. / price)
+    trades['fees'] = quantity * (taker_fee / entry + np.where(reason == PROFIT, maker_fee, taker_fee) / price)
+    trades['reason'] = reason
+    trades['gap'] = gap
+    trades['ambiguous'] = ambiguous
+    return trades
+
+
+def _first_exit(against, favour, start, until, stop, profit):
+    """First bar in [start, until] with against <= stop or favour >= profit, looking at growing chunks.
+
+    For a long, against is the lows and favour the highs; a short passes both negated, with its stop and
+    profit negated too. Returns (index, reason, whether both were reached) or None.
+    """
+    chunk = _FIRST_CHUNK
+    while start <= until:
+        end = min(start + chunk, until + 1)
+        stopped = against[start:end] <= stop
+        profited = favour[start:end] >= profit
+        hits = stopped | profited
+        i = hits.argmax()
+        if hits[i]:
+            return start + i, STOP if stopped[i] else PROFIT, bool(stopped[i] and profited[i])
+        start = end
+        chunk *= 4
+    return None
+
+
+def report(trades, bars=None):
+    """Summary statistics of a trades array, as a dict. PnL and drawdown are in XBT, net of fees."""
+    net = trades['pnl'] - trades['fees']
+    equity = np.cumsum(net)
+    drawdown = np.maximum.accumulate(np.r_[0., equity]) - np.r_[0., equity]
+    wins = net > 0
+    held = (trades['exit_time'] - trades['entry_time']) / NS_PER_SECOND
+    stats = {
+        'trades': len(trades),
+        'wins': int(wins.sum()),
+        'win_rate': float(wins.mean()) if len(trades) else 0.,
+        'gross_pnl': float(trades['pnl'].sum()),
+        'fees': float(trades['fees'].sum()),
+        'net_pnl': float(net.sum()),
+        'max_drawdown': float(drawdown.max()),
+        'profit_factor': float(net[wins].sum() / -net[~wins].sum()) if (~wins).any() and net[~wins].sum() else
+        float('inf') if wins.any() else 0.,
+        'avg_trade': float(net.mean()) if len(trades) else 0.,
+        'avg_hold': float(held.mean()) if len(trades) else 0.,
+        'exits': dict((name, int((trades['reason'] == reason).sum())) for reason, name in enumerate(EXIT_NAMES)),
+        'gaps': int(trades['gap'].sum()),
+        'ambiguous': int(trades['ambiguous'].sum()),
+    }
+    if bars is not None and len(bars['timestamp']):
+        timestamps = bars['timestamp']
+        span = (timestamps[-1] - timestamps[0]) / NS_PER_SECOND
+        stats['exposure'] = float(held.sum() / span) if span else 0.
+    return stats
+
+
+def backtest(bars, tick='1m', stop_loss=0.007, take_profit=0.01, quantity=1000, method='recursive',
+             heikin_ashi=False, fast=12, slow=26, signal=9, **fees):
+    """Resample, compute signals and run in one go. Returns (trades, report)."""
+    tick_bars, last = resample(bars, tick)
+    trades = run(bars, signals(tick_bars, method, heikin_ashi, fast, slow, signal), last, stop_loss, take_profit,
+                 quantity, **fees)
+    return trades, report(trades, bars)
+
+
+def parse_factor(value):
+    """A stop loss or take profit factor; settings use "" (and the command line 'none') for no leg."""
+    return None if value is None or str(value).lower() in ("", "none") else float(value)
+
+
+if __name__ == "__main__":
+    from bitmex_bot.settings import settings
+
+    parser = argparse.ArgumentParser(description="Backtest the MACD strategy over stored candles.")
+    parser.add_argument('path', help="a bulk_download store directory or a candle cache .bin file")
+    parser.add_argument('--tick', default=settings.TICK_INTERVAL, choices=sorted(BIN_SECONDS))
+    parser.add_argument('--stop', type=parse_factor, default=parse_factor(settings.STOP_LOSS_FACTOR),
+                        help="stop loss as a fraction of the entry price")
+    parser.add_argument('--profit', type=parse_factor, default=parse_factor(settings.STOP_PROFIT_FACTOR),
+                        help="take profit as a fraction of the entry price")
+    parser.add_argument('--quantity', type=int, default=settings.POSITION)
+    parser.add_argument('--method', default=settings.MACD_EMA_METHOD or 'recursive',
+                        choices=indicators.EMA_METHODS)
+    parser.add_argument('--heikin-ashi', action='store_true', default=bool(settings.MACD_HEIKIN_ASHI))
+    parser.add_argument('--fast', type=int, default=settings.MACD_FAST or 12)
+    parser.add_argument('--slow', type=int, default=settings.MACD_SLOW or 26)
+    parser.add_argument('--signal', type=int, default=settings.MACD_SIGNAL or 9)
+    parser.add_argument('--taker-fee', type=float, default=0.00075)
+    parser.add_argument('--maker-fee', type=float, default=-0.00025)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    bars = load_bars(args.path)
+    trades, stats = backtest(bars, args.tick, args.stop, args.profit, args.quantity, args.method,
+                             args.heikin_ashi, args.fast, args.slow, args.signal, taker_fee=args.taker_fee,
+                             maker_fee=args.maker_fee)
+    elapsed = time.perf_counter() - start
+
+    print("%d bars, %d trades in %.2fs" % (len(bars['timestamp']), stats['trades'], elapsed))
+    print("Net PnL %.6f XBT (gross %.6f, fees %.6f), max drawdown %.6f XBT" %
+          (stats['net_pnl'], stats['gross_pnl'], stats['fees'], stats['max_drawdown']))
+    print("Win rate %.1f%%, profit factor %.2f, %.6f XBT per trade, held %.0fs on average, in the market %.1f%% "
+          "of the time" % (stats['win_rate'] * 100, stats['profit_factor'], stats['avg_trade'], stats['avg_hold'],
+                           stats.get('exposure', 0.) * 100))
+    print("Exits: %s; %d stops filled through a gap, %d bars reached both legs" %
+          (", ".join("%d %s" % (stats['exits'][name], name) for name in EXIT_NAMES), stats['gaps'],
+           stats['ambiguous']))
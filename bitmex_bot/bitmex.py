@@ -7,8 +7,10 @@ import json
 import base64
 import uuid
 import logging
-from bitmex_bot.auth import APIKeyAuthWithExpires
-from bitmex_bot.utils import constants, errors
+from bitmex_bot.auth import APIKeyAuthWithExpires, RequestSigner
+from bitmex_bot.utils import constants, errors, codec, trace
+from bitmex_bot.utils.transport import new_session
+from bitmex_bot.utils.ratelimit import shared_limiter, CANCEL, NORMAL
 from bitmex_bot.ws.ws_thread import BitMEXWebsocket
 
 
@@ -18,11 +20,17 @@ class BitMEX(object):
     """BitMEX API Connector."""
 
     def __init__(self, base_url=None, symbol=None, apiKey=None, apiSecret=None,
-                 orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False):
-        """Init connector."""
+                 orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False, ratelimitReserve=5,
+                 session=None, capture=None):
+        """Init connector.
+
+        `symbol` may be a list, to trade several symbols over one websocket and one REST session. Methods
+        that take a symbol default to the first one.
+        """
         self.logger = logging.getLogger('root')
         self.base_url = base_url
-        self.symbol = symbol
+        self.symbols = [symbol] if isinstance(symbol, str) or symbol is None else list(symbol)
+        self.symbol = self.symbols[0]
         self.postOnly = postOnly
         if (apiKey is None):
             raise Exception("Please set an API key and Secret to get started. See " +
@@ -30,21 +38,33 @@ class BitMEX(object):
                             )
         self.apiKey = apiKey
         self.apiSecret = apiSecret
+        # Keyed once, used to sign every REST request
+        self.signer = RequestSigner(apiSecret)
+        self.auth = APIKeyAuthWithExpires(apiKey, apiSecret, signer=self.signer)
         if len(orderIDPrefix) > 13:
             raise ValueError("settings.ORDERID_PREFIX must be at most 13 characters long!")
         self.orderIDPrefix = orderIDPrefix
         self.retries = 0  # initialize counter
+        # REST request budget, shared with any other client in this process using the same key
+        self.ratelimit = shared_limiter(apiKey, reserve=ratelimitReserve)
 
-        # Prepare HTTPS session
-        self.session = requests.Session()
+        # Prepare HTTPS session. Pass one from utils.transport.new_session() to size its connection pool.
+        self.session = session or new_session()
         # These headers are always sent
         self.session.headers.update({'user-agent': 'liquidbot-' + constants.VERSION})
         self.session.headers.update({'content-type': 'application/json'})
         self.session.headers.update({'accept': 'application/json'})
 
+        # Optional capture.CaptureWriter, recording websocket frames and REST responses for replay
+        self.capture = capture
+
         # Create websocket for streaming data
         self.ws = BitMEXWebsocket()
-        self.ws.connect(base_url, symbol, shouldAuth=shouldWSAuth)
+        self.ws.capture = capture
+        self._connect_ws(shouldWSAuth)
+
+    def _connect_ws(self, shouldWSAuth):
+        self.ws.connect(self.base_url, self.symbols, shouldAuth=shouldWSAuth, apiKey=self.apiKey, signer=self.signer)
 
     def __del__(self):
         self.exit()
@@ -71,23 +91,31 @@ class BitMEX(object):
             query['filter'] = json.dumps(filter)
         return self._curl_bitmex(path='instrument', query=query, verb='GET')
 
-    def market_depth(self, symbol):
-        """Get market depth / orderbook."""
-        return self.ws.market_depth(symbol)
+    def market_depth(self, symbol=None):
+        """Get market depth / orderbook, as the websocket's OrderBookL2 for the symbol."""
+        return self.ws.market_depth(symbol or self.symbol)
 
-    def recent_trades(self):
-        """Get recent trades.
+    def recent_trades(self, count=None):
+        """Get recent trades. Pass count to only get the latest `count` of them.
 
         Returns
         -------
-        A list of dicts:
+        A sequence of dicts, oldest first:
               {u'amount': 60,
                u'date': 1306775375,
                u'price': 8.7401099999999996,
                u'tid': u'93842'},
 
         """
-        return self.ws.recent_trades()
+        return self.ws.recent_trades(count)
+
+    def trade_columns(self, symbol=None):
+        """Get recent trades as NumPy columns (timestamp, price, size, side)."""
+        return self.ws.trade_columns(symbol or self.symbol)
+
+    def quote_columns(self, symbol=None):
+        """Get recent quotes as NumPy columns (timestamp, bidPrice, askPrice, bidSize, askSize)."""
+        return self.ws.quote_columns(symbol or self.symbol)
 
     #
     # Authentication required methods
@@ -129,8 +157,8 @@ class BitMEX(object):
         return self._curl_bitmex(path=path, postdict=postdict, verb="GET", rethrow_errors=rethrow_errors)
 
     @authentication_required
-    def delta(self):
-        return self.position(self.symbol)['homeNotional']
+    def delta(self, symbol=None):
+        return self.position(symbol or self.symbol)['homeNotional']
 
     @authentication_required
     def buy(self, **kwargs):
@@ -160,7 +188,7 @@ class BitMEX(object):
         # Generate a unique clOrdID with our prefix so we can identify it.
         clOrdID = self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
         postdict = {
-            'symbol': self.symbol,
+            'symbol': kwargs.get('symbol') or self.symbol,
             'orderQty': kwargs['quantity'],
             'clOrdID': clOrdID,
             'orderType': kwargs['orderType']
@@ -173,10 +201,10 @@ class BitMEX(object):
         return self._curl_bitmex(path=endpoint, postdict=postdict, verb="POST")
 
     @authentication_required
-    def close_position(self):
+    def close_position(self, symbol=None):
         endpoint = 'order/closePosition'
         postdict = {'execlnst': 'Close',
-                    'symbol': self.symbol
+                    'symbol': symbol or self.symbol
                     }
         return self._curl_bitmex(path=endpoint, postdict=postdict, verb="POST")
 
@@ -187,28 +215,33 @@ class BitMEX(object):
         return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='PUT', rethrow_errors=True)
 
     @authentication_required
-    def create_bulk_orders(self, orders):
+    def create_bulk_orders(self, orders, symbol=None):
         """Create multiple orders."""
         for order in orders:
             order['clOrdID'] = self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
-            order['symbol'] = self.symbol
+            order['symbol'] = symbol or self.symbol
             if self.postOnly:
                 order['execInst'] = 'ParticipateDoNotInitiate'
         return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='POST')
 
     @authentication_required
-    def open_orders(self):
+    def open_orders(self, symbol=None):
         """Get open orders."""
-        return self.ws.open_orders(self.orderIDPrefix)
+        return self.ws.open_orders(self.orderIDPrefix, symbol or self.symbol)
+
+    @authentication_required
+    def executions(self, symbol=None):
+        """Get our recent executions (fills, cancels, ...)."""
+        return self.ws.executions(symbol or self.symbol)
 
     @authentication_required
-    def http_open_orders(self):
+    def http_open_orders(self, symbol=None):
         """Get open orders via HTTP. Used on close to ensure we catch them all."""
         path = "order"
         orders = self._curl_bitmex(
             path=path,
             query={
-                'filter': json.dumps({'ordStatus.isTerminated': False, 'symbol': self.symbol}),
+                'filter': json.dumps({'ordStatus.isTerminated': False, 'symbol': symbol or self.symbol}),
                 'count': 500
             },
             verb="GET"
@@ -253,9 +286,6 @@ class BitMEX(object):
         if max_retries is None:
             max_retries = 0 if verb in ['POST', 'PUT'] else 3
 
-        # Auth: API Key/Secret
-        auth = APIKeyAuthWithExpires(self.apiKey, self.apiSecret)
-
         def exit_or_throw(e):
             if rethrow_errors:
                 raise e
@@ -271,10 +301,26 @@ class BitMEX(object):
         # Make the request
         response = None
         try:
-            self.logger.info("sending req to %s: %s" % (url, json.dumps(postdict or query or '')))
-            req = requests.Request(verb, url, json=postdict, auth=auth, params=query)
+            self.logger.info("sending req to %s: %s", url, codec.lazy(postdict or query or ''))
+            started = trace.now() if trace.on else 0
+            # Wait for ratelimit room rather than get a 429; cancels go first. Sign only once through: the
+            # signature expires a few seconds after it is made, and the wait can be longer than that.
+            self.ratelimit.acquire(CANCEL if verb == 'DELETE' else NORMAL)
+            if trace.on:
+                acquired = trace.now()
+                trace.record('rest.ratelimit', started, acquired)
+            req = requests.Request(verb, url, data=codec.dumpb(postdict) if postdict else None, auth=self.auth,
+                                   params=query)
             prepped = self.session.prepare_request(req)
+            if trace.on:
+                sent = trace.now()
+                trace.record('rest.sign', acquired, sent)
             response = self.session.send(prepped, timeout=timeout)
+            if trace.on:
+                trace.record('rest.http', sent)
+            self.ratelimit.update(response.headers)
+            if self.capture is not None:
+                self.capture.write_response(verb, path, query, response.status_code, response.content)
             # Make non-200s throw
             response.raise_for_status()
 
@@ -311,14 +357,16 @@ class BitMEX(object):
                 to_sleep = int(ratelimit_reset) - int(time.time())
                 reset_str = datetime.datetime.fromtimestamp(int(ratelimit_reset)).strftime('%X')
 
-                # We're ratelimited, and we may be waiting for a long time. Cancel orders.
-                self.logger.warning("Canceling all known orders in the meantime.")
-                self.cancel([o['orderID'] for o in self.open_orders()])
+                # We're ratelimited, and we may be waiting for a long time. Cancel orders, on every symbol.
+                orderIDs = [o['orderID'] for symbol in self.symbols for o in self.open_orders(symbol)]
+                if orderIDs and verb != 'DELETE':
+                    self.logger.warning("Canceling all known orders in the meantime.")
+                    self.cancel(orderIDs)
 
                 self.logger.error("Your ratelimit will reset at %s. Sleeping for %d seconds." % (reset_str, to_sleep))
-                time.sleep(to_sleep)
+                self.ratelimit.hold(int(ratelimit_reset))
 
-                # Retry the request.
+                # Retry the request. It waits in the ratelimiter until the reset.
                 return retry()
 
             # 503 - BitMEX temporary downtime, likely due to a deploy. Try again
@@ -375,4 +423,4 @@ class BitMEX(object):
         # Reset retry counter on success
         self.retries = 0
 
-        return response.json()
+        return codec.loads(response.content)
@@ -0,0 +1,258 @@
+"""asyncio BitMEX API Connector.
+
+AsyncBitMEX has the same public surface as bitmex.BitMEX, but runs on one asyncio event loop: the
+websocket reader is a task and every REST method is a coroutine, so several order operations can be
+in flight at once, e.g.
+
+    client = AsyncBitMEX(base_url=url, symbol='XBTUSD', apiKey=key, apiSecret=secret)
+    await client.connect()
+    stop, profit = await asyncio.gather(client.sell(quantity=100, orderType='StopLimit', price=p, stopPx=s),
+                                        client.sell(quantity=100, orderType='Limit', price=q))
+    await client.close()
+
+Market and account data (ticker_data, instrument, position, funds, open_orders, ...) are read from a
+BitMEXWebsocket that is fed the frames from our own connection, so those stay plain methods. Frames
+are applied and read on the event loop thread only, so no locking is needed.
+
+Needs aiohttp, which the threaded bot does not: pip install aiohttp
+"""
+from __future__ import absolute_import
+import asyncio
+import datetime
+import json
+import time
+from bitmex_bot.bitmex import BitMEX
+from bitmex_bot.utils import codec, trace
+from bitmex_bot.utils.ratelimit import CANCEL, NORMAL
+from future.standard_library import hooks
+with hooks():  # Python 2/3 compat
+    from urllib.parse import urlencode
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+
+
+class AsyncBitMEX(BitMEX):
+
+    """asyncio BitMEX API Connector."""
+
+    def __init__(self, *args, **kwargs):
+        """Init connector. Call connect() from the event loop before using it."""
+        if aiohttp is None:
+            raise ImportError("AsyncBitMEX needs aiohttp: pip install aiohttp")
+        self.http = None
+        self.socket = None
+        self.reader = None
+        super(AsyncBitMEX, self).__init__(*args, **kwargs)
+
+    def _connect_ws(self, shouldWSAuth):
+        # The socket is opened by connect(), once we're running on the event loop.
+        self.shouldWSAuth = shouldWSAuth
+
+    async def connect(self, timeout=30):
+        """Open the REST session and the websocket, and wait for the initial table images."""
+        self.http = aiohttp.ClientSession(headers={
+            'user-agent': self.session.headers['user-agent'],
+            'content-type': 'application/json',
+            'accept': 'application/json',
+        })
+        wsURL = self.ws.realtime_url(self.base_url, self.symbols, self.shouldWSAuth)
+        headers = [h.split(':', 1) for h in self.ws.auth_headers(self.apiKey, signer=self.signer)]
+        self.logger.info("Connecting to %s" % wsURL)
+        self.socket = await self.http.ws_connect(wsURL, headers=dict((k.strip(), v.strip()) for k, v in headers),
+                                                 heartbeat=30)
+        self.reader = asyncio.ensure_future(self._read_ws())
+
+        deadline = time.time() + timeout
+        while not self.ws.has_partials():
+            if self.ws.exited or time.time() > deadline:
+                await self.close()
+                raise Exception("Websocket closed or timed out before sending all table images")
+            await asyncio.sleep(0.05)
+        self.logger.info('Got all market data. Starting.')
+
+    async def _read_ws(self):
+        try:
+            async for msg in self.socket:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self.ws.process_message(msg.data)
+                elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+        finally:
+            self.logger.info('Websocket Closed')
+            self.ws.exited = True
+
+    async def close(self):
+        """Close the websocket and the REST session."""
+        self.ws.exited = True
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.socket is not None:
+            await self.socket.close()
+        if self.http is not None:
+            await self.http.close()
+
+    #
+    # Overrides of methods that post-process a REST response
+    #
+    @BitMEX.authentication_required
+    async def http_open_orders(self, symbol=None):
+        """Get open orders via HTTP. Used on close to ensure we catch them all."""
+        orders = await self._curl_bitmex(
+            path="order",
+            query={
+                'filter': json.dumps({'ordStatus.isTerminated': False, 'symbol': symbol or self.symbol}),
+                'count': 500
+            },
+            verb="GET"
+        )
+        # Only return orders that start with our clOrdID prefix.
+        return [o for o in orders if str(o['clOrdID']).startswith(self.orderIDPrefix)]
+
+    async def _acquire_ratelimit(self, priority):
+        # RateLimiter.acquire() would block the event loop, so poll it instead
+        waited = 0
+        wait = self.ratelimit.try_acquire(priority)
+        while wait:
+            await asyncio.sleep(wait)
+            waited += wait
+            wait = self.ratelimit.try_acquire(priority)
+        if waited:
+            self.ratelimit.record_wait(waited)
+
+    async def _curl_bitmex(self, path, query=None, postdict=None, timeout=5, verb=None, rethrow_errors=False,
+                           max_retries=None):
+        """Send a request to BitMEX Servers. Handles errors the same way as BitMEX._curl_bitmex."""
+        # Handle URL
+        url = self.base_url + path
+        if query:
+            url += '?' + urlencode(query)
+
+        # Default to POST if data is attached, GET otherwise
+        if not verb:
+            verb = 'POST' if postdict else 'GET'
+
+        # By default don't retry POST or PUT. Retrying GET/DELETE is okay because they are idempotent.
+        if max_retries is None:
+            max_retries = 0 if verb in ['POST', 'PUT'] else 3
+
+        def exit_or_throw(e):
+            if rethrow_errors:
+                raise e
+            else:
+                exit(1)
+
+        # Retries are counted per call rather than on the client, since many calls can be in flight at once.
+        retries = 0
+        while True:
+            if retries > max_retries:
+                raise Exception("Max retries on %s (%s) hit, raising." % (path, json.dumps(postdict or '')))
+            retries += 1
+
+            started = trace.now() if trace.on else 0
+            # Sign after the ratelimit wait, which can outlast the signature's expiry
+            await self._acquire_ratelimit(CANCEL if verb == 'DELETE' else NORMAL)
+            if trace.on:
+                acquired = trace.now()
+                trace.record('rest.ratelimit', started, acquired)
+            body = codec.dumpb(postdict) if postdict else b''
+            expires = int(round(time.time()) + 5)  # 5s grace period in case of clock skew
+            headers = {
+                'api-expires': str(expires),
+                'api-key': self.apiKey,
+                'api-signature': self.signer.sign_url(verb, url, expires, body),
+            }
+            if trace.on:
+                sent = trace.now()
+                trace.record('rest.sign', acquired, sent)
+            try:
+                self.logger.info("sending req to %s: %s", url, codec.lazy(postdict or query or ''))
+                async with self.http.request(verb, URL(url, encoded=True), data=body or None, headers=headers,
+                                             timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    self.ratelimit.update(response.headers)
+                    content = await response.read()
+                    if trace.on:
+                        trace.record('rest.http', sent)  # includes waiting for the event loop
+                    if response.status < 400:
+                        return codec.loads(content)
+                    text = content.decode('utf8', 'replace')
+                    error = aiohttp.ClientResponseError(response.request_info, response.history,
+                                                        status=response.status, message=text,
+                                                        headers=response.headers)
+            except asyncio.TimeoutError:
+                # Timeout, re-run this request
+                self.logger.warning("Timed out on request: %s (%s), retrying..." % (path, json.dumps(postdict or '')))
+                continue
+            except aiohttp.ClientConnectionError as e:
+                self.logger.warning("Unable to contact the BitMEX API (%s). Please check the URL. Retrying. "
+                                    "Request: %s \n %s" % (e, url, json.dumps(postdict)))
+                await asyncio.sleep(1)
+                continue
+
+            # 401 - Auth error. This is fatal.
+            if error.status == 401:
+                self.logger.error("API Key or Secret incorrect, please check and restart.")
+                self.logger.error("Error: " + text)
+                if postdict:
+                    self.logger.error(postdict)
+                # Always exit, even if rethrow_errors, because this is fatal
+                exit(1)
+
+            # 404, can be thrown if order canceled or does not exist.
+            elif error.status == 404:
+                if verb == 'DELETE':
+                    self.logger.error("Order not found: %s" % postdict['orderID'])
+                    return
+                self.logger.error("Unable to contact the BitMEX API (404). " +
+                                  "Request: %s \n %s" % (url, json.dumps(postdict)))
+                exit_or_throw(error)
+
+            # 429, ratelimit; cancel orders & wait until X-Ratelimit-Reset
+            elif error.status == 429:
+                self.logger.error("Ratelimited on current request. Sleeping, then trying again. Try fewer " +
+                                  "order pairs or contact support@bitmex.com to raise your limits. " +
+                                  "Request: %s \n %s" % (url, json.dumps(postdict)))
+
+                # Figure out how long we need to wait.
+                ratelimit_reset = error.headers['X-Ratelimit-Reset']
+                to_sleep = int(ratelimit_reset) - int(time.time())
+                reset_str = datetime.datetime.fromtimestamp(int(ratelimit_reset)).strftime('%X')
+
+                # We're ratelimited, and we may be waiting for a long time. Cancel orders, on every symbol.
+                orderIDs = [o['orderID'] for symbol in self.symbols for o in self.open_orders(symbol)]
+                if orderIDs and verb != 'DELETE':
+                    self.logger.warning("Canceling all known orders in the meantime.")
+                    await self.cancel(orderIDs)
+
+                self.logger.error("Your ratelimit will reset at %s. Sleeping for %d seconds." % (reset_str, to_sleep))
+                self.ratelimit.hold(int(ratelimit_reset))
+                continue
+
+            # 503 - BitMEX temporary downtime, likely due to a deploy. Try again
+            elif error.status == 503:
+                self.logger.warning("Unable to contact the BitMEX API (503), retrying. " +
+                                    "Request: %s \n %s" % (url, json.dumps(postdict)))
+                await asyncio.sleep(3)
+                continue
+
+            elif error.status == 400:
+                error_body = json.loads(text)['error']
+                message = error_body['message'].lower() if error_body else ''
+
+                # Duplicate clOrdID: that's fine, probably a deploy, go get the order(s) and return it
+                if 'duplicate clordid' in message:
+                    orders = postdict['orders'] if 'orders' in postdict else [postdict]
+                    IDs = json.dumps({'clOrdID': [order['clOrdID'] for order in orders]})
+                    return await self._curl_bitmex('order', query={'filter': IDs}, verb='GET')
+
+                elif 'insufficient available balance' in message:
+                    self.logger.error('Account out of funds. The message: %s' % error_body['message'])
+                    exit_or_throw(Exception('Insufficient Funds'))
+
+            # If we haven't returned or re-raised yet, we get here.
+            self.logger.error("Unhandled Error: %s: %s" % (error, text))
+            self.logger.error("Endpoint was: %s %s: %s" % (verb, path, json.dumps(postdict)))
+            exit_or_throw(error)
@@ -1,15 +1,21 @@
 from __future__ import absolute_import
 
+import copy
 import threading
-from time import sleep
+import traceback
+from time import sleep, time
 import sys
 from datetime import datetime
 from os.path import getmtime
 import atexit
 import signal
+import numpy as np
 from bitmex_bot import bitmex, indicators
+from bitmex_bot.candles import CandleAggregator, NS_PER_SECOND, bar_event
+from bitmex_bot.capture import CaptureWriter
 from bitmex_bot.settings import settings
-from bitmex_bot.utils import log, constants, errors
+from bitmex_bot.utils import log, constants, errors, trace
+from bitmex_bot.utils.transport import new_session, prewarm
 from bitmex_bot.bitmex_historical import Bitmex
 
 from bitmex_bot.bot_trade import BOT_TRADE
@@ -26,12 +32,47 @@ logger = log.setup_custom_logger('root')
 
 
 class ExchangeInterface:
-    def __init__(self, dry_run=False):
+    def __init__(self, dry_run=False, client=None, historical=None, clock=None):
+        """Connect to BitMEX, or wrap the given `client` (a BitMEX-like connector, e.g. replay.ReplayBitMEX).
+
+        `historical` is where the candles are seeded from (bitmex_historical.Bitmex by default), and
+        `clock` returns the current time in seconds (time.time by default).
+
+        All the symbols of the connector share its websocket and REST session. Methods act on `symbol`, the
+        first of them; for_symbol() gives a view of the interface that acts on another one.
+        """
         self.dry_run = dry_run
+        self.clock = clock or time
+        if client is not None:
+            self.symbols = list(getattr(client, 'symbols', [client.symbol]))
+            self.mode = settings.MODE
+            self.bitmex = client
+        else:
+            self.__connect()
+            historical = historical or Bitmex(capture=self.bitmex.capture)
+        self.symbol = self.symbols[0]
+
+        # Build bars from the trade stream so signals don't need a REST round trip every loop.
+        # Seed from history once, catch up on trades the websocket already holds, then follow it.
+        self.candles_by_symbol = {}
+        trades = self.bitmex.recent_trades()
+        for symbol in self.symbols:
+            candles = CandleAggregator(symbol, settings.CANDLE_BIN_SIZES, settings.CANDLE_HISTORY,
+                                       events=self.bitmex.ws.events, trades=self.bitmex.trade_columns(symbol))
+            if historical is not None:
+                candles.seed(historical)
+            candles.on_trades('trade', 'insert', trades)
+            self.bitmex.ws.add_listener('trade', candles.on_trades)
+            self.candles_by_symbol[symbol] = candles
+        self.candles = self.candles_by_symbol[self.symbol]
+
+    def __connect(self):
         if len(sys.argv) > 1:
-            self.symbol = sys.argv[1]
+            self.symbols = [sys.argv[1]]
+        elif settings.TRADE_CONTRACTS:
+            self.symbols = list(settings.CONTRACTS)
         else:
-            self.symbol = settings.SYMBOL
+            self.symbols = [settings.SYMBOL]
 
         url = settings.BASE_URL_TESTING
 
@@ -41,9 +82,22 @@ class ExchangeInterface:
         if self.mode == "LIVE":
             url = settings.BASE_URL_LIVE
 
-        self.bitmex = bitmex.BitMEX(base_url=url, symbol=self.symbol,
+        self.bitmex = bitmex.BitMEX(base_url=url, symbol=self.symbols,
                                     apiKey=settings.API_KEY, apiSecret=settings.API_SECRET,
-                                    orderIDPrefix=settings.ORDERID_PREFIX)
+                                    orderIDPrefix=settings.ORDERID_PREFIX,
+                                    ratelimitReserve=settings.API_RATELIMIT_RESERVE,
+                                    session=new_session(pool_size=settings.HTTP_POOL_SIZE,
+                                                        retries=settings.HTTP_RETRIES),
+                                    capture=CaptureWriter(settings.CAPTURE_FILE) if settings.CAPTURE_FILE else None)
+        if settings.HTTP_PREWARM:
+            prewarm(self.bitmex.session, url)
+
+    def for_symbol(self, symbol):
+        """A view of this interface acting on `symbol`, sharing its connections, events and candles."""
+        view = copy.copy(self)
+        view.symbol = symbol
+        view.candles = self.candles_by_symbol[symbol]
+        return view
 
     def cancel_order(self, order):
         tickLog = self.get_instrument()['tickLog']
@@ -51,7 +105,6 @@ class ExchangeInterface:
         while True:
             try:
                 self.bitmex.cancel(order['orderID'])
-                sleep(settings.API_REST_INTERVAL)
             except ValueError as e:
                 logger.info(e)
                 sleep(settings.API_ERROR_INTERVAL)
@@ -62,7 +115,7 @@ class ExchangeInterface:
         logger.info("Resetting current position. Canceling all existing orders.")
         tickLog = self.get_instrument()['tickLog']
 
-        orders_1 = self.bitmex.http_open_orders()
+        orders_1 = self.bitmex.http_open_orders(self.symbol)
 
         for order in orders_1:
             logger.info("Canceling: %s %d @ %.*f" % (order['side'], order['orderQty'], tickLog, order['price']))
@@ -70,8 +123,6 @@ class ExchangeInterface:
         if len(orders_1):
             self.bitmex.cancel([order['orderID'] for order in orders_1])
 
-        sleep(settings.API_REST_INTERVAL)
-
     def get_portfolio(self):
         contracts = settings.CONTRACTS
         portfolio = {}
@@ -143,7 +194,10 @@ class ExchangeInterface:
         return self.bitmex.funds()
 
     def get_orders(self):
-        return self.bitmex.open_orders()
+        return self.bitmex.open_orders(self.symbol)
+
+    def get_executions(self):
+        return self.bitmex.executions(self.symbol)
 
     def set_isolate_margin(self):
         self.bitmex.isolate_margin(self.symbol)
@@ -172,8 +226,34 @@ class ExchangeInterface:
             symbol = self.symbol
         return self.bitmex.ticker_data(symbol)
 
+    def get_order_book(self, symbol=None):
+        """The live L2 order book (ws.orderbook.OrderBookL2); raises errors.BookNotSubscribedError if not subscribed."""
+        if symbol is None:
+            symbol = self.symbol
+        return self.bitmex.market_depth(symbol)
+
+    def get_bars(self, tick):
+        """Completed bars of size `tick` as NumPy columns, or None if we don't build that size."""
+        if tick not in self.candles.series:
+            return None
+        return self.candles.series[tick].bars
+
     def close_position(self):
-        return self.bitmex.close_position()
+        return self.bitmex.close_position(self.symbol)
+
+    def get_ratelimit_stats(self):
+        return self.bitmex.ratelimit.stats()
+
+    def get_http_stats(self):
+        return self.bitmex.session.get_adapter(self.bitmex.base_url).stats()
+
+    def event_versions(self, events):
+        """Current versions of the named websocket/bar events, to pass to wait_for_update."""
+        return self.bitmex.ws.events.versions(events)
+
+    def wait_for_update(self, since, timeout):
+        """Block until one of the events in `since` fires, or timeout. Returns (changed, versions)."""
+        return self.bitmex.ws.events.wait(since, timeout)
 
     def is_open(self):
         """Check that websockets are still open."""
@@ -195,16 +275,34 @@ class ExchangeInterface:
         return self.bitmex.amend_bulk_orders(orders)
 
     def create_bulk_orders(self, orders):
-        return self.bitmex.create_bulk_orders(orders)
+        return self.bitmex.create_bulk_orders(orders, self.symbol)
 
     def cancel_bulk_orders(self, orders):
         return self.bitmex.cancel([order['orderID'] for order in orders])
 
+    def place_bracket(self, side, quantity, stop_price=None, profit_price=None):
+        """Place the stop loss and take profit legs that close a position, in one order/bulk request.
+
+        `side` is the side of the closing orders, i.e. 'sell' to protect a long position.
+        """
+        if side == 'sell':
+            quantity = -quantity
+        orders = []
+        if stop_price is not None:
+            orders.append({'ordType': 'StopLimit', 'orderQty': quantity, 'price': int(stop_price),
+                           'stopPx': int(stop_price) - 5.0})
+        if profit_price is not None:
+            orders.append({'ordType': 'Limit', 'orderQty': quantity, 'price': int(profit_price)})
+        if not orders:
+            return []
+        return self.create_bulk_orders(orders)
+
     def place_order(self, **kwargs):
         """
         :param kwargs:
         :return:
         """
+        kwargs.setdefault('symbol', self.symbol)
         if kwargs['side'] == 'buy':
             kwargs.pop('side')
             return self.bitmex.buy(**kwargs)
@@ -214,19 +312,19 @@ class ExchangeInterface:
             return self.bitmex.sell(**kwargs)
 
 
-class OrderManager:
+class SymbolStrategy:
+    """The MACD strategy and its trade state for one symbol, acting through an ExchangeInterface view of it."""
     UP = "up"
     DOWN = "down"
     SELL = "sell"
     BUY = "buy"
+    # Seconds to hold off entering again after closing a trade on a reversal
+    REVERSAL_COOLDOWN = 5
 
-    def __init__(self):
-        self.exchange = ExchangeInterface()
-        atexit.register(self.exit)
-        signal.signal(signal.SIGTERM, self.exit)
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.symbol = exchange.symbol
         self.current_bitmex_price = 0
-        logger.info("-------------------------------------------------------------")
-        logger.info("Starting Bot......")
         self.macd_signal = False
         self.current_ask_price = 0
         self.current_bid_price = 0
@@ -241,50 +339,54 @@ class OrderManager:
         self.stop_price = 0
         self.profit_price = 0
         self.trade_signal = False
-        logger.info("Using symbol %s." % self.exchange.symbol)
+        # Whether the websocket has shown the position of our last entry yet; until it has, a flat position
+        # and no orders only mean it hasn't caught up with our REST calls, not that the trade is over.
+        self.position_seen = False
+        # orderIDs of the stop loss and take profit of the current trade; one of them filling ends the trade
+        self.bracket_ids = set()
+        # No new entries before this time (exchange clock); set when a reversal closes a trade
+        self.cooldown_until = 0
+        # MACD over completed bars, fed one close at a time as bars complete
+        self.macd = indicators.StreamingMACD(settings.MACD_FAST or 12, settings.MACD_SLOW or 26,
+                                             settings.MACD_SIGNAL or 9, method=settings.MACD_EMA_METHOD or 'recursive')
+        self.heikin_ashi = indicators.StreamingHeikinAshi() if settings.MACD_HEIKIN_ASHI else None
+        self.macd_bar_end = None
 
     def init(self):
-        if settings.DRY_RUN:
-            logger.info("Initializing dry run. Orders printed below represent what would be posted to BitMEX.")
-        else:
-            logger.info("Order Manager initializing, connecting to BitMEX. Live run: executing real trades.")
-        self.start_time = datetime.now()
         self.instrument = self.exchange.get_instrument()
         self.starting_qty1 = self.exchange.get_delta()
         self.running_qty = self.starting_qty1
-        self.reset()
-        # set cross margin for the trade
-        self.exchange.set_isolate_margin()
-
-    # self.place_orders()
-
-    def reset(self):
-        self.exchange.cancel_all_orders()
-        self.sanity_check()
-        self.print_status()
-        if settings.DRY_RUN:
-            sys.exit()
 
     def print_status(self):
-        """Print the current MM status."""
-        margin1 = self.exchange.get_margin()
         self.running_qty = self.exchange.get_delta()
-        self.start_XBt = margin1["marginBalance"]
-        logger.info("Current XBT Balance : %.6f" % XBt_to_XBT(self.start_XBt))
-        logger.info("Contracts Traded This Run by BOT: %d" % (self.running_qty - self.starting_qty1))
-        logger.info("Total Contract Delta: %.4f XBT" % self.exchange.calc_delta()['spot'])
+        logger.info("%s: Contracts Traded This Run by BOT: %d" % (self.symbol, self.running_qty - self.starting_qty1))
+
+    def wake_events(self):
+        """A new bar of our symbol for the MACD."""
+        return [bar_event(self.symbol, settings.TICK_INTERVAL)]
 
     def macd_check(self):
         # print("yes macd")
         # as latest price is last one
         up_vote = 0
         down_vote = 0
-        data = Bitmex().get_historical_data(tick=settings.TICK_INTERVAL)
-
-        if data:
-            price_list = list(map(lambda i: i['close'], data))
-            data = indicators.macd(price_list)
-            status = data[-1]
+        started = trace.now() if trace.on else 0
+        self.exchange.candles.roll(int(self.exchange.clock() * NS_PER_SECOND))
+        bars = self.exchange.get_bars(settings.TICK_INTERVAL)
+
+        if bars is not None:
+            count = len(bars)
+            timestamps = bars.column('timestamp', count)
+            if not self.macd.ready:
+                self.macd.warmup(self.macd_input(bars, count))
+            else:
+                # Only bars that completed since we last looked need to go through the indicator
+                new = np.count_nonzero(timestamps > self.macd_bar_end)
+                for close in self.macd_input(bars, new, streaming=True):
+                    self.macd.update(close)
+            if count:
+                self.macd_bar_end = timestamps[-1]
+            status = self.macd.value or 0
             if status > 0:
                 up_vote += 1
                 self.macd_signal = self.UP
@@ -293,9 +395,20 @@ class OrderManager:
                 self.macd_signal = self.DOWN
             else:
                 self.macd_signal = False
+            if trace.on:
+                trace.record('bot.indicator', started)
         else:
             logger.error("Tick interval not supported")
 
+    def macd_input(self, bars, count, streaming=False):
+        """Prices the MACD runs on for the newest `count` bars: closes, or Heikin-Ashi closes."""
+        columns = [bars.column(name, count) for name in ('open', 'high', 'low', 'close')]
+        if self.heikin_ashi is None:
+            return columns[3]
+        if not streaming:
+            return self.heikin_ashi.warmup(*columns)[3]
+        return [self.heikin_ashi.update(*bar)[3] for bar in zip(*columns)]
+
     def get_ticker(self):
         ticker = self.exchange.get_ticker()
         return ticker
@@ -308,6 +421,54 @@ class OrderManager:
         """Create order items for use in convergence."""
         return self.exchange.place_order(**kwargs)
 
+    def enter_trade(self, side):
+        """Enter at market, then protect the position straight away.
+
+        The stop loss and take profit go out together in one request as soon as the fill price is known,
+        so the position is unprotected for one round trip rather than one per order plus fixed sleeps.
+        """
+        if trace.on:
+            trace.since('bot.trade_to_entry', 'trade')
+        self.log_expected_fill(side)
+        order = self.place_orders(side=side, orderType='Market', quantity=self.amount)
+        if trace.on:
+            trace.since('bot.trade_to_order', 'trade')
+        self.trade_signal = self.macd_signal
+        self.initial_order = True
+        self.position_seen = False
+        direction = 1 if side == self.BUY else -1
+        # A market order's price is not what it filled at; avgPx is
+        price = order.get('avgPx') or order['price']
+        if settings.STOP_PROFIT_FACTOR != "":
+            self.profit_price = price + direction * (price * settings.STOP_PROFIT_FACTOR)
+        if settings.STOP_LOSS_FACTOR != "":
+            self.stop_price = price - direction * (price * settings.STOP_LOSS_FACTOR)
+        print("Order price {} \tStop Price {} \tProfit Price {} ".
+              format(price, self.stop_price, self.profit_price))
+        bracket = self.exchange.place_bracket(
+            self.SELL if side == self.BUY else self.BUY, self.amount,
+            stop_price=self.stop_price if settings.STOP_LOSS_FACTOR != "" else None,
+            profit_price=self.profit_price if settings.STOP_PROFIT_FACTOR != "" else None)
+        self.bracket_ids = set(order['orderID'] for order in bracket or [])
+        self.close_order = True
+
+    def log_expected_fill(self, side):
+        """Log what a market order of our size should fill at, walking the order book, before we send it."""
+        try:
+            book = self.exchange.get_order_book()
+        except errors.BookNotSubscribedError:
+            return
+        price, touch, filled = book.slippage('Buy' if side == self.BUY else 'Sell', self.amount)
+        if price is None:
+            logger.warning("{} order book is empty; the market {} goes in blind".format(self.symbol, side))
+            return
+        slippage = (price - touch) if side == self.BUY else (touch - price)
+        logger.info("Expected market {} fill for {} {}: {:.2f} average, {:.2f} ({:.1f} bps) through the touch at {}".
+                    format(side, self.amount, self.symbol, price, slippage, slippage / touch * 1e4, touch))
+        if filled < self.amount:
+            logger.warning("Only {} of {} contracts are within the order book we hold; expect worse".
+                           format(filled, self.amount))
+
     ###
     # Position Limits
     ###
@@ -351,106 +512,154 @@ class OrderManager:
         self.exchange.check_market_open()
         self.get_exchange_price()
         # print(self.exchange.get_orders())
-        logger.info("current BITMEX price is {}".format(self.last_price))
+        logger.info("current BITMEX {} price is {}".format(self.symbol, self.last_price))
         # self.get_exchange_price()
 
-        logger.info("Current Price is {} MACD signal {}".format(self.last_price, self.macd_signal))
+        logger.info("Current {} Price is {} MACD signal {}".format(self.symbol, self.last_price, self.macd_signal))
+        if self.exchange.clock() < self.cooldown_until:
+            return  # let the close and cancels of the last trade settle; the other symbols carry on meanwhile
         if not self.is_trade:
             if self.macd_signal:
                 if self.macd_signal == self.UP:
-                    logger.info("Buy Trade Signal {}".format(self.last_price))
+                    logger.info("{} Buy Trade Signal {}".format(self.symbol, self.last_price))
                     logger.info("-----------------------------------------")
                     self.is_trade = True
                     self.sequence = self.BUY
 
                     if not self.initial_order:
-                        order = self.place_orders(side=self.BUY, orderType='Market', quantity=self.amount)
-                        self.trade_signal = self.macd_signal
-                        self.initial_order = True
-                        if settings.STOP_PROFIT_FACTOR != "":
-                            self.profit_price = order['price'] + (order['price'] * settings.STOP_PROFIT_FACTOR)
-                        if settings.STOP_LOSS_FACTOR != "":
-                            self.stop_price = order['price'] - (order['price'] * settings.STOP_LOSS_FACTOR)
-                        print("Order price {} \tStop Price {} \tProfit Price {} ".
-                              format(order['price'], self.stop_price, self.profit_price))
-                        sleep(settings.API_REST_INTERVAL)
-                        if settings.STOP_LOSS_FACTOR != "":
-                            self.place_orders(side=self.SELL, orderType='StopLimit', quantity=self.amount,
-                                              price=int(self.stop_price), stopPx=int(self.stop_price) - 5.0)
-                            sleep(settings.API_REST_INTERVAL)
-                        if settings.STOP_PROFIT_FACTOR != "":
-                            self.place_orders(side=self.SELL, orderType='Limit', quantity=self.amount,
-                                              price=int(self.profit_price))
-                            sleep(settings.API_REST_INTERVAL)
-                        self.close_order = True
+                        self.enter_trade(self.BUY)
 
                 elif self.macd_signal == self.DOWN:
-                    logger.info("Sell Trade Signal {}".format(self.last_price))
+                    logger.info("{} Sell Trade Signal {}".format(self.symbol, self.last_price))
                     logger.info("-----------------------------------------")
                     self.is_trade = True
                     self.sequence = self.SELL
                     # place order
                     if not self.initial_order:
-                        order = self.place_orders(side=self.SELL, orderType='Market', quantity=self.amount)
-                        self.trade_signal = self.macd_signal
-                        self.initial_order = True
-                        if settings.STOP_PROFIT_FACTOR != "":
-                            self.profit_price = order['price'] - (order['price'] * settings.STOP_PROFIT_FACTOR)
-                        if settings.STOP_LOSS_FACTOR != "":
-                            self.stop_price = order['price'] + (order['price'] * settings.STOP_LOSS_FACTOR)
-
-                        print("Order price {} \tStop Price {} \tProfit Price {} ".
-                              format(order['price'], self.stop_price, self.profit_price))
-                        sleep(settings.API_REST_INTERVAL)
-                        if settings.STOP_LOSS_FACTOR != "":
-                            self.place_orders(side=self.BUY, orderType='StopLimit', quantity=self.amount,
-                                              price=int(self.stop_price), stopPx=int(self.stop_price) - 5.0)
-                            sleep(settings.API_REST_INTERVAL)
-                        if settings.STOP_PROFIT_FACTOR != "":
-                            self.place_orders(side=self.BUY, orderType='Limit', quantity=self.amount,
-                                              price=int(self.profit_price))
-                            sleep(settings.API_REST_INTERVAL)
-                        self.close_order = True
+                        self.enter_trade(self.SELL)
                         # set cross margin for the trade
 
         else:
-            if self.macd_signal and self.macd_signal != self.trade_signal and self.trade_signal:
+            if self.close_order and not self.position_seen:
+                self.position_seen = self.exchange.get_position() != 0
+
+            if self.close_order and self.bracket_filled():
+                # The stop loss or take profit closed the position, maybe between two checks: drop the other leg
+                logger.info("{} trade closed by its stop loss or take profit".format(self.symbol))
+                self.exchange.cancel_all_orders()
+                self.reset_trade()
+
+            elif self.macd_signal and self.macd_signal != self.trade_signal and self.trade_signal:
                 # TODO close all positions on market price immediately and cancel ALL open orders(including stops).
-                self.exchange.close_position()
+                if self.exchange.get_position() != 0:
+                    self.exchange.close_position()
                 # sleep(settings.API_REST_INTERVAL)
                 self.exchange.cancel_all_orders()
-                self.is_trade = False
-                self.close_order = False
-                self.initial_order = False
-                self.sequence = ""
-                self.profit_price = 0
-                self.stop_price = 0
-                self.trade_signal = False
-                sleep(5)
-
-            elif self.close_order and self.exchange.get_position() == 0 and len(self.exchange.get_orders()) == 0:
-                self.is_trade = False
-                self.close_order = False
-                self.initial_order = False
-                self.sequence = ""
-                self.profit_price = 0
-                self.stop_price = 0
-                self.trade_signal = False
-            else:
+                self.reset_trade()
+                self.cooldown_until = self.exchange.clock() + self.REVERSAL_COOLDOWN
+
+            elif self.close_order and self.position_seen and self.exchange.get_position() == 0 and \
+                    len(self.exchange.get_orders()) == 0:
+                self.reset_trade()
+            elif self.position_seen:
                 data = self.exchange.get_orders()
                 if len(data) == 1:
                     if data[0]['ordType'] == "StopLimit" and data[0]['ordStatus'] == 'New':
                         if data[0]['triggered'] == "":
                             self.exchange.cancel_all_orders()
-                            self.is_trade = False
-                            self.close_order = False
-                            self.initial_order = False
-                            self.sequence = ""
-                            self.profit_price = 0
-                            self.stop_price = 0
-                            self.trade_signal = False
+                            self.reset_trade()
+
+    def bracket_filled(self):
+        """Whether an execution shows one of the current trade's stop loss and take profit orders filled."""
+        if not self.bracket_ids:
+            return False
+        return any(e['orderID'] in self.bracket_ids and e['ordStatus'] == 'Filled'
+                   for e in self.exchange.get_executions())
+
+    def reset_trade(self):
+        """Forget the current trade, so the next signal can enter a new one."""
+        self.is_trade = False
+        self.close_order = False
+        self.initial_order = False
+        self.position_seen = False
+        self.bracket_ids = set()
+        self.sequence = ""
+        self.profit_price = 0
+        self.stop_price = 0
+        self.trade_signal = False
+
+
+class OrderManager:
+    """Runs a SymbolStrategy for every symbol of the exchange, over its one websocket and REST session."""
+
+    def __init__(self, exchange=None):
+        self.exchange = exchange or ExchangeInterface()
+        atexit.register(self.exit)
+        signal.signal(signal.SIGTERM, self.exit)
+        logger.info("-------------------------------------------------------------")
+        logger.info("Starting Bot......")
+        self.strategies = [SymbolStrategy(self.exchange.for_symbol(symbol)) for symbol in self.exchange.symbols]
+        logger.info("Using symbol %s." % ', '.join(self.exchange.symbols))
+        if settings.TRACE:
+            trace.enable(settings.TRACE_INTERVAL)
+
+    def init(self):
+        if settings.DRY_RUN:
+            logger.info("Initializing dry run. Orders printed below represent what would be posted to BitMEX.")
+        else:
+            logger.info("Order Manager initializing, connecting to BitMEX. Live run: executing real trades.")
+        self.start_time = datetime.now()
+        for strategy in self.strategies:
+            strategy.init()
+        self.reset()
+        # set cross margin for the trade
+        for strategy in self.strategies:
+            strategy.exchange.set_isolate_margin()
 
+    # self.place_orders()
 
+    def reset(self):
+        for strategy in self.strategies:
+            strategy.exchange.cancel_all_orders()
+        self.sanity_check()
+        self.print_status()
+        if settings.DRY_RUN:
+            sys.exit()
+
+    def print_status(self):
+        """Print the current MM status."""
+        margin1 = self.exchange.get_margin()
+        self.start_XBt = margin1["marginBalance"]
+        logger.info("Current XBT Balance : %.6f" % XBt_to_XBT(self.start_XBt))
+        for strategy in self.strategies:
+            strategy.print_status()
+        logger.info("Total Contract Delta: %.4f XBT" % self.exchange.calc_delta()['spot'])
+        ratelimit = self.exchange.get_ratelimit_stats()
+        logger.info("REST ratelimit: %d/%d left, %d of %d requests deferred for %.1fs in total" %
+                    (ratelimit['tokens'], ratelimit['limit'], ratelimit['deferred'], ratelimit['requests'],
+                     ratelimit['waited']))
+        http = self.exchange.get_http_stats()
+        if http['requests']:
+            logger.info("REST: %d requests on %d new connections; connect %.1fms, TLS %.1fms in total, "
+                        "first byte %.1fms on average" %
+                        (http['requests'], http['connections'], http['connect'] * 1000, http['tls'] * 1000,
+                         http['ttfb'] * 1000 / http['requests']))
+
+    def sanity_check(self):
+        """Perform checks before placing orders, for every symbol. One symbol failing doesn't stop the others."""
+        for strategy in self.strategies:
+            if trace.on:
+                trace.since('bot.trade_to_check', 'trade')
+                started = trace.now()
+            try:
+                strategy.sanity_check()
+            except (errors.MarketClosedError, errors.MarketEmptyError) as e:
+                logger.warning("{}: {}".format(strategy.symbol, e))
+            except Exception:
+                logger.error("{}: check failed, carrying on with the other symbols:\n{}".
+                             format(strategy.symbol, traceback.format_exc()))
+            if trace.on:
+                trace.record('bot.check', started)
 
     ###
     # Running
@@ -469,22 +678,33 @@ class OrderManager:
     def exit(self):
         logger.info("Shutting down. All open orders will be cancelled.")
         try:
-            self.exchange.cancel_all_orders()
+            for strategy in self.strategies:
+                strategy.exchange.cancel_all_orders()
             self.exchange.bitmex.exit()
         except errors.AuthenticationError as e:
             logger.info("Was not authenticated; could not cancel orders.")
         except Exception as e:
             logger.info("Unable to cancel orders: %s" % e)
+        if trace.on:
+            trace.dump()
 
         sys.exit()
 
+    def wake_events(self):
+        """Events that can change a trading decision: our orders, fills, position, and a new bar for a MACD."""
+        events = ['order', 'execution', 'position']
+        for strategy in self.strategies:
+            events.extend(strategy.wake_events())
+        return events
+
     def run_loop(self):
+        # Re-evaluate as soon as something we act on changes, and at least every LOOP_INTERVAL regardless.
+        since = self.exchange.event_versions(self.wake_events())
+        last_status = 0
         while True:
-            sys.stdout.write("-----\n")
-            sys.stdout.flush()
+            changed, since = self.exchange.wait_for_update(since, settings.LOOP_INTERVAL)
 
             self.check_file_change()
-            sleep(settings.LOOP_INTERVAL)
 
             # This will restart on very short downtime, but if it's longer,
             # the MM will crash entirely as it is unable to connect to the WS on boot.
@@ -493,7 +713,12 @@ class OrderManager:
                 self.restart()
 
             self.sanity_check()  # Ensures health of mm - several cut-out points here
-            self.print_status()  # Print skew, delta, etc
+
+            if time() - last_status >= settings.LOOP_INTERVAL:
+                sys.stdout.write("-----\n")
+                sys.stdout.flush()
+                self.print_status()  # Print skew, delta, etc
+                last_status = time()
 
     def restart(self):
         logger.info("Restarting the bitmex bot...")
@@ -1,49 +1,83 @@
+import time
+import logging
 import requests
 import json
-import settings as s
+import numpy as np
+from bitmex_bot.settings import settings as s
+from bitmex_bot.candles import BIN_SECONDS, NS_PER_SECOND
+from bitmex_bot.candle_cache import CandleCache, CANDLE_DTYPE
+from bitmex_bot.ws.columns import parse_timestamps
+from bitmex_bot.utils.transport import new_session
 
 
 class Bitmex(object):
 
-    def __init__(self):
-        self.trade_currency = "XBT"
+    # Most bars BitMEX returns from one trade/bucketed request.
+    MAX_COUNT = 1000
+
+    def __init__(self, cache_dir=None, base_url=None, symbol=None, session=None, capture=None):
+        self.logger = logging.getLogger('root')
+        self.trade_currency = symbol or "XBT"
         self.ask_price = 0
         self.bid_price = 0
         self.order_id_prefix = "lee_bot"
         self.symbol = s.SYMBOL
-        self.BASE_URL = "https://www.bitmex.com/api/v1/"
+        self.BASE_URL = base_url or "https://www.bitmex.com/api/v1/"
+        self.cache_dir = cache_dir or s.CANDLE_CACHE_DIR
+        # Keep-alive session, so paging through history reuses one connection
+        self.session = session or new_session(pool_size=s.HTTP_POOL_SIZE or 10, retries=s.HTTP_RETRIES or 0)
+        # Optional capture.CaptureWriter; the bars we hand out are recorded for replay
+        self.capture = capture
 
-    def get_historical_data(self, tick='1m', count=400):
-        # last one hour data with latest one in the end
+    def get_historical_data(self, tick='1m', count=400, symbol=None):
+        """Return the last `count` completed bars of `symbol` as a CANDLE_DTYPE array, latest one in the end.
 
-        url = self.BASE_URL + "trade/bucketed?binSize={}&partial=false&symbol={}&count={}&reverse=true". \
-            format(tick, self.trade_currency, count)
-        r = json.loads(requests.get(url).text)
+        Bars are kept in a local cache, so only bars newer than the last cached one are downloaded.
+        Returns None if nothing could be fetched and nothing is cached.
+        """
+        symbol = symbol or self.trade_currency
+        cache = CandleCache(self.cache_dir, symbol, tick)
+        width = BIN_SECONDS[tick] * NS_PER_SECOND
+        now = int(time.time() * NS_PER_SECOND)
+        latest = now - now % width  # end of the newest bar that can be complete
+        last = cache.last_timestamp()
 
-        lst = []
-        # configure result into suitable data type
         try:
-            dict_key = ["open", "close", "high", "low", "timestamp"]
-            for item in r:
-                d = {
-                    dict_key[0]: item[dict_key[0]],
-                    dict_key[1]: item[dict_key[1]],
-                    dict_key[2]: item[dict_key[2]],
-                    dict_key[3]: item[dict_key[3]],
-                    dict_key[4]: item[dict_key[4]]
-                }
-                lst.append(d)
-            return lst[::-1]
-        except KeyError as e:
-            pass
-        except TypeError as e:
-            pass
-        except Exception as e:
-            pass
-
-# b = Bitmex()
-# b.get_price()
-# # print(b.ask_price, b.bid_price)
-# b.place_order(price=b.bid_price, side='Buy', orderQty=100, type="Market")
-# # b.cancel_all_order()
-# print(b.get_historical_data())
+            if last is None or (latest - last) // width > count:
+                # Nothing cached, or too far behind to be worth topping up: start over from the newest bars.
+                cache.reset(self.get_bucketed(tick, count=count, reverse=True, symbol=symbol)[::-1])
+            else:
+                # Page forward from the last cached bar until we're caught up.
+                while last < latest:
+                    bars = self.get_bucketed(tick, count=self.MAX_COUNT, startTime=last + width, symbol=symbol)
+                    if not cache.append(bars):
+                        break
+                    last = cache.last_timestamp()
+        except (requests.exceptions.RequestException, KeyError, TypeError, ValueError) as e:
+            self.logger.warning("Unable to update %s %s candles: %s" % (symbol, tick, e))
+
+        data = cache.load(count)
+        if self.capture is not None:
+            self.capture.write_candles(tick, data, symbol)
+        return data if len(data) else None
+
+    def get_bucketed(self, tick, count=MAX_COUNT, startTime=None, reverse=False, timeout=10, symbol=None):
+        """One trade/bucketed request, returned as a CANDLE_DTYPE array in the order BitMEX sent it."""
+        url = self.BASE_URL + "trade/bucketed?binSize={}&partial=false&symbol={}&count={}&reverse={}". \
+            format(tick, symbol or self.trade_currency, count, 'true' if reverse else 'false')
+        if startTime is not None:
+            url += "&startTime={}".format(np.datetime64(startTime, 'ns').astype('datetime64[ms]'))
+        response = self.session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return to_candles(json.loads(response.text))
+
+
+def to_candles(rows):
+    """Turn trade/bucketed rows into a CANDLE_DTYPE array."""
+    bars = np.zeros(len(rows), dtype=CANDLE_DTYPE)
+    if len(rows):
+        bars['timestamp'] = parse_timestamps([row['timestamp'] for row in rows])
+        for field in ('open', 'high', 'low', 'close'):
+            bars[field] = [row[field] for row in rows]
+        bars['volume'] = [row['volume'] or 0 for row in rows]
+    return bars
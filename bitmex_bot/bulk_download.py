@@ -0,0 +1,198 @@
+"""Bulk download of deep candle history into a columnar on-disk store.
+
+A store is a directory holding one .npy file per candle column (see candles.CANDLE_COLUMNS), laid out
+on a fixed time grid: row i is the bar ending at start + i * binSize. Bars BitMEX has no data for keep
+a timestamp of 0. The files can be memory mapped, so backtests can read months of 1m bars without
+loading or copying them.
+
+Pages of up to Bitmex.MAX_COUNT bars are fetched concurrently, within a requests-per-minute budget.
+Each page is marked done in pages.npy once its bars are on disk, so an interrupted download picks up
+where it left off when run again with the same arguments.
+
+    python -m bitmex_bot.bulk_download XBTUSD 1m 2018-01-01 2018-04-01 --dir history
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import requests
+from bitmex_bot.bitmex_historical import Bitmex
+from bitmex_bot.candles import CANDLE_COLUMNS, BIN_SECONDS, NS_PER_SECOND
+from bitmex_bot.utils.transport import new_session
+
+logger = logging.getLogger('root')
+
+
+class RateBudget(object):
+    """Spaces out request starts so that no more than `per_minute` begin in any minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60. / per_minute
+        self.lock = threading.Lock()
+        self.next_start = 0.
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def backoff(self, seconds):
+        """Hold every request back for `seconds`, e.g. after being ratelimited."""
+        with self.lock:
+            self.next_start = max(self.next_start, time.time() + seconds)
+
+
+def store_path(directory, symbol, binSize):
+    return os.path.join(directory, "%s-%s" % (symbol, binSize))
+
+
+def load_candles(path, mmap_mode='r'):
+    """Open a store written by BulkDownloader. Returns a dict of column name -> array of the bars we have.
+
+    With mmap_mode set, the full-grid columns are memory mapped and only the rows that are present are
+    read. Pass mmap_mode=None to get the raw grid (including missing rows) loaded into memory instead.
+    """
+    columns = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+                   for name, dtype in CANDLE_COLUMNS)
+    if mmap_mode is None:
+        return columns
+    present = np.flatnonzero(columns['timestamp'])
+    if len(present) and present[-1] - present[0] + 1 == len(present):
+        # No holes: hand back slices of the maps rather than copies
+        return dict((name, column[present[0]:present[-1] + 1]) for name, column in columns.items())
+    return dict((name, column[present]) for name, column in columns.items())
+
+
+class BulkDownloader(object):
+    """Download every `binSize` bar for `symbol` with end timestamps in [start, end] into a store."""
+
+    def __init__(self, symbol, binSize, start, end, directory='history', workers=4, per_minute=30,
+                 base_url=None, max_retries=5):
+        self.symbol = symbol
+        self.binSize = binSize
+        self.width = BIN_SECONDS[binSize] * NS_PER_SECOND
+        start = _to_ns(start)
+        self.start = start - start % self.width + (self.width if start % self.width else 0)
+        self.end = _to_ns(end)
+        if self.end < self.start:
+            raise ValueError("Nothing to download between %s and %s" % (start, end))
+        self.bars = (self.end - self.start) // self.width + 1
+        self.page_size = Bitmex.MAX_COUNT
+        self.pages = (self.bars + self.page_size - 1) // self.page_size
+        self.path = store_path(directory, symbol, binSize)
+        self.workers = workers
+        self.budget = RateBudget(per_minute)
+        self.client = Bitmex(base_url=base_url, symbol=symbol, session=new_session(pool_size=workers))
+        self.max_retries = max_retries
+
+    def run(self):
+        """Fetch every page not already on disk. Returns the path of the store."""
+        columns, done = self.__open_store()
+        todo = [page for page in range(self.pages) if not done[page]]
+        logger.info("Downloading %d of %d pages of %s %s candles into %s" %
+                    (len(todo), self.pages, self.symbol, self.binSize, self.path))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = dict((pool.submit(self.__fetch_page, page), page) for page in todo)
+            for finished, future in enumerate(as_completed(futures), 1):
+                page = futures[future]
+                try:
+                    bars = future.result()
+                except Exception:
+                    # Don't spend the rate budget on pages we would throw away; a rerun resumes from here.
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                index = (bars['timestamp'] - self.start) // self.width
+                keep = (bars['timestamp'] >= self.start) & (index < self.bars)
+                for name, column in columns.items():
+                    column[index[keep]] = bars[name][keep]
+                    column.flush()
+                done[page] = True
+                done.flush()
+                if finished % 50 == 0 or finished == len(todo):
+                    logger.info("%d/%d pages downloaded" % (finished, len(todo)))
+        return self.path
+
+    def __fetch_page(self, page):
+        startTime = self.start + page * self.page_size * self.width
+        count = min(self.page_size, self.bars - page * self.page_size)
+        for attempt in range(self.max_retries + 1):
+            self.budget.wait()
+            try:
+                return self.client.get_bucketed(self.binSize, count=count, startTime=startTime)
+            except requests.exceptions.HTTPError as e:
+                if attempt == self.max_retries:
+                    raise
+                response = e.response
+                if response is not None and response.status_code == 429:
+                    reset = int(response.headers.get('X-RateLimit-Reset', time.time() + 60))
+                    logger.warning("Ratelimited, pausing downloads until %d" % reset)
+                    self.budget.backoff(max(1, reset - time.time()))
+                else:
+                    self.budget.backoff(2 ** attempt)
+            except requests.exceptions.RequestException:
+                if attempt == self.max_retries:
+                    raise
+                self.budget.backoff(2 ** attempt)
+
+    def __open_store(self):
+        meta = {'symbol': self.symbol, 'binSize': self.binSize, 'start': self.start, 'bars': self.bars,
+                'pageSize': self.page_size}
+        meta_path = os.path.join(self.path, 'meta.json')
+        resume = os.path.exists(meta_path)
+        if resume:
+            with open(meta_path) as f:
+                if json.load(f) != meta:
+                    raise ValueError("%s holds a different download; remove it or pick another directory" % self.path)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+        mode = 'r+' if resume else 'w+'
+        columns = {}
+        for name, dtype in CANDLE_COLUMNS:
+            filename = os.path.join(self.path, name + '.npy')
+            if resume:
+                columns[name] = np.load(filename, mmap_mode=mode)
+            else:
+                columns[name] = np.lib.format.open_memmap(filename, mode=mode, dtype=dtype, shape=(self.bars,))
+        filename = os.path.join(self.path, 'pages.npy')
+        if resume:
+            done = np.load(filename, mmap_mode=mode)
+        else:
+            done = np.lib.format.open_memmap(filename, mode=mode, dtype=np.bool_, shape=(self.pages,))
+        if not resume:
+            # Only written once the store exists, so a half-created store is never mistaken for a resumable one
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        return columns, done
+
+
+def _to_ns(value):
+    """Accept ns since epoch or anything np.datetime64 understands ('2018-01-01', '2018-01-01T00:00')."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(np.datetime64(value, 'ns').astype(np.int64))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download BitMEX trade/bucketed history into a columnar store.")
+    parser.add_argument('symbol')
+    parser.add_argument('binSize', choices=sorted(BIN_SECONDS))
+    parser.add_argument('start', help="first bar end, e.g. 2018-01-01")
+    parser.add_argument('end', help="last bar end, e.g. 2018-04-01")
+    parser.add_argument('--dir', default='history')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--per-minute', type=int, default=30, help="request budget per minute")
+    parser.add_argument('--base-url', default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    BulkDownloader(args.symbol, args.binSize, args.start, args.end, directory=args.dir, workers=args.workers,
+                   per_minute=args.per_minute, base_url=args.base_url).run()
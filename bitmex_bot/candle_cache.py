@@ -0,0 +1,60 @@
+"""On-disk cache of completed candles, one append-only file per (symbol, binSize)."""
+import os
+import numpy as np
+from bitmex_bot.candles import CANDLE_COLUMNS
+
+# One fixed size record per bar; the file is just these records back to back, oldest first.
+CANDLE_DTYPE = np.dtype([(name, np.dtype(dtype).newbyteorder('<')) for name, dtype in CANDLE_COLUMNS])
+
+
+class CandleCache(object):
+    """Completed bars for one symbol and bin size, stored as packed CANDLE_DTYPE records.
+
+    Bars are only ever appended, in timestamp order, so reading the newest N is a memory map and a slice.
+    If the cache falls too far behind to be topped up it is rewritten with `reset()`.
+    """
+
+    def __init__(self, directory, symbol, binSize):
+        self.path = os.path.join(directory, "%s-%s.bin" % (symbol, binSize))
+
+    def __len__(self):
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // CANDLE_DTYPE.itemsize
+
+    def load(self, count=None):
+        """Return the newest `count` bars (all of them if None) as a CANDLE_DTYPE array, oldest first."""
+        size = len(self)
+        if not size:
+            return np.zeros(0, dtype=CANDLE_DTYPE)
+        bars = np.memmap(self.path, dtype=CANDLE_DTYPE, mode='r', shape=(size,))
+        return np.array(bars[-count:] if count else bars)
+
+    def last_timestamp(self):
+        """Timestamp (ns since epoch, bar end) of the newest cached bar, or None if the cache is empty."""
+        last = self.load(1)
+        return int(last['timestamp'][0]) if len(last) else None
+
+    def append(self, bars):
+        """Append bars newer than the newest cached one. Returns how many were written."""
+        last = self.last_timestamp()
+        if last is not None:
+            bars = bars[bars['timestamp'] > last]
+        if len(bars):
+            self.__ensure_dir()
+            with open(self.path, 'ab') as f:
+                f.write(np.ascontiguousarray(bars, dtype=CANDLE_DTYPE).tobytes())
+        return len(bars)
+
+    def reset(self, bars):
+        """Replace the cache contents with `bars`."""
+        self.__ensure_dir()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(np.ascontiguousarray(bars, dtype=CANDLE_DTYPE).tobytes())
+        os.replace(tmp, self.path)
+
+    def __ensure_dir(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
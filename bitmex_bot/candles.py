@@ -0,0 +1,182 @@
+"""Live OHLCV bars built from the websocket trade stream."""
+import time
+import threading
+import numpy as np
+from bitmex_bot.ws.columns import ColumnStore, parse_timestamps
+from bitmex_bot.utils import trace
+
+NS_PER_SECOND = 1000000000
+
+# Bin sizes BitMEX offers on trade/bucketed, in seconds.
+BIN_SECONDS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+
+CANDLE_COLUMNS = [
+    ('timestamp', np.int64),  # ns since epoch, end of the bin (same convention as trade/bucketed)
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.int64),
+]
+
+
+class CandleSeries(object):
+    """Completed bars of one bin size, plus the bar currently being built.
+
+    Completed bars live in a ColumnStore, so reading closes is a view rather than a list rebuild.
+    A bar is completed by the first trade of a later bin, or by roll() once its bin is over.
+    Bins without any trades are filled with flat, zero-volume bars the way BitMEX does.
+    """
+
+    def __init__(self, binSize, capacity, events=None, event=None):
+        self.binSize = binSize
+        self.events = events
+        self.event = event or 'bar:' + binSize  # name a completed bar is published under
+        self.width = BIN_SECONDS[binSize] * NS_PER_SECOND
+        self.bars = ColumnStore(CANDLE_COLUMNS, capacity)
+        self.bar = None  # [end, open, high, low, close, volume] of the bar being built
+        self.lastEnd = None  # end of the newest completed bar
+
+    def seed(self, timestamps, opens, highs, lows, closes, volumes):
+        """Load completed bars (oldest first), e.g. from trade/bucketed."""
+        if not len(timestamps):
+            return
+        self.bars.extend(timestamp=timestamps, open=opens, high=highs, low=lows, close=closes, volume=volumes)
+        self.lastEnd = int(timestamps[-1])
+        self.bar = None
+
+    def add_trade(self, timestamp, price, size):
+        end = timestamp - timestamp % self.width + self.width
+        if self.lastEnd is not None and end <= self.lastEnd:
+            return  # Already part of a completed bar
+        if self.bar is not None and end != self.bar[0]:
+            if end < self.bar[0]:
+                return  # Out of order trade for a bin we've moved past
+            self.__complete()
+        if self.bar is None:
+            self.__pad(end - self.width)
+            self.bar = [end, price, price, price, price, size]
+        else:
+            bar = self.bar
+            bar[2] = max(bar[2], price)
+            bar[3] = min(bar[3], price)
+            bar[4] = price
+            bar[5] += size
+
+    def roll(self, now):
+        """Complete any bins that ended at or before `now` (ns since epoch)."""
+        if self.bar is not None and self.bar[0] <= now:
+            self.__complete()
+        if self.bar is None:
+            self.__pad(now - now % self.width)
+
+    def closes(self, count=None, partial=False):
+        """Close prices of completed bars, oldest first. With partial=True the building bar is appended."""
+        if not partial or self.bar is None:
+            return self.bars.column('close', count)
+        closes = self.bars.column('close', None if count is None else count - 1)
+        return np.append(closes, self.bar[4])
+
+    def __complete(self):
+        """Move the building bar into the completed bars."""
+        end, o, h, l, c, v = self.bar
+        self.bars.append(timestamp=end, open=o, high=h, low=l, close=c, volume=v)
+        self.lastEnd = end
+        self.bar = None
+        if self.events is not None:
+            self.events.publish(self.event)
+
+    def __pad(self, through):
+        """Add flat, zero-volume bars for empty bins after the last completed bar, up to the bin ending at `through`."""
+        if self.lastEnd is None or through <= self.lastEnd:
+            return
+        gap = np.arange(self.lastEnd + self.width, through + 1, self.width, dtype=np.int64)
+        flat = np.full(len(gap), self.bars.column('close', 1)[0])
+        self.bars.extend(timestamp=gap, open=flat, high=flat, low=flat, close=flat,
+                         volume=np.zeros(len(gap), dtype=np.int64))
+        self.lastEnd = int(gap[-1])
+        if self.events is not None:
+            self.events.publish(self.event)
+
+
+def bar_event(symbol, binSize):
+    """EventBoard name a CandleAggregator publishes completed `binSize` bars of `symbol` under."""
+    return 'bar:%s:%s' % (symbol, binSize)
+
+
+class CandleAggregator(object):
+    """Keeps rolling OHLCV bars for several bin sizes from the trades of one symbol.
+
+    Register `on_trades` as a listener on the websocket 'trade' table. Seed it first with `seed()` so
+    indicators have history from the start; trades older than the seeded bars are ignored. Note that
+    the first live bar only contains the trades we saw, so it may be incomplete if we started mid-bin.
+
+    Given the websocket's trade ColumnStore for the symbol (BitMEXWebsocket.trade_columns), the new
+    trades are read from its arrays, which the websocket fills before calling listeners, rather than
+    parsed out of the rows a second time.
+
+    If given an EventBoard, a completed bar is published on it as 'bar:<symbol>:<binSize>' (see bar_event).
+
+    Trades come in on the websocket thread while the bot thread rolls the bars over, so both, and reading
+    the bar being built, go under the aggregator's lock.
+    """
+
+    def __init__(self, symbol, binSizes=('1m', '5m', '1h', '1d'), capacity=400, events=None, trades=None):
+        self.symbol = symbol
+        self.trades = trades
+        self.series = dict((binSize, CandleSeries(binSize, capacity, events, bar_event(symbol, binSize)))
+                           for binSize in binSizes)
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+    def seed(self, historical):
+        """Seed every bin size from a bitmex_historical.Bitmex-like source. Returns self."""
+        for binSize, series in self.series.items():
+            data = historical.get_historical_data(tick=binSize, count=self.capacity, symbol=self.symbol)
+            if data is None:
+                continue
+            with self.lock:
+                series.seed(data['timestamp'], data['open'], data['high'], data['low'], data['close'],
+                            data['volume'])
+        return self
+
+    def on_trades(self, table, action, rows):
+        """Websocket listener: fold new trades for our symbol into every series."""
+        if action not in ('partial', 'insert'):
+            return
+        rows = [r for r in rows if r['symbol'] == self.symbol]
+        if not rows:
+            return
+        started = trace.now() if trace.on else 0
+        if self.trades is not None:
+            # The rows are the newest ones in the store
+            count = len(rows)
+            self.add_trades(self.trades.column('timestamp', count), self.trades.column('price', count),
+                            self.trades.column('size', count))
+        else:
+            self.add_trades(parse_timestamps([r['timestamp'] for r in rows]), [r['price'] for r in rows],
+                            [r['size'] for r in rows])
+        if trace.on:
+            trace.record('ws.bar', started)
+
+    def add_trades(self, timestamps, prices, sizes):
+        """Fold trades, given as timestamp (ns since epoch), price and size sequences, into every series."""
+        with self.lock:
+            for i in range(len(timestamps)):
+                timestamp, price, size = int(timestamps[i]), float(prices[i]), int(sizes[i])
+                for series in self.series.values():
+                    series.add_trade(timestamp, price, size)
+
+    def roll(self, now=None):
+        """Complete bars whose bins are over, even if no trade has arrived since."""
+        if now is None:
+            now = int(time.time() * NS_PER_SECOND)
+        with self.lock:
+            for series in self.series.values():
+                series.roll(now)
+
+    def closes(self, binSize, count=None, partial=False):
+        """Close prices for a bin size, oldest first. Raises KeyError for bin sizes we don't build."""
+        series = self.series[binSize]
+        with self.lock:
+            return series.closes(count, partial)
@@ -0,0 +1,78 @@
+"""Recording of live websocket frames, REST responses and seed candles, for replay.py.
+
+A capture file is a flat, append-only sequence of records, each a fixed header followed by a payload:
+
+    kind      uint8    FRAME, RESPONSE or CANDLES
+    time      int64    ns since epoch the record was written
+    length    uint32   payload size in bytes
+
+FRAME payloads are the websocket frame exactly as received. RESPONSE payloads are one line of JSON
+({"verb", "path", "query", "status"}), a newline, then the raw response body. CANDLES payloads are one
+line of JSON ({"binSize"}), a newline, then the bars as packed candle_cache.CANDLE_DTYPE records.
+
+Set CAPTURE_FILE in settings to record a bot session. A truncated last record (e.g. after a crash) is
+ignored on reading.
+"""
+import struct
+import threading
+import time
+import numpy as np
+from bitmex_bot.utils import codec
+from bitmex_bot.candle_cache import CANDLE_DTYPE
+
+FRAME = 1
+RESPONSE = 2
+CANDLES = 3
+
+HEADER = struct.Struct('<BqI')
+
+
+class CaptureWriter(object):
+    """Appends records to a capture file. Safe to share between the websocket thread and the bot."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+
+    def write_frame(self, frame):
+        self.__write(FRAME, frame.encode('utf8') if isinstance(frame, str) else frame)
+
+    def write_response(self, verb, path, query, status, content):
+        meta = codec.dumpb({'verb': verb, 'path': path, 'query': query, 'status': status})
+        self.__write(RESPONSE, meta + b'\n' + (content or b''))
+
+    def write_candles(self, binSize, bars, symbol=None):
+        meta = codec.dumpb({'binSize': binSize, 'symbol': symbol})
+        self.__write(CANDLES, meta + b'\n' + np.ascontiguousarray(bars, dtype=CANDLE_DTYPE).tobytes())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __write(self, kind, payload):
+        header = HEADER.pack(kind, time.time_ns(), len(payload))
+        with self.lock:
+            # Flushed per record, so a crash loses at most the record being written
+            self.file.write(header + payload)
+            self.file.flush()
+
+
+def read_records(path):
+    """Yield (kind, time, payload) for every complete record in a capture file, oldest first."""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            kind, timestamp, length = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield kind, timestamp, payload
+
+
+def split_payload(payload):
+    """Split a RESPONSE or CANDLES payload into its decoded metadata and raw body."""
+    meta, _, body = payload.partition(b'\n')
+    return codec.loads(meta), body
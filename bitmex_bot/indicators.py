@@ -1,25 +1,111 @@
+from collections import deque
 import numpy as np
 
 
-def ema(values, period=20):
-    values = np.asarray(values)
+# ema() methods:
+#   'recursive' - the standard exponential moving average, y[t] = y[t-1] + alpha * (x[t] - y[t-1]) with
+#                 alpha = 2 / (period + 1), seeded with the first value.
+#   'legacy'    - the original finite kernel: a convolution with `period` exponentially spaced weights,
+#                 with the first `period` outputs back-filled. Kept for comparison with older results.
+EMA_METHODS = ('recursive', 'legacy')
+
+# The batch recursive EMA is evaluated in blocks short enough that the decay factor over one block
+# stays within this range, which keeps the closed form free of overflow and loss of precision.
+_EMA_BLOCK_RANGE = np.log(1e6)
+
+
+def ema_weights(period):
     weights = np.exp(np.linspace(-1., 0., period))
 
     weights /= weights.sum()
+    return weights
+
+
+def ema_legacy(values, period=20):
+    values = np.asarray(values)
+    weights = ema_weights(period)
 
     a = np.convolve(values, weights, mode='full')[:len(values)]
     a[:period] = a[period]
     return a
 
 
-def macd(l):
-    if len(l) > 26:
-        ema_26 = ema(l, 26)
-        ema_12 = ema(l, 12)
+def ema(values, period=20, method='recursive'):
+    """Exponential moving average.
+
+    `values` may be 1-D, or 2-D with one series per row (e.g. several symbols). `period` may be a
+    single period or one per row; with 1-D values and several periods you get one row per period,
+    which makes a parameter sweep a single 2-D operation. float32 input gives float32 output.
+
+    NaNs are gaps: the recursive EMA holds its last value across them, and is NaN until the first
+    real value of each row.
+    """
+    if method == 'legacy':
+        return ema_legacy(values, period)
+    if method != 'recursive':
+        raise ValueError("Unknown EMA method %r, expected one of %s" % (method, EMA_METHODS))
+
+    values = np.asarray(values)
+    dtype = np.float32 if values.dtype == np.float32 else np.float64
+    periods = np.asarray(period, dtype=np.float64)
+    if np.any(periods <= 1):
+        raise ValueError("EMA period must be greater than 1")
+    if values.ndim == 1 and periods.ndim == 1:
+        x = np.tile(values.astype(np.float64), (len(periods), 1))
+    else:
+        x = np.atleast_2d(values).astype(np.float64)
+    alpha = np.broadcast_to(2. / (periods.reshape(-1, 1) + 1.), (len(x), 1))
+
+    out = _ema_filter(x, alpha)
+    if values.ndim == 1 and periods.ndim == 0:
+        out = out[0]
+    return out.astype(dtype, copy=False)
+
+
+def _ema_filter(x, alpha):
+    """Vectorized first order IIR filter y[t] = (1 - alpha) * y[t-1] + alpha * x[t], row by row.
 
-        macd_value = ema_12 - ema_26
+    Within a block, with P[t] the product of the decay factors up to t,
+        y[t] = P[t] * (y[start - 1] + cumsum(alpha * x[k] / P[k]))
+    which is a couple of cumsums instead of a Python loop over every value.
+    """
+    rows, n = x.shape
+    out = np.full(x.shape, np.nan)
+    if not n:
+        return out
+    valid = ~np.isnan(x)
+    has_values = valid.any(axis=1)
+    first = np.argmax(valid, axis=1)
 
-        signal_line = ema(macd_value, 9)
+    # Seed each row with its first real value, and treat everything before it as that value too.
+    # Gaps get a weight of zero and a decay of one, so the EMA simply carries through them.
+    leading = np.arange(n) < first[:, None]
+    x = np.where(leading, x[np.arange(rows), first][:, None], x)
+    valid |= leading
+    a = np.where(valid, alpha, 0.)
+    ax = np.where(valid, a * x, 0.)
+    log_decay = np.log(np.where(valid, 1. - alpha, 1.))
+
+    block = max(1, int(_EMA_BLOCK_RANGE / -np.log(1. - alpha.max())))
+    prev = x[:, 0]
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        decay = np.exp(np.cumsum(log_decay[:, start:end], axis=1))
+        out[:, start:end] = decay * (prev[:, None] + np.cumsum(ax[:, start:end] / decay, axis=1))
+        prev = out[:, end - 1]
+
+    out[leading | ~has_values[:, None]] = np.nan
+    return out
+
+
+def macd(l, fast=12, slow=26, signal=9, method='recursive'):
+    if len(l) > slow:
+        ema_slow = ema(l, slow, method)
+        ema_fast = ema(l, fast, method)
+
+        macd_value = ema_fast - ema_slow
+
+        signal_line = ema(macd_value, signal, method)
 
         macd_hist = macd_value - signal_line
 
@@ -28,6 +114,81 @@ def macd(l):
     return
 
 
+class StreamingEMA(object):
+    """ema() one value at a time.
+
+    The recursive EMA only needs its last value, so each update is O(1). The legacy kernel is a weighted
+    sum over the last `period` values, so its state is that window and each update costs O(period).
+    Warm up with the history first; from then on update() continues the same series that ema() gives.
+    """
+
+    def __init__(self, period=20, method='recursive'):
+        if method not in EMA_METHODS:
+            raise ValueError("Unknown EMA method %r, expected one of %s" % (method, EMA_METHODS))
+        self.period = period
+        self.method = method
+        self.alpha = 2. / (period + 1.)
+        # np.convolve applies the kernel back to front, so reverse it once to line up with the window.
+        self.weights = ema_weights(period)[::-1]
+        self.window = deque(maxlen=period)
+        self.value = None
+
+    def warmup(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if self.method == 'legacy' and len(values) <= self.period:
+            raise ValueError("Need more than %d values to warm up a legacy EMA(%d)" % (self.period, self.period))
+        out = ema(values, self.period, self.method)
+        self.window.clear()
+        self.window.extend(values[-self.period:])
+        self.value = out[-1] if len(out) else np.nan
+        return out
+
+    def update(self, value):
+        if self.value is None:
+            raise ValueError("StreamingEMA must be warmed up before it is updated")
+        if self.method == 'legacy':
+            self.window.append(value)
+            self.value = float(np.dot(self.weights, self.window))
+        elif np.isnan(self.value):
+            self.value = value
+        elif not np.isnan(value):
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class StreamingMACD(object):
+    """macd() one close at a time: update(close) returns the new histogram value.
+
+    warmup(closes) runs the batch macd() over the history (and returns its output, None if there is
+    not enough of it) and primes the running state so later updates continue the same series.
+    `method` picks the EMA, see EMA_METHODS.
+    """
+
+    def __init__(self, fast=12, slow=26, signal=9, method='recursive'):
+        self.fast = StreamingEMA(fast, method)
+        self.slow = StreamingEMA(slow, method)
+        self.signal = StreamingEMA(signal, method)
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def warmup(self, closes):
+        closes = np.asarray(closes, dtype=np.float64)
+        if len(closes) <= max(self.slow.period, self.fast.period):
+            return None
+        macd_value = self.fast.warmup(closes) - self.slow.warmup(closes)
+        macd_hist = macd_value - self.signal.warmup(macd_value)
+        self.value = macd_hist[-1]
+        return macd_hist
+
+    def update(self, close):
+        macd_value = self.fast.update(close) - self.slow.update(close)
+        self.value = macd_value - self.signal.update(macd_value)
+        return self.value
+
+
 def HEIKIN(O, H, L, C, oldO, oldC):
     HA_Close = (O + H + L + C)/4
     HA_Open = (oldO + oldC)/2
@@ -36,3 +197,45 @@ def HEIKIN(O, H, L, C, oldO, oldC):
     HA_Low = elements.min(0)
     out = np.array([HA_Close, HA_Open, HA_High, HA_Low])
     return out
+
+
+def heikin_ashi(O, H, L, C):
+    """Heikin-Ashi candles for whole O/H/L/C arrays. Returns (HA_Open, HA_High, HA_Low, HA_Close).
+
+    HA_Open[t] = (HA_Open[t-1] + HA_Close[t-1]) / 2 is a first order recursion (an EMA with alpha 1/2
+    over the previous HA_Close), so it goes through the same vectorized filter as ema(). The first
+    HA_Open is (O[0] + C[0]) / 2. Like ema(), 2-D input is treated as one series per row.
+    """
+    O, H, L, C = [np.asarray(a, dtype=np.float64) for a in (O, H, L, C)]
+    HA_Close = (O + H + L + C) / 4
+    if not O.shape[-1]:
+        return O.copy(), H.copy(), L.copy(), HA_Close
+    closes = np.atleast_2d(HA_Close)
+    seed = (np.atleast_2d(O)[:, :1] + np.atleast_2d(C)[:, :1]) / 2
+    HA_Open = _ema_filter(np.hstack([seed, closes[:, :-1]]), np.full((len(closes), 1), 0.5))
+    HA_Open = HA_Open.reshape(HA_Close.shape)
+    HA_High = np.maximum(H, np.maximum(HA_Open, HA_Close))
+    HA_Low = np.minimum(L, np.minimum(HA_Open, HA_Close))
+    return HA_Open, HA_High, HA_Low, HA_Close
+
+
+class StreamingHeikinAshi(object):
+    """heikin_ashi() one bar at a time: update(o, h, l, c) returns the bar's (HA_Open, HA_High, HA_Low, HA_Close).
+
+    Warm up with the bar history to continue the same series heikin_ashi() gives, or just start updating.
+    """
+
+    def __init__(self):
+        self.last = None  # (HA_Open, HA_Close) of the previous bar
+
+    def warmup(self, O, H, L, C):
+        out = heikin_ashi(O, H, L, C)
+        if len(out[0]):
+            self.last = (out[0][-1], out[3][-1])
+        return out
+
+    def update(self, o, h, l, c):
+        HA_Close = (o + h + l + c) / 4.
+        HA_Open = (o + c) / 2. if self.last is None else (self.last[0] + self.last[1]) / 2.
+        self.last = (HA_Open, HA_Close)
+        return HA_Open, max(h, HA_Open, HA_Close), min(l, HA_Open, HA_Close), HA_Close
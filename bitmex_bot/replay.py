@@ -0,0 +1,220 @@
+"""Replay a session recorded with CAPTURE_FILE (see capture.py) without a BitMEX connection.
+
+Websocket frames are fed to BitMEXWebsocket.process_message in their recorded order, paced at real
+time, N times real time, or as fast as possible. In bot mode an OrderManager runs on top: it reads the
+replayed websocket tables, its REST requests are answered with the recorded responses (in the order they
+were recorded, per verb and path) through the normal BitMEX._curl_bitmex code, its candles are seeded
+with the recorded seed bars, and its clock follows the recording. It checks whenever one of its wake
+events changes, or LOOP_INTERVAL of recorded time has passed, the way run_loop does live.
+
+    python -m bitmex_bot.replay session.capture                 # frames only, as fast as possible
+    python -m bitmex_bot.replay session.capture --bot --speed 10
+    python -m bitmex_bot.replay session.capture --bot --trace    # and print where the time went
+"""
+import time
+import logging
+import argparse
+import atexit
+import http.client
+from collections import deque
+import numpy as np
+import requests
+from requests.structures import CaseInsensitiveDict
+from bitmex_bot.settings import settings
+from bitmex_bot.bitmex import BitMEX
+from bitmex_bot.capture import read_records, split_payload, FRAME, RESPONSE, CANDLES
+from bitmex_bot.candle_cache import CANDLE_DTYPE
+from bitmex_bot.utils import trace
+from bitmex_bot.utils.ratelimit import RateLimiter
+from bitmex_bot.utils.transport import TimedHTTPAdapter
+from bitmex_bot.ws.ws_thread import BitMEXWebsocket
+
+logger = logging.getLogger('root')
+
+REPLAY_URL = 'https://replay.invalid/api/v1/'
+
+
+class ReplaySession(requests.Session):
+    """A requests.Session that answers with recorded responses instead of going to the network."""
+
+    def __init__(self, base_url=REPLAY_URL):
+        super(ReplaySession, self).__init__()
+        self.base_url = base_url
+        self.mount('https://', TimedHTTPAdapter())  # never sends, but keeps get_adapter().stats() working
+        self.responses = {}  # (verb, path) -> deque of (status, body)
+
+    def add(self, verb, path, status, body):
+        self.responses.setdefault((verb, path), deque()).append((status, body))
+
+    def unused(self):
+        return sum(len(queue) for queue in self.responses.values())
+
+    def send(self, request, **kwargs):
+        path = request.url[len(self.base_url):].split('?', 1)[0]
+        queue = self.responses.get((request.method, path))
+        if not queue:
+            raise requests.exceptions.ConnectionError("No recorded response left for %s %s" % (request.method, path))
+        status, body = queue.popleft()
+        response = requests.Response()
+        response.status_code = status
+        response.reason = http.client.responses.get(status, '')
+        response.headers = CaseInsensitiveDict({'content-type': 'application/json'})
+        response.encoding = 'utf-8'
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class ReplayHistorical(object):
+    """Stands in for bitmex_historical.Bitmex, handing out the recorded seed candles."""
+
+    def __init__(self):
+        self.bars = {}  # (symbol, binSize) -> bars; symbol is None in captures from before it was recorded
+
+    def add(self, binSize, bars, symbol=None):
+        self.bars.setdefault((symbol, binSize), bars)
+
+    def get_historical_data(self, tick='1m', count=400, symbol=None):
+        data = self.bars.get((symbol, tick))
+        if data is None:
+            data = self.bars.get((None, tick))
+        if data is None or not len(data):
+            return None
+        return data[-count:]
+
+
+class ReplayBitMEX(BitMEX):
+    """BitMEX connector whose websocket is fed by a Replayer and whose REST calls get recorded responses."""
+
+    def __init__(self, session, symbol=None, shouldWSAuth=True):
+        super(ReplayBitMEX, self).__init__(base_url=session.base_url, symbol=symbol or settings.SYMBOL,
+                                           apiKey='replay', apiSecret='replay', shouldWSAuth=shouldWSAuth,
+                                           orderIDPrefix=settings.ORDERID_PREFIX or 'mm_bitmex_', session=session)
+        # Recorded responses come back instantly; don't pace them against the live ratelimit
+        self.ratelimit = RateLimiter(limit=10 ** 9, reserve=0)
+
+    def _connect_ws(self, shouldWSAuth):
+        # Nothing to connect to. Just set up what the tables and has_partials() need.
+        self.ws.realtime_url(self.base_url, self.symbols, shouldWSAuth)
+
+
+def load_recording(path, base_url=REPLAY_URL):
+    """Read the REST responses and seed candles of a capture into a ReplaySession and a ReplayHistorical."""
+    session = ReplaySession(base_url)
+    historical = ReplayHistorical()
+    for kind, timestamp, payload in read_records(path):
+        if kind == RESPONSE:
+            meta, body = split_payload(payload)
+            session.add(meta['verb'], meta['path'], meta['status'], body)
+        elif kind == CANDLES:
+            meta, body = split_payload(payload)
+            historical.add(meta['binSize'], np.frombuffer(body, dtype=CANDLE_DTYPE).copy(), meta.get('symbol'))
+    return session, historical
+
+
+class Replayer(object):
+    """Yields the websocket frames of a capture, paced at `speed` times real time (None: no pacing)."""
+
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = speed
+        self.now = None  # recorded time of the last frame handed out, in seconds
+
+    def clock(self):
+        """Current time as far as the recording goes; pass as ExchangeInterface's clock."""
+        return self.now if self.now is not None else time.time()
+
+    def frames(self):
+        start = None
+        for kind, timestamp, payload in read_records(self.path):
+            if kind != FRAME:
+                continue
+            if self.speed:
+                if start is None:
+                    start = (timestamp, time.time())
+                delay = start[1] + (timestamp - start[0]) / 1e9 / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.now = timestamp / 1e9
+            yield payload.decode('utf8')
+
+
+def replay_frames(path, speed=None, symbol=None):
+    """Feed every frame into a fresh BitMEXWebsocket. Returns (websocket, frames, seconds)."""
+    ws = BitMEXWebsocket()
+    ws.realtime_url(REPLAY_URL, symbol or settings.SYMBOL, True)  # symbol may be a list
+    count = 0
+    start = time.perf_counter()
+    for frame in Replayer(path, speed).frames():
+        ws.process_message(frame)
+        count += 1
+    return ws, count, time.perf_counter() - start
+
+
+def replay_bot(path, speed=None, symbol=None):
+    """Run an OrderManager against a recording. Returns (order manager, frames, checks, seconds)."""
+    from bitmex_bot.bitmex_bot import ExchangeInterface, OrderManager
+
+    session, historical = load_recording(path)
+    replayer = Replayer(path, speed)
+    client = ReplayBitMEX(session, symbol)
+    frames = replayer.frames()
+    count = 0
+    start = time.perf_counter()
+
+    # The live bot only starts once the initial table images are in
+    for frame in frames:
+        client.ws.process_message(frame)
+        count += 1
+        if client.ws.has_partials():
+            break
+    else:
+        raise ValueError("%s ends before the websocket sent all table images" % path)
+
+    om = OrderManager(ExchangeInterface(client=client, historical=historical, clock=replayer.clock))
+    atexit.unregister(om.exit)  # there's nothing to cancel at the end of a replay
+    om.init()
+
+    events = om.wake_events()
+    since = om.exchange.event_versions(events)
+    last_check = replayer.clock()
+    checks = 0
+    for frame in frames:
+        client.ws.process_message(frame)
+        count += 1
+        versions = om.exchange.event_versions(events)
+        if versions != since or replayer.clock() - last_check >= settings.LOOP_INTERVAL:
+            since = versions
+            last_check = replayer.clock()
+            om.sanity_check()
+            checks += 1
+    elapsed = time.perf_counter() - start
+    if session.unused():
+        logger.warning("%d recorded REST responses were not asked for; the replay diverged from the recording" %
+                       session.unused())
+    return om, count, checks, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a session recorded with CAPTURE_FILE.")
+    parser.add_argument('capture')
+    parser.add_argument('--speed', type=float, default=None,
+                        help="1 for real time, N for N times faster; as fast as possible if not given")
+    parser.add_argument('--symbol', default=None, type=lambda text: text.split(','),
+                        help="symbol, or comma separated symbols, the session was recorded for")
+    parser.add_argument('--bot', action='store_true', help="run the OrderManager on top of the replayed data")
+    parser.add_argument('--trace', action='store_true', help="print latency histograms of the hot path at the end")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace.enable()
+
+    if args.bot:
+        om, frames, checks, elapsed = replay_bot(args.capture, args.speed, args.symbol)
+        print("%d frames, %d order manager checks in %.2fs" % (frames, checks, elapsed))
+    else:
+        ws, frames, elapsed = replay_frames(args.capture, args.speed, args.symbol)
+        print("%d frames in %.2fs (%.0f frames/s)" % (frames, elapsed, frames / elapsed if elapsed else 0))
+    if args.trace:
+        print(trace.report())
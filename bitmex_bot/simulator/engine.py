@@ -0,0 +1,567 @@
+"""Price-time priority matching engine for one inverse perpetual contract, shaped like BitMEX.
+
+Orders, executions, positions and margins are plain dicts with BitMEX field names, so the rows the
+engine publishes can be sent to BitMEXWebsocket as they are. Every change is passed to
+publish(table, action, rows, account); account is None for public tables (trade, quote, instrument,
+orderBookL2_25).
+"""
+import bisect
+import itertools
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+XBT_SATOSHIS = 100000000
+
+# Levels a side in the orderBookL2_25 table
+BOOK_DEPTH = 25
+
+# Keys of each table, as sent with its partial
+TABLE_KEYS = {
+    'instrument': ['symbol'],
+    'trade': [],
+    'quote': [],
+    'order': ['orderID'],
+    'execution': ['execID'],
+    'position': ['account', 'symbol'],
+    'margin': ['account'],
+    'orderBookL2_25': ['symbol', 'id', 'side'],
+}
+PRIVATE_TABLES = ('order', 'execution', 'position', 'margin')
+
+
+class SimulatorError(Exception):
+    """A request the exchange rejects. Sent back as {"error": {"message": ...}} with `status`."""
+
+    def __init__(self, message, status=400):
+        super(SimulatorError, self).__init__(message)
+        self.status = status
+
+
+def timestamp():
+    return datetime.utcnow().isoformat(timespec='milliseconds') + 'Z'
+
+
+class BookSide(object):
+    """Resting orders on one side of the book: FIFO queues per price level, prices kept sorted."""
+
+    def __init__(self, descending):
+        self.descending = descending
+        self.levels = {}  # price -> deque of orders
+        self.prices = []  # ascending
+
+    def best(self):
+        if not self.prices:
+            return None
+        return self.prices[-1] if self.descending else self.prices[0]
+
+    def add(self, order):
+        price = order['price']
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = deque()
+            bisect.insort(self.prices, price)
+        level.append(order)
+
+    def remove(self, order):
+        price = order['price']
+        level = self.levels.get(price)
+        if level is None:
+            return
+        try:
+            level.remove(order)
+        except ValueError:
+            return
+        if not level:
+            self.__drop(price)
+
+    def pop_front(self, price):
+        level = self.levels[price]
+        level.popleft()
+        if not level:
+            self.__drop(price)
+
+    def size_at(self, price):
+        return sum(o['leavesQty'] for o in self.levels.get(price, ()))
+
+    def __drop(self, price):
+        del self.levels[price]
+        del self.prices[bisect.bisect_left(self.prices, price)]
+
+
+class MatchingEngine(object):
+    """Order book, stops, positions and margin for one contract. All methods are thread safe."""
+
+    def __init__(self, symbol='XBTUSD', price=10000., tickSize=0.5, walletBalance=XBT_SATOSHIS, publish=None):
+        self.lock = threading.RLock()
+        self.symbol = symbol
+        self.tickSize = tickSize
+        self.publish = publish or (lambda table, action, rows, account=None: None)
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.orders = {}  # orderID -> every order we've seen (open ones are also in the book or in stops)
+        self.clOrdIDs = {}  # (account, clOrdID) -> orderID
+        self.stops = []  # untriggered stop orders
+        self.trades = deque(maxlen=100)
+        self.positions = {}
+        self.margins = {}
+        self.walletBalance = walletBalance
+        self.execIDs = itertools.count(1)
+        self.instrument = {
+            'symbol': symbol, 'state': 'Open', 'typ': 'FFWCSX', 'tickSize': tickSize, 'lotSize': 1,
+            'multiplier': -XBT_SATOSHIS, 'isQuanto': False, 'isInverse': True,
+            'underlyingToSettleMultiplier': None, 'quoteToSettleMultiplier': -XBT_SATOSHIS,
+            'initMargin': 0.01, 'maintMargin': 0.005,
+            'lastPrice': price, 'bidPrice': None, 'askPrice': None, 'midPrice': None, 'markPrice': price,
+            'indicativeSettlePrice': price, 'fairPrice': price, 'timestamp': timestamp(),
+        }
+        self.quote = {'timestamp': timestamp(), 'symbol': symbol, 'bidSize': None, 'bidPrice': None,
+                      'askPrice': None, 'askSize': None}
+        self.depth = {}  # (side, price) -> size of the orderBookL2_25 levels last published
+
+    #
+    # Requests
+    #
+    def place(self, account, params):
+        """New order from REST parameters (orderQty signed or side given). Returns the order."""
+        with self.lock:
+            order = self.__new_order(account, params)
+            self.__accept(order)
+            self.__settle_stops()
+            return dict(order)
+
+    def place_bulk(self, account, orders):
+        with self.lock:
+            return [self.place(account, params) for params in orders]
+
+    def amend(self, account, params):
+        """Change price, orderQty or leavesQty of an open order, found by orderID or origClOrdID."""
+        with self.lock:
+            order = self.__find(account, params.get('orderID'), params.get('origClOrdID') or params.get('clOrdID'))
+            if order['ordStatus'] in ('Filled', 'Canceled'):
+                raise SimulatorError("Invalid ordStatus")
+            if 'orderQty' in params and abs(params['orderQty']) <= order['cumQty']:
+                raise SimulatorError("Invalid orderQty")
+            price = self.__check_price(params['price']) if 'price' in params else order['price']
+            resting = order not in self.stops
+            if resting:
+                self.__book(order).remove(order)
+            else:
+                self.stops.remove(order)
+            if 'orderQty' in params:
+                qty = abs(params['orderQty'])
+                order['orderQty'] = qty
+                order['leavesQty'] = qty - order['cumQty']
+            if 'leavesQty' in params:
+                order['leavesQty'] = abs(params['leavesQty'])
+                order['orderQty'] = order['cumQty'] + order['leavesQty']
+            order['price'] = price
+            if 'stopPx' in params:
+                order['stopPx'] = params['stopPx']
+            order['timestamp'] = timestamp()
+            self.publish('order', 'update', [self.__order_update(order, 'price', 'orderQty', 'leavesQty', 'stopPx')],
+                         account)
+            if resting:
+                # Amending loses queue priority, as on BitMEX
+                self.__match(order)
+            else:
+                self.stops.append(order)
+            self.__settle_stops()
+            return dict(order)
+
+    def amend_bulk(self, account, orders):
+        with self.lock:
+            return [self.amend(account, params) for params in orders]
+
+    def cancel(self, account, orderIDs=None, clOrdIDs=None, text='Canceled via API.'):
+        """Cancel orders by ID. Returns the canceled orders; raises a 404 if none of them are open."""
+        with self.lock:
+            canceled = []
+            ids = [(orderID, None) for orderID in _as_list(orderIDs)] + [(None, c) for c in _as_list(clOrdIDs)]
+            for orderID, clOrdID in ids:
+                try:
+                    order = self.__find(account, orderID, clOrdID)
+                except SimulatorError:
+                    continue
+                if order['ordStatus'] in ('Filled', 'Canceled'):
+                    continue
+                self.__cancel(order, text)
+                canceled.append(dict(order))
+            if canceled:
+                self.__update_quote()
+            if ids and not canceled:
+                raise SimulatorError("Not Found", status=404)
+            return canceled
+
+    def cancel_all(self, account):
+        with self.lock:
+            orderIDs = [o['orderID'] for o in self.open_orders(account)]
+            return self.cancel(account, orderIDs) if orderIDs else []
+
+    def forget(self, orderIDs):
+        """Drop finished orders from the history, so long synthetic runs don't grow it without bound."""
+        with self.lock:
+            for orderID in orderIDs:
+                order = self.orders.get(orderID)
+                if order is not None and order['ordStatus'] in ('Filled', 'Canceled'):
+                    del self.orders[orderID]
+                    self.clOrdIDs.pop((order['account'], order['clOrdID']), None)
+
+    def close_position(self, account, params=None):
+        """Market order for the whole position, as order/closePosition does."""
+        with self.lock:
+            qty = self.position(account)['currentQty']
+            if not qty:
+                raise SimulatorError("Position is already closed")
+            price = (params or {}).get('price')
+            return self.place(account, {'orderQty': -qty, 'ordType': 'Limit' if price else 'Market',
+                                        'price': price, 'execInst': 'Close'})
+
+    def isolate(self, account, enabled=True):
+        with self.lock:
+            position = self.position(account)
+            position['crossMargin'] = not enabled
+            self.publish('position', 'update', [self.__position_update(position, 'crossMargin')], account)
+            return dict(position)
+
+    def open_orders(self, account=None, symbol=None):
+        with self.lock:
+            return [dict(o) for o in self.orders.values()
+                    if o['ordStatus'] in ('New', 'PartiallyFilled') and (account is None or o['account'] == account)]
+
+    def find_orders(self, account, filter=None, count=100, reverse=False):
+        """GET /order: the account's orders matching a BitMEX style filter dict."""
+        filter = dict(filter or {})
+        with self.lock:
+            orders = [o for o in self.orders.values() if o['account'] == account]
+        terminated = filter.pop('ordStatus.isTerminated', None)
+        if terminated is not None:
+            orders = [o for o in orders if (o['ordStatus'] in ('Filled', 'Canceled')) == terminated]
+        open_only = filter.pop('open', None)
+        if open_only:
+            orders = [o for o in orders if o['ordStatus'] in ('New', 'PartiallyFilled')]
+        for field, value in filter.items():
+            values = value if isinstance(value, list) else [value]
+            orders = [o for o in orders if o.get(field) in values]
+        if reverse:
+            orders = orders[::-1]
+        return [dict(o) for o in orders[:count]]
+
+    def position(self, account):
+        with self.lock:
+            if account not in self.positions:
+                self.positions[account] = {
+                    'account': account, 'symbol': self.symbol, 'currency': 'XBt', 'currentQty': 0,
+                    'avgEntryPrice': None, 'avgCostPrice': None, 'realisedPnl': 0, 'unrealisedPnl': 0,
+                    'markPrice': self.instrument['markPrice'], 'homeNotional': 0, 'foreignNotional': 0,
+                    'isOpen': False, 'crossMargin': True, 'leverage': 100, 'timestamp': timestamp(),
+                }
+            return self.positions[account]
+
+    def margin(self, account):
+        with self.lock:
+            if account not in self.margins:
+                self.margins[account] = {
+                    'account': account, 'currency': 'XBt', 'walletBalance': self.walletBalance,
+                    'marginBalance': self.walletBalance, 'availableMargin': self.walletBalance,
+                    'realisedPnl': 0, 'unrealisedPnl': 0, 'timestamp': timestamp(),
+                }
+            return self.margins[account]
+
+    def snapshot(self, table, account=None):
+        """Rows for the partial of `table`, as seen by `account`."""
+        with self.lock:
+            if table == 'instrument':
+                return [dict(self.instrument)]
+            if table == 'trade':
+                return list(self.trades)
+            if table == 'quote':
+                return [dict(self.quote)] if self.quote['bidPrice'] or self.quote['askPrice'] else []
+            if table == 'order':
+                return self.open_orders(account)
+            if table == 'execution':
+                return []
+            if table == 'position':
+                return [dict(self.position(account))]
+            if table == 'margin':
+                return [dict(self.margin(account))]
+            if table == 'orderBookL2_25':
+                return [self.__level(side, price, size=size, price=price) for (side, price), size in self.depth.items()]
+            raise SimulatorError("Unknown table: %s" % table)
+
+    #
+    # Orders
+    #
+    def __new_order(self, account, params):
+        qty = params.get('orderQty')
+        side = params.get('side')
+        if qty is None:
+            raise SimulatorError("Missing orderQty")
+        if side is None:
+            side = 'Buy' if qty > 0 else 'Sell'
+        qty = abs(int(qty))
+        ordType = params.get('ordType') or params.get('orderType') or ('Limit' if params.get('price') else 'Market')
+        if ordType not in ('Market', 'Limit', 'StopLimit', 'Stop'):
+            raise SimulatorError("Unsupported ordType: %s" % ordType)
+        if qty <= 0:
+            raise SimulatorError("Invalid orderQty")
+        price = params.get('price')
+        if ordType in ('Limit', 'StopLimit'):
+            if price is None:
+                raise SimulatorError("Must specify price for %s orders" % ordType)
+            price = self.__check_price(price)
+        elif price is not None:
+            raise SimulatorError("Cannot specify price for %s orders" % ordType)
+        elif ordType == 'Market':
+            # BitMEX fills in a price on market orders too; use the touch it will trade against
+            best = (self.asks if side == 'Buy' else self.bids).best()
+            price = best if best is not None else self.instrument['lastPrice']
+        stopPx = params.get('stopPx')
+        if ordType in ('StopLimit', 'Stop') and stopPx is None:
+            raise SimulatorError("Must specify stopPx for %s orders" % ordType)
+        clOrdID = params.get('clOrdID') or ''
+        if clOrdID and (account, clOrdID) in self.clOrdIDs:
+            raise SimulatorError("Duplicate clOrdID")
+        now = timestamp()
+        order = {
+            'orderID': str(uuid.uuid4()), 'clOrdID': clOrdID, 'account': account, 'symbol': self.symbol,
+            'side': side, 'orderQty': qty, 'price': price, 'stopPx': stopPx, 'ordType': ordType,
+            'execInst': params.get('execInst') or '', 'ordStatus': 'New', 'triggered': '',
+            'workingIndicator': ordType not in ('StopLimit', 'Stop'), 'leavesQty': qty, 'cumQty': 0,
+            'avgPx': None, 'text': 'Submitted via API.', 'transactTime': now, 'timestamp': now,
+        }
+        self.orders[order['orderID']] = order
+        if clOrdID:
+            self.clOrdIDs[(account, clOrdID)] = order['orderID']
+        return order
+
+    def __accept(self, order):
+        self.publish('order', 'insert', [dict(order)], order['account'])
+        if order['ordType'] in ('StopLimit', 'Stop'):
+            self.stops.append(order)
+            return
+        self.__match(order)
+
+    def __match(self, order):
+        """Fill `order` against the other side of the book, then rest, cancel or reject what's left."""
+        book, other = (self.bids, self.asks) if order['side'] == 'Buy' else (self.asks, self.bids)
+        limit = order['price'] if order['ordType'] in ('Limit', 'StopLimit') else None
+        if 'ParticipateDoNotInitiate' in order['execInst'] and self.__crosses(order, other.best(), limit):
+            self.__cancel(order, 'Canceled: Order had execInst of ParticipateDoNotInitiate')
+            return
+        if 'Close' in order['execInst'] or 'ReduceOnly' in order['execInst']:
+            # Never more than it takes to flatten the position
+            position = self.position(order['account'])['currentQty']
+            closing = -position if (position > 0) == (order['side'] == 'Sell') else 0
+            if abs(closing) < order['leavesQty']:
+                order['leavesQty'] = abs(closing)
+                order['orderQty'] = order['cumQty'] + order['leavesQty']
+                if not order['leavesQty']:
+                    self.__cancel(order, 'Canceled: Order would not reduce position')
+                    return
+        while order['leavesQty'] > 0:
+            best = other.best()
+            if not self.__crosses(order, best, limit):
+                break
+            maker = other.levels[best][0]
+            self.__fill(order, maker, best, min(order['leavesQty'], maker['leavesQty']))
+            if not maker['leavesQty']:
+                other.pop_front(best)
+        if order['leavesQty'] > 0:
+            if limit is None:
+                self.__cancel(order, 'Canceled: Market order had remaining quantity')
+            else:
+                book.add(order)
+        self.__update_quote()
+
+    def __crosses(self, order, best, limit):
+        if best is None:
+            return False
+        if limit is None:
+            return True
+        return best <= limit if order['side'] == 'Buy' else best >= limit
+
+    def __fill(self, taker, maker, price, qty):
+        now = timestamp()
+        self.__trade(taker['side'], price, qty, now)
+        for order, liquidity in ((maker, 'AddedLiquidity'), (taker, 'RemovedLiquidity')):
+            previous = order['cumQty']
+            order['cumQty'] += qty
+            order['leavesQty'] -= qty
+            order['avgPx'] = ((order['avgPx'] or 0) * previous + price * qty) / order['cumQty']
+            order['ordStatus'] = 'Filled' if not order['leavesQty'] else 'PartiallyFilled'
+            order['timestamp'] = now
+            account = order['account']
+            self.publish('execution', 'insert', [dict(order, execID='%016x' % next(self.execIDs), execType='Trade',
+                                                      lastQty=qty, lastPx=price, lastLiquidityInd=liquidity)],
+                         account)
+            self.publish('order', 'update',
+                         [self.__order_update(order, 'ordStatus', 'leavesQty', 'cumQty', 'avgPx', 'workingIndicator')],
+                         account)
+            self.__update_position(account, qty if order['side'] == 'Buy' else -qty, price)
+
+    def __cancel(self, order, text):
+        if order in self.stops:
+            self.stops.remove(order)
+        elif order['ordStatus'] in ('New', 'PartiallyFilled') and order['workingIndicator']:
+            self.__book(order).remove(order)
+        order['ordStatus'] = 'Canceled'
+        order['leavesQty'] = 0
+        order['workingIndicator'] = False
+        order['text'] = text
+        order['timestamp'] = timestamp()
+        self.publish('order', 'update', [self.__order_update(order, 'ordStatus', 'leavesQty', 'workingIndicator',
+                                                             'text')], order['account'])
+
+    def __settle_stops(self):
+        """Trigger stops whose stopPx the last price has reached, until none are left to trigger."""
+        triggered = True
+        while triggered and self.stops:
+            last = self.instrument['lastPrice']
+            triggered = [o for o in self.stops
+                         if (o['side'] == 'Buy' and last >= o['stopPx']) or (o['side'] == 'Sell' and last <= o['stopPx'])]
+            for order in triggered:
+                self.stops.remove(order)
+                order['triggered'] = 'StopOrderTriggered'
+                order['workingIndicator'] = True
+                order['ordType'] = 'Limit' if order['ordType'] == 'StopLimit' else 'Market'
+                self.publish('order', 'update', [self.__order_update(order, 'triggered', 'workingIndicator')],
+                             order['account'])
+                self.__match(order)
+
+    def __find(self, account, orderID=None, clOrdID=None):
+        if orderID is None and clOrdID:
+            orderID = self.clOrdIDs.get((account, clOrdID))
+        order = self.orders.get(orderID)
+        if order is None or order['account'] != account:
+            raise SimulatorError("Not Found", status=404)
+        return order
+
+    def __book(self, order):
+        return self.bids if order['side'] == 'Buy' else self.asks
+
+    def __check_price(self, price):
+        price = float(price)
+        if price <= 0:
+            raise SimulatorError("Invalid price")
+        ticks = round(price / self.tickSize)
+        if abs(ticks * self.tickSize - price) > 1e-9:
+            raise SimulatorError("Invalid price tickSize")
+        return ticks * self.tickSize
+
+    @staticmethod
+    def __order_update(order, *fields):
+        row = dict((field, order[field]) for field in fields)
+        row.update(orderID=order['orderID'], clOrdID=order['clOrdID'], account=order['account'],
+                   symbol=order['symbol'], timestamp=order['timestamp'])
+        return row
+
+    #
+    # Market data
+    #
+    def __trade(self, side, price, size, now):
+        trade = {'timestamp': now, 'symbol': self.symbol, 'side': side, 'size': size, 'price': price,
+                 'tickDirection': 'PlusTick' if price >= self.instrument['lastPrice'] else 'MinusTick',
+                 'trdMatchID': str(uuid.uuid4()), 'grossValue': int(size * XBT_SATOSHIS / price),
+                 'homeNotional': size / price, 'foreignNotional': size}
+        self.trades.append(trade)
+        self.publish('trade', 'insert', [trade])
+        instrument = self.instrument
+        instrument.update(lastPrice=price, markPrice=price, fairPrice=price, indicativeSettlePrice=price,
+                          timestamp=now)
+        self.publish('instrument', 'update', [{'symbol': self.symbol, 'lastPrice': price, 'markPrice': price,
+                                               'fairPrice': price, 'indicativeSettlePrice': price,
+                                               'timestamp': now}])
+
+    def __update_quote(self):
+        self.__update_depth()
+        bid, ask = self.bids.best(), self.asks.best()
+        bidSize = self.bids.size_at(bid) if bid is not None else None
+        askSize = self.asks.size_at(ask) if ask is not None else None
+        quote = self.quote
+        if (quote['bidPrice'], quote['askPrice'], quote['bidSize'], quote['askSize']) == (bid, ask, bidSize, askSize):
+            return
+        now = timestamp()
+        quote.update(timestamp=now, bidPrice=bid, askPrice=ask, bidSize=bidSize, askSize=askSize)
+        self.publish('quote', 'insert', [dict(quote)])
+        mid = (bid + ask) / 2 if bid is not None and ask is not None else None
+        if (self.instrument['bidPrice'], self.instrument['askPrice']) != (bid, ask):
+            self.instrument.update(bidPrice=bid, askPrice=ask, midPrice=mid, timestamp=now)
+            self.publish('instrument', 'update', [{'symbol': self.symbol, 'bidPrice': bid, 'askPrice': ask,
+                                                   'midPrice': mid, 'timestamp': now}])
+
+    def __update_depth(self):
+        """Publish the orderBookL2_25 levels that changed, as inserts, updates and deletes by level id."""
+        depth = {}
+        for side, book in (('Buy', self.bids), ('Sell', self.asks)):
+            prices = book.prices[-BOOK_DEPTH:] if book.descending else book.prices[:BOOK_DEPTH]
+            for price in prices:
+                depth[(side, price)] = book.size_at(price)
+        if depth == self.depth:
+            return
+        old = self.depth
+        self.depth = depth
+        deleted = [self.__level(side, price) for side, price in old if (side, price) not in depth]
+        inserted = [self.__level(side, price, size=size, price=price) for (side, price), size in depth.items()
+                    if (side, price) not in old]
+        updated = [self.__level(side, price, size=size) for (side, price), size in depth.items()
+                   if (side, price) in old and old[(side, price)] != size]
+        for action, rows in (('delete', deleted), ('insert', inserted), ('update', updated)):
+            if rows:
+                self.publish('orderBookL2_25', action, rows)
+
+    def __level(self, side, levelPrice, **fields):
+        """An orderBookL2 row. Like BitMEX, the level id is derived from the price, which only inserts carry."""
+        row = {'symbol': self.symbol, 'id': 10 ** 9 - int(round(levelPrice / self.tickSize)), 'side': side}
+        row.update(fields)
+        return row
+
+    #
+    # Accounts
+    #
+    def __update_position(self, account, qty, price):
+        position = self.position(account)
+        current = position['currentQty']
+        entry = position['avgEntryPrice']
+        realised = 0
+        if current and (current > 0) != (qty > 0):
+            # Reducing (or flipping): realise PnL on the closed part. Inverse contract, so PnL is in XBT.
+            closed = min(abs(qty), abs(current)) * (1 if current > 0 else -1)
+            realised = int(round(closed * (1. / entry - 1. / price) * XBT_SATOSHIS))
+        new = current + qty
+        if not new:
+            entry = None
+        elif not current or (current > 0) != (new > 0):
+            entry = price  # opened, or flipped through zero
+        elif (current > 0) == (qty > 0):
+            # Adding: the average entry of an inverse contract is the harmonic mean of the fill prices
+            entry = abs(new) / (abs(current) / entry + abs(qty) / price)
+        position.update(currentQty=new, avgEntryPrice=entry, avgCostPrice=entry, isOpen=bool(new),
+                        realisedPnl=position['realisedPnl'] + realised, markPrice=price,
+                        homeNotional=-new / price if new else 0, foreignNotional=new, timestamp=timestamp())
+        position['unrealisedPnl'] = int(round(new * (1. / entry - 1. / price) * XBT_SATOSHIS)) if new else 0
+        self.publish('position', 'update', [self.__position_update(
+            position, 'currentQty', 'avgEntryPrice', 'avgCostPrice', 'isOpen', 'realisedPnl', 'unrealisedPnl',
+            'markPrice', 'homeNotional', 'foreignNotional')], account)
+
+        margin = self.margin(account)
+        margin['walletBalance'] += realised
+        margin['realisedPnl'] += realised
+        margin['unrealisedPnl'] = position['unrealisedPnl']
+        margin['marginBalance'] = margin['walletBalance'] + margin['unrealisedPnl']
+        margin['availableMargin'] = margin['marginBalance']
+        margin['timestamp'] = position['timestamp']
+        self.publish('margin', 'update', [dict(margin)], account)
+
+    @staticmethod
+    def __position_update(position, *fields):
+        row = dict((field, position[field]) for field in fields)
+        row.update(account=position['account'], symbol=position['symbol'], timestamp=position['timestamp'])
+        return row
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
@@ -0,0 +1,95 @@
+"""Synthetic market for the simulator: a random walk quoted by a maker ladder and hit by random takers."""
+import time
+import random
+import logging
+import threading
+from bitmex_bot.simulator.engine import SimulatorError
+
+logger = logging.getLogger('root')
+
+MARKET_ACCOUNT = 0
+
+
+class MarketGenerator(threading.Thread):
+    """Drives the engine from account 0 at `rate` steps per second.
+
+    Each step moves the mid price by up to `volatility` ticks, re-quotes the ladder of `levels` orders per
+    side where the mid moved or fills ate into it, then sends a market order of up to `takerSize`
+    contracts. Every step produces trade, quote and instrument messages for the websocket clients.
+    """
+
+    def __init__(self, engine, rate=100., levels=10, size=1000, takerSize=500, volatility=1, seed=None):
+        super(MarketGenerator, self).__init__()
+        self.daemon = True
+        self.engine = engine
+        self.rate = rate
+        self.levels = levels
+        self.size = size
+        self.takerSize = takerSize
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.ticks = int(engine.instrument['lastPrice'] / engine.tickSize)  # mid, in ticks
+        self.ladder = {}  # price -> our resting orderID
+        self.steps = 0
+        self.running = threading.Event()
+
+    def stop(self):
+        self.running.clear()
+
+    def run(self):
+        self.running.set()
+        interval = 1. / self.rate if self.rate else 0
+        deadline = time.perf_counter()
+        while self.running.is_set():
+            try:
+                self.step()
+            except SimulatorError as e:
+                logger.debug("Market step failed: %s" % e)
+            self.steps += 1
+            deadline += interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -1:
+                deadline = time.perf_counter()  # fell behind; don't try to catch up in a burst
+
+    def step(self):
+        engine = self.engine
+        self.ticks = max(self.levels + 1, self.ticks + self.random.randint(-self.volatility, self.volatility))
+        with engine.lock:
+            self.requote()
+            side = 'Buy' if self.random.random() < 0.5 else 'Sell'
+            taker = engine.place(MARKET_ACCOUNT, {'side': side, 'orderQty': self.random.randint(1, self.takerSize),
+                                                  'ordType': 'Market'})
+            engine.forget([taker['orderID']])
+
+    def requote(self):
+        """Keep one order of `size` at each ladder price, cancelling the ones the mid moved away from."""
+        engine = self.engine
+        tick = engine.tickSize
+        wanted = {}
+        for level in range(1, self.levels + 1):
+            wanted[(self.ticks - level) * tick] = 'Buy'
+            wanted[(self.ticks + level) * tick] = 'Sell'
+
+        stale, done = [], []
+        for price, orderID in list(self.ladder.items()):
+            order = engine.orders[orderID]
+            if wanted.get(price) != order['side'] or order['ordStatus'] not in ('New', 'PartiallyFilled') or \
+                    order['leavesQty'] < self.size // 2:
+                del self.ladder[price]
+                done.append(orderID)
+                if order['ordStatus'] in ('New', 'PartiallyFilled'):
+                    stale.append(orderID)
+        if stale:
+            engine.cancel(MARKET_ACCOUNT, stale)
+        engine.forget(done)
+
+        for price, side in wanted.items():
+            if price not in self.ladder:
+                order = engine.place(MARKET_ACCOUNT, {'side': side, 'orderQty': self.size, 'price': price,
+                                                      'ordType': 'Limit', 'execInst': 'ParticipateDoNotInitiate'})
+                if order['ordStatus'] == 'New':
+                    self.ladder[price] = order['orderID']
+                else:
+                    engine.forget([order['orderID']])
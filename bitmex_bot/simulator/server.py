@@ -0,0 +1,392 @@
+"""Local BitMEX stand-in serving the parts of /api/v1 and /realtime that BitMEX and BitMEXWebsocket use.
+
+    python -m bitmex_bot.simulator.server --port 8080 --rate 2000 --fault-429 0.01 --fault-503 0.01
+
+then point the bot at it with BASE_URL_TESTING = "http://localhost:8080/api/v1/". Any API key is accepted
+and signatures aren't checked; every authenticated client trades on the same account. Requests are paced
+with a per-key ratelimit like BitMEX's, and a share of them can be failed with 429s and 503s on purpose.
+"""
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+from bitmex_bot.utils import codec
+from bitmex_bot.simulator import websocket
+from bitmex_bot.simulator.engine import MatchingEngine, SimulatorError, TABLE_KEYS, PRIVATE_TABLES
+from bitmex_bot.simulator.market import MarketGenerator
+
+logger = logging.getLogger('root')
+
+API_PREFIX = '/api/v1/'
+
+# The account of authenticated clients. The synthetic market trades on account 0.
+TRADER_ACCOUNT = 1
+
+# Clients that fall this many messages behind are disconnected, as BitMEX does with slow consumers.
+MAX_QUEUED = 100000
+
+
+class Subscriber(object):
+    """One /realtime connection: the tables it subscribed to and the frames waiting to be written."""
+
+    def __init__(self, account):
+        self.account = account
+        self.tables = set()
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.closed = False
+
+    def push(self, frame):
+        with self.condition:
+            if len(self.queue) >= MAX_QUEUED:
+                self.closed = True
+            self.queue.append(frame)
+            self.condition.notify()
+
+    def drain(self, timeout=1.):
+        """Everything queued so far (waits up to timeout for something to arrive)."""
+        with self.condition:
+            if not self.queue and not self.closed:
+                self.condition.wait(timeout)
+            frames = list(self.queue)
+            self.queue.clear()
+            return frames
+
+
+class RealtimeHub(object):
+    """Fans out engine changes to /realtime subscribers. Used as the engine's publish callback."""
+
+    def __init__(self):
+        self.engine = None
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.messages = 0
+
+    def publish(self, table, action, rows, account=None):
+        with self.lock:
+            targets = [s for s in self.subscribers
+                       if table in s.tables and (account is None or s.account == account)]
+        if not targets:
+            return
+        frame = websocket.encode_frame(codec.dumpb({'table': table, 'action': action, 'data': rows}))
+        for subscriber in targets:
+            subscriber.push(frame)
+        self.messages += len(targets)
+
+    def subscribe(self, subscriber, topics):
+        """Send the partials for `topics` ('trade:XBTUSD', 'margin', ...) and start streaming them."""
+        # Hold the engine lock so no change falls between the partial and the stream
+        with self.engine.lock:
+            for topic in topics:
+                table, _, symbol = topic.partition(':')
+                if table not in TABLE_KEYS or (table in PRIVATE_TABLES and subscriber.account is None) or \
+                        symbol not in ('', self.engine.symbol):
+                    if table not in TABLE_KEYS:
+                        error = "Unknown table: %s" % table
+                    elif symbol not in ('', self.engine.symbol):
+                        error = "Unknown or expired symbol: %s" % symbol
+                    else:
+                        error = "Not authenticated for private table: %s" % table
+                    subscriber.push(websocket.encode_frame(codec.dumpb({
+                        'success': False, 'error': error, 'request': {'op': 'subscribe', 'args': [topic]}})))
+                    continue
+                subscriber.push(websocket.encode_frame(codec.dumpb({
+                    'success': True, 'subscribe': topic, 'request': {'op': 'subscribe', 'args': [topic]}})))
+                subscriber.push(websocket.encode_frame(codec.dumpb({
+                    'table': table, 'action': 'partial', 'keys': TABLE_KEYS[table], 'types': {}, 'foreignKeys': {},
+                    'attributes': {}, 'filter': {'symbol': symbol} if symbol else {},
+                    'data': self.engine.snapshot(table, subscriber.account)})))
+                with self.lock:
+                    subscriber.tables.add(table)
+                    if subscriber not in self.subscribers:
+                        self.subscribers.append(subscriber)
+
+    def remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+
+class RateBucket(object):
+    """Server side per key ratelimit: `limit` requests per minute, refilled steadily."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.tokens = float(limit)
+        self.updated = time.time()
+
+    def take(self):
+        """Returns (allowed, remaining, reset)."""
+        now = time.time()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / 60.)
+        self.updated = now
+        allowed = self.tokens >= 1
+        if allowed:
+            self.tokens -= 1
+        reset = int(now + (self.limit - self.tokens) * 60. / self.limit) + 1
+        return allowed, int(self.tokens), reset
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/realtime'):
+            return self.__realtime()
+        self.__rest('GET')
+
+    def do_POST(self):
+        self.__rest('POST')
+
+    def do_PUT(self):
+        self.__rest('PUT')
+
+    def do_DELETE(self):
+        self.__rest('DELETE')
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    #
+    # REST
+    #
+    def __rest(self, verb):
+        sim = self.server.simulator
+        start = time.perf_counter()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        if not url.path.startswith(API_PREFIX):
+            return self.__reply(404, {'error': {'message': 'Not Found', 'name': 'HTTPError'}})
+        path = url.path[len(API_PREFIX):].strip('/')
+
+        apiKey = self.headers.get('api-key')
+        allowed, remaining, reset = sim.ratelimit(apiKey)
+        headers = {'X-RateLimit-Limit': sim.ratelimit_per_minute, 'X-RateLimit-Remaining': remaining,
+                   'X-RateLimit-Reset': reset}
+        roll = random.random()
+        if not allowed or roll < sim.fault_429:
+            sim.count('429')
+            return self.__reply(429, {'error': {'message': 'Rate limit exceeded, retry in 1 seconds.',
+                                                'name': 'RateLimitError'}}, headers)
+        if roll < sim.fault_429 + sim.fault_503:
+            sim.count('503')
+            return self.__reply(503, {'error': {'message': 'The system is currently overloaded. Please try again '
+                                                           'later.', 'name': 'HTTPError'}}, headers)
+
+        params = dict(parse_qsl(url.query))
+        if 'filter' in params:
+            params['filter'] = codec.loads(params['filter'])
+        if body:
+            params.update(codec.loads(body))
+        try:
+            status, result = 200, sim.handle(verb, path, params, TRADER_ACCOUNT if apiKey else None)
+        except SimulatorError as e:
+            status, result = e.status, {'error': {'message': str(e), 'name': 'HTTPError'}}
+        sim.count('requests', time.perf_counter() - start)
+        self.__reply(status, result, headers)
+
+    def __reply(self, status, result, headers=None):
+        payload = codec.dumpb(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    #
+    # Websocket
+    #
+    def __realtime(self):
+        sim = self.server.simulator
+        key = self.headers.get('Sec-WebSocket-Key')
+        if not key or 'websocket' not in (self.headers.get('Upgrade') or '').lower():
+            return self.__reply(400, {'error': {'message': 'Expected a websocket upgrade', 'name': 'HTTPError'}})
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', websocket.accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        apiKey = self.headers.get('api-key')
+        subscriber = Subscriber(TRADER_ACCOUNT if apiKey else None)
+        subscriber.push(websocket.encode_frame(codec.dumpb({
+            'info': 'Welcome to the BitMEX Realtime API.', 'version': 'simulator', 'timestamp': time.time(),
+            'limit': {'remaining': 39}})))
+        topics = [topic for value in dict(parse_qsl(urlsplit(self.path).query)).get('subscribe', '').split(',')
+                  for topic in [value.strip()] if topic]
+        sim.hub.subscribe(subscriber, topics)
+
+        reader = threading.Thread(target=self.__read_client, args=(subscriber,))
+        reader.daemon = True
+        reader.start()
+        try:
+            while not subscriber.closed:
+                frames = subscriber.drain()
+                if frames:
+                    self.wfile.write(b''.join(frames))
+                    self.wfile.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            subscriber.closed = True
+            sim.hub.remove(subscriber)
+
+    def __read_client(self, subscriber):
+        sim = self.server.simulator
+        try:
+            while not subscriber.closed:
+                opcode, payload = websocket.read_frame(self.rfile)
+                if opcode is None or opcode == websocket.CLOSE:
+                    break
+                if opcode == websocket.PING:
+                    subscriber.push(websocket.encode_frame(payload, websocket.PONG))
+                elif opcode == websocket.TEXT:
+                    if payload == b'ping':
+                        subscriber.push(websocket.encode_frame(b'pong'))
+                        continue
+                    command = codec.loads(payload)
+                    if command.get('op') == 'subscribe':
+                        sim.hub.subscribe(subscriber, command.get('args') or [])
+        except (OSError, ValueError):
+            pass
+        finally:
+            with subscriber.condition:
+                subscriber.closed = True
+                subscriber.condition.notify()
+
+
+class Simulator(object):
+    """The matching engine behind a threaded HTTP server, plus request routing, ratelimits and stats."""
+
+    def __init__(self, host='127.0.0.1', port=0, symbol='XBTUSD', price=10000., ratelimit=120, fault_429=0.,
+                 fault_503=0., walletBalance=None):
+        self.hub = RealtimeHub()
+        kwargs = {} if walletBalance is None else {'walletBalance': walletBalance}
+        self.engine = MatchingEngine(symbol, price, publish=self.hub.publish, **kwargs)
+        self.hub.engine = self.engine
+        self.ratelimit_per_minute = ratelimit
+        self.fault_429 = fault_429
+        self.fault_503 = fault_503
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.stats = {'requests': 0, 'orders': 0, '429': 0, '503': 0, 'seconds': 0.}
+        self.httpd = ThreadingHTTPServer((host, port), SimulatorHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.simulator = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d%s" % (host, port, API_PREFIX)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def ratelimit(self, apiKey):
+        with self.lock:
+            bucket = self.buckets.get(apiKey)
+            if bucket is None:
+                bucket = self.buckets[apiKey] = RateBucket(self.ratelimit_per_minute)
+            return bucket.take()
+
+    def count(self, name, seconds=0.):
+        with self.lock:
+            self.stats[name] += 1
+            self.stats['seconds'] += seconds
+
+    def handle(self, verb, path, params, account):
+        """Route one REST call to the engine. Returns the JSON result."""
+        engine = self.engine
+        if verb == 'GET' and path == 'instrument':
+            return engine.snapshot('instrument')
+        if account is None:
+            raise SimulatorError("Missing API key.", status=401)
+        if path.startswith('order') and verb in ('POST', 'PUT'):
+            with self.lock:
+                self.stats['orders'] += len(params['orders']) if 'orders' in params else 1
+        if path == 'order':
+            if verb == 'GET':
+                return engine.find_orders(account, params.get('filter'), int(params.get('count', 100)),
+                                          str(params.get('reverse', 'false')).lower() == 'true')
+            if verb == 'POST':
+                return engine.place(account, params)
+            if verb == 'PUT':
+                return engine.amend(account, params)
+            if verb == 'DELETE':
+                return engine.cancel(account, params.get('orderID'), params.get('clOrdID'))
+        elif path == 'order/bulk':
+            if verb == 'POST':
+                return engine.place_bulk(account, params['orders'])
+            if verb == 'PUT':
+                return engine.amend_bulk(account, params['orders'])
+        elif path == 'order/all' and verb == 'DELETE':
+            return engine.cancel_all(account)
+        elif path == 'order/closePosition' and verb == 'POST':
+            return engine.close_position(account, params)
+        elif path == 'position/isolate' and verb == 'POST':
+            return engine.isolate(account, params.get('enabled', True))
+        elif path == 'position' and verb == 'GET':
+            return engine.snapshot('position', account)
+        elif path == 'user/margin' and verb == 'GET':
+            return engine.margin(account)
+        raise SimulatorError("Not Found", status=404)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local BitMEX simulator.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--symbol', default='XBTUSD')
+    parser.add_argument('--price', type=float, default=10000.)
+    parser.add_argument('--rate', type=float, default=100., help="synthetic market steps (taker trades) per second")
+    parser.add_argument('--levels', type=int, default=10, help="synthetic order book depth per side")
+    parser.add_argument('--ratelimit', type=int, default=120, help="REST requests per minute per API key")
+    parser.add_argument('--fault-429', type=float, default=0., help="share of REST requests failed with a 429")
+    parser.add_argument('--fault-503', type=float, default=0., help="share of REST requests failed with a 503")
+    parser.add_argument('--stats-interval', type=float, default=10.)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    simulator = Simulator(args.host, args.port, args.symbol, args.price, args.ratelimit, args.fault_429,
+                          args.fault_503).start()
+    market = MarketGenerator(simulator.engine, rate=args.rate, levels=args.levels)
+    market.start()
+    logger.info("Simulator listening; set BASE_URL_TESTING = \"%s\"" % simulator.url)
+    try:
+        last = dict(simulator.stats, messages=0, steps=0)
+        while True:
+            time.sleep(args.stats_interval)
+            now = dict(simulator.stats, messages=simulator.hub.messages, steps=market.steps)
+            rates = dict((name, (now[name] - last[name]) / args.stats_interval) for name in now)
+            handled = now['requests'] - last['requests']
+            logger.info("%.0f market steps/s, %.0f ws messages/s, %.1f REST requests/s (%.1f orders/s, %.2fms to "
+                        "handle), %d 429s, %d 503s" %
+                        (rates['steps'], rates['messages'], rates['requests'], rates['orders'],
+                         (now['seconds'] - last['seconds']) / handled * 1000 if handled else 0,
+                         now['429'] - last['429'], now['503'] - last['503']))
+            last = now
+    except KeyboardInterrupt:
+        market.stop()
+        simulator.stop()
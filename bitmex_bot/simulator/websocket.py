@@ -0,0 +1,51 @@
+"""Just enough of RFC 6455 to serve /realtime: the upgrade handshake and text/control frames."""
+import base64
+import hashlib
+import struct
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+TEXT = 0x1
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+
+def accept_key(key):
+    """Sec-WebSocket-Accept for a client's Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + GUID).digest()).decode('ascii')
+
+
+def encode_frame(payload, opcode=TEXT):
+    """A single, unmasked (server to client) frame."""
+    if isinstance(payload, str):
+        payload = payload.encode('utf8')
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def read_frame(stream):
+    """Read one frame from a file-like socket stream. Returns (opcode, payload), or (None, b'') on EOF."""
+    header = stream.read(2)
+    if len(header) < 2:
+        return None, b''
+    opcode = header[0] & 0x0F
+    masked = header[1] & 0x80
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', stream.read(8))[0]
+    mask = stream.read(4) if masked else None
+    payload = stream.read(length)
+    if mask:
+        # XOR with the repeated 4 byte mask, done as one big integer operation
+        repeated = (mask * (length // 4 + 1))[:length]
+        payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+    return opcode, payload
@@ -0,0 +1,193 @@
+"""Parameter sweep of the MACD strategy backtest (see backtest.py) across a process pool.
+
+Every combination of TICK_INTERVAL, MACD periods, stop loss and take profit given is backtested, or a
+random sample of them with --samples. Combinations sharing a tick interval and MACD periods share one
+signal series, so each pool task computes the signals once and then runs all of its stop/profit pairs.
+
+Workers open the candle store themselves, memory mapped, when they start; the bars are never pickled.
+Results stream back as tasks finish, into a CSV if asked for and into the ranked report.
+
+    python -m bitmex_bot.sweep history/XBTUSD-1m --tick 1m,5m,1h --fast 8:16:2 --slow 20:32:3 \\
+        --stop 0.003:0.015:0.002 --profit 0.005:0.03:0.005 --rank calmar
+
+Values are lists of numbers or start:stop:step ranges (both ends included); 'none' leaves a leg out.
+"""
+import os
+import csv
+import time
+import random
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bitmex_bot import indicators
+from bitmex_bot.backtest import load_bars, resample, signals, run, report, parse_factor
+from bitmex_bot.candles import BIN_SECONDS
+
+logger = logging.getLogger('root')
+
+PARAMETERS = ('tick', 'fast', 'slow', 'signal', 'stop_loss', 'take_profit')
+RANKINGS = ('net_pnl', 'calmar', 'profit_factor', 'win_rate', 'avg_trade')
+COLUMNS = PARAMETERS + ('trades', 'net_pnl', 'gross_pnl', 'fees', 'max_drawdown', 'calmar', 'profit_factor',
+                        'win_rate', 'avg_trade', 'avg_hold', 'exposure')
+
+# State of each pool worker: the memory mapped bars, and bars resampled per tick interval.
+_worker = {}
+
+
+def parse_values(text, kind=float):
+    """'1m,5m' -> ['1m', '5m']; '8:16:2' -> [8, 10, 12, 14, 16]; '0.005,0.01:0.02:0.005' -> [0.005, 0.01, ...]."""
+    values = []
+    for part in text.split(','):
+        if ':' in part:
+            start, stop, step = [float(bound) for bound in part.split(':')]
+            count = int(round((stop - start) / step)) + 1
+            values.extend(kind(round(start + i * step, 10)) for i in range(count))
+        else:
+            values.append(kind(part))
+    return values
+
+
+def combinations(space, samples=None, seed=None):
+    """Valid parameter dicts from `space` (name -> values): all of them, or `samples` picked at random."""
+    names = [name for name in PARAMETERS if name in space]
+    combos = [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+    combos = [c for c in combos if c.get('fast', 12) < c.get('slow', 26)]
+    if samples is not None and samples < len(combos):
+        combos = random.Random(seed).sample(combos, samples)
+    return combos
+
+
+def group(combos):
+    """Split combinations into pool tasks: (signal parameters, [(stop_loss, take_profit), ...])."""
+    tasks = {}
+    for c in combos:
+        key = (c.get('tick', '1m'), c.get('fast', 12), c.get('slow', 26), c.get('signal', 9))
+        tasks.setdefault(key, []).append((c.get('stop_loss'), c.get('take_profit')))
+    return list(tasks.items())
+
+
+def _init_worker(path):
+    _worker['bars'] = load_bars(path)
+    _worker['ticks'] = {}
+
+
+def _run_task(key, legs, options):
+    tick, fast, slow, signal = key
+    bars = _worker['bars']
+    if tick not in _worker['ticks']:
+        _worker['ticks'][tick] = resample(bars, tick)
+    tick_bars, last = _worker['ticks'][tick]
+    series = signals(tick_bars, options['method'], options['heikin_ashi'], fast, slow, signal)
+    results = []
+    for stop_loss, take_profit in legs:
+        trades = run(bars, series, last, stop_loss, take_profit, options['quantity'],
+                     taker_fee=options['taker_fee'], maker_fee=options['maker_fee'])
+        stats = report(trades, bars)
+        stats['calmar'] = stats['net_pnl'] / stats['max_drawdown'] if stats['max_drawdown'] else 0.
+        results.append((dict(tick=tick, fast=fast, slow=slow, signal=signal, stop_loss=stop_loss,
+                             take_profit=take_profit), stats))
+    return results
+
+
+def sweep(path, combos, workers=None, rank='net_pnl', quantity=1000, method='recursive', heikin_ashi=False,
+          taker_fee=0.00075, maker_fee=-0.00025, on_result=None, progress_interval=10.):
+    """Backtest every combination over the store at `path`. Returns [(params, stats)], best first.
+
+    on_result(params, stats) is called for each result as it comes in.
+    """
+    options = dict(quantity=quantity, method=method, heikin_ashi=heikin_ashi, taker_fee=taker_fee,
+                   maker_fee=maker_fee)
+    tasks = group(combos)
+    results = []
+    done = 0
+    start = last_progress = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as pool:
+        # Biggest tasks (shortest ticks, most legs) first, so none is left running alone at the end
+        tasks.sort(key=lambda task: (BIN_SECONDS[task[0][0]], -len(task[1])))
+        futures = [pool.submit(_run_task, key, legs, options) for key, legs in tasks]
+        for future in as_completed(futures):
+            for params, stats in future.result():
+                results.append((params, stats))
+                if on_result is not None:
+                    on_result(params, stats)
+            done += 1
+            if time.time() - last_progress >= progress_interval or done == len(futures):
+                last_progress = time.time()
+                best = max(results, key=lambda r: r[1][rank])
+                logger.info("%d/%d combinations in %.0fs; best %s so far %.6f with %s" %
+                            (len(results), len(combos), last_progress - start, rank, best[1][rank],
+                             _describe(best[0])))
+    results.sort(key=lambda r: r[1][rank], reverse=True)
+    return results
+
+
+def _describe(params):
+    return " ".join("%s=%s" % (name, params[name]) for name in PARAMETERS)
+
+
+if __name__ == "__main__":
+    from bitmex_bot.settings import settings
+
+    parser = argparse.ArgumentParser(description="Sweep MACD strategy parameters over stored candles.")
+    parser.add_argument('path', help="a bulk_download store directory or a candle cache .bin file")
+    parser.add_argument('--tick', default=settings.TICK_INTERVAL)
+    parser.add_argument('--fast', default=str(settings.MACD_FAST or 12))
+    parser.add_argument('--slow', default=str(settings.MACD_SLOW or 26))
+    parser.add_argument('--signal', default=str(settings.MACD_SIGNAL or 9))
+    parser.add_argument('--stop', default=str(parse_factor(settings.STOP_LOSS_FACTOR)))
+    parser.add_argument('--profit', default=str(parse_factor(settings.STOP_PROFIT_FACTOR)))
+    parser.add_argument('--samples', type=int, default=None, help="random search: backtest this many combinations")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--rank', default='net_pnl', choices=RANKINGS)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--csv', default=None, help="also write every result here as it comes in")
+    parser.add_argument('--quantity', type=int, default=settings.POSITION)
+    parser.add_argument('--method', default=settings.MACD_EMA_METHOD or 'recursive', choices=indicators.EMA_METHODS)
+    parser.add_argument('--heikin-ashi', action='store_true', default=bool(settings.MACD_HEIKIN_ASHI))
+    parser.add_argument('--taker-fee', type=float, default=0.00075)
+    parser.add_argument('--maker-fee', type=float, default=-0.00025)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    space = {
+        'tick': parse_values(args.tick, str),
+        'fast': parse_values(args.fast, int),
+        'slow': parse_values(args.slow, int),
+        'signal': parse_values(args.signal, int),
+        'stop_loss': parse_values(args.stop, parse_factor),
+        'take_profit': parse_values(args.profit, parse_factor),
+    }
+    for tick in space['tick']:
+        if tick not in BIN_SECONDS:
+            parser.error("unknown tick interval %s" % tick)
+    combos = combinations(space, args.samples, args.seed)
+    logger.info("Backtesting %d combinations on %d workers" % (len(combos), args.workers))
+
+    writer = None
+    if args.csv:
+        out = open(args.csv, 'w', newline='')
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS)
+
+    def write(params, stats):
+        if writer is not None:
+            row = dict(params, **stats)
+            writer.writerow([row.get(name) for name in COLUMNS])
+
+    start = time.time()
+    results = sweep(args.path, combos, args.workers, args.rank, args.quantity, args.method, args.heikin_ashi,
+                    args.taker_fee, args.maker_fee, on_result=write)
+    if writer is not None:
+        out.close()
+
+    print("%d combinations in %.0fs, top %d by %s:" % (len(results), time.time() - start, args.top, args.rank))
+    print("%4s %5s %4s %4s %6s %7s %7s %7s %11s %11s %7s %6s %6s" %
+          ('tick', 'fast', 'slow', 'sig', 'stop', 'profit', 'trades', 'win%', 'net XBT', 'max dd XBT', 'calmar',
+           'pf', 'rank'))
+    for i, (params, stats) in enumerate(results[:args.top]):
+        print("%4s %5d %4d %4d %6s %7s %7d %7.1f %11.6f %11.6f %7.2f %6.2f %6d" %
+              (params['tick'], params['fast'], params['slow'], params['signal'], params['stop_loss'],
+               params['take_profit'], stats['trades'], stats['win_rate'] * 100, stats['net_pnl'],
+               stats['max_drawdown'], stats['calmar'], stats['profit_factor'], i + 1))
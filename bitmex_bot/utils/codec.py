@@ -0,0 +1,145 @@
+"""JSON encoding and decoding for websocket frames and REST bodies.
+
+Uses orjson if it's installed, else ujson, else the standard library, all behind the same calls:
+
+    codec.loads(text_or_bytes)  -> object
+    codec.dumps(obj)            -> str, compact
+    codec.dumpb(obj)            -> bytes, compact (request bodies)
+
+Call through the module (codec.loads, not `from codec import loads`) so use() can switch backends.
+Log calls should pass codec.lazy(obj) as an argument, so nothing is serialized unless the line is emitted.
+
+    python -m bitmex_bot.utils.codec [frames.jsonl] [--repeats N]
+
+replays newline-delimited websocket frames through BitMEXWebsocket with each available backend and
+prints the median throughput, of decoding alone and of applying whole frames. Without a file it replays
+generated trade frames. After a warm-up pass the backends take turns, N rounds of each, so drift in the
+machine's speed hits them all alike; compare medians from one run, not numbers across runs.
+"""
+import json
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+name = None
+loads = dumps = dumpb = None  # set by use()
+
+
+def use(backend=None):
+    """Switch to a backend by name, or to the fastest installed one. Returns its name."""
+    global name, loads, dumps, dumpb
+    for candidate in ([backend] if backend else BACKENDS):
+        if candidate == 'orjson':
+            try:
+                import orjson
+            except ImportError:
+                continue
+            option = orjson.OPT_SERIALIZE_NUMPY
+            loads = orjson.loads
+            dumps = lambda obj: orjson.dumps(obj, option=option).decode('utf8')
+            dumpb = lambda obj: orjson.dumps(obj, option=option)
+        elif candidate == 'ujson':
+            try:
+                import ujson
+            except ImportError:
+                continue
+            loads = ujson.loads
+            dumps = ujson.dumps
+            dumpb = lambda obj: ujson.dumps(obj).encode('utf8')
+        elif candidate == 'json':
+            encoder = json.JSONEncoder(separators=(',', ':'))
+            loads = json.loads
+            dumps = encoder.encode
+            dumpb = lambda obj: encoder.encode(obj).encode('utf8')
+        else:
+            raise ValueError("Unknown JSON backend %r, expected one of %s" % (candidate, ', '.join(BACKENDS)))
+        name = candidate
+        return name
+    raise ImportError("JSON backend %r is not installed" % backend)
+
+
+def available():
+    """Names of the backends that can be imported here."""
+    current = name
+    found = []
+    for backend in BACKENDS:
+        try:
+            use(backend)
+        except ImportError:
+            continue
+        found.append(backend)
+    use(current)
+    return found
+
+
+class lazy(object):
+    """Wraps an object for logging; it's only serialized if the log record is actually formatted."""
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return dumps(self.obj)
+
+
+use()
+
+
+if __name__ == "__main__":
+    import time
+    import logging
+    import argparse
+    from statistics import median
+    from bitmex_bot.ws.ws_thread import BitMEXWebsocket
+    # Run as a script this file is __main__, a separate copy of the module; switch the one the websocket uses
+    from bitmex_bot.utils import codec
+
+    parser = argparse.ArgumentParser(description="Compare the JSON backends on websocket frames.")
+    parser.add_argument('frames', nargs='?', help="newline-delimited frames; generated trade frames if not given")
+    parser.add_argument('--repeats', type=int, default=5, help="timed rounds per backend")
+    args = parser.parse_args()
+
+    if args.frames:
+        with open(args.frames) as f:
+            frames = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        def trade(i):
+            return {'timestamp': '2018-01-01T00:%02d:%02d.%03dZ' % (i // 60000 % 60, i // 1000 % 60, i % 1000),
+                    'symbol': 'XBTUSD', 'side': 'Buy' if i % 3 else 'Sell', 'size': 100 + i % 900,
+                    'price': 13000.5 + (i % 200) / 2., 'tickDirection': 'PlusTick',
+                    'trdMatchID': '%08x-0000-0000-0000-000000000000' % i, 'grossValue': 769230, 'homeNotional': 0.0077,
+                    'foreignNotional': 100}
+        frames = [json.dumps({'table': 'trade', 'action': 'partial', 'keys': [], 'types': {}, 'data': []})]
+        frames += [json.dumps({'table': 'trade', 'action': 'insert', 'data': [trade(i * 4 + j) for j in range(4)]})
+                   for i in range(20000)]
+
+    def decode():
+        start = time.perf_counter()
+        for frame in frames:
+            codec.loads(frame)
+        return time.perf_counter() - start
+
+    def apply():
+        ws = BitMEXWebsocket()
+        start = time.perf_counter()
+        for frame in frames:
+            ws.process_message(frame)
+        return time.perf_counter() - start
+
+    logging.getLogger('root').setLevel(logging.INFO)
+    size = sum(len(frame) for frame in frames)
+    backends = codec.available()
+    timings = dict((backend, {'decode': [], 'apply': []}) for backend in backends)
+    for round in range(args.repeats + 1):
+        for backend in backends:
+            codec.use(backend)
+            decoded, applied = decode(), apply()
+            if round:  # the first round only warms up caches and allocators
+                timings[backend]['decode'].append(decoded)
+                timings[backend]['apply'].append(applied)
+    print("%d frames, %.1f MB, median of %d rounds" % (len(frames), size / 1e6, args.repeats))
+    for backend in backends:
+        decoded, applied = median(timings[backend]['decode']), median(timings[backend]['apply'])
+        print("%-7s decode %8.0f frames/s %6.1f MB/s   apply %8.0f frames/s  (apply min-max %.0f-%.0f)" %
+              (backend, len(frames) / decoded, size / decoded / 1e6, len(frames) / applied,
+               len(frames) / max(timings[backend]['apply']), len(frames) / min(timings[backend]['apply'])))
@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class EventBoard(object):
+    """Change notifications between threads, e.g. from the websocket thread to the order manager.
+
+    Publishers bump a version counter per event name ('order', 'position', 'bar:XBTUSD:1m', ...). Consumers keep
+    the versions they last saw and block in wait() until any of the names they care about moves on.
+    Bursts of changes collapse into one wakeup, and nothing is queued up for slow consumers.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.counters = {}
+
+    def publish(self, name):
+        with self.condition:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            self.condition.notify_all()
+
+    def versions(self, names):
+        with self.condition:
+            return dict((name, self.counters.get(name, 0)) for name in names)
+
+    def wait(self, since, timeout=None):
+        """Block until a name in `since` has a newer version than the one given, or until timeout.
+
+        Returns (changed, versions): the names that changed, and the current versions to pass next time.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                changed = [name for name, version in since.items() if self.counters.get(name, 0) != version]
+                remaining = None if deadline is None else deadline - time.time()
+                if changed or (remaining is not None and remaining <= 0):
+                    return changed, dict((name, self.counters.get(name, 0)) for name in since)
+                self.condition.wait(remaining)
@@ -0,0 +1,122 @@
+import threading
+import time
+
+# Request priorities, most urgent first. Cancels may dip into the reserve that new orders leave alone.
+CANCEL = 0
+NORMAL = 1
+
+
+class RateLimiter(object):
+    """Client side token bucket for the BitMEX REST ratelimit.
+
+    BitMEX allows `limit` requests per minute per API key and refills the budget steadily. The bucket
+    refills at the same rate locally and is corrected from the X-RateLimit-* headers of every response,
+    so requests made by other bots on the same key are accounted for as well.
+
+    Callers take a token with acquire() before each request and block until one is free rather than
+    getting a 429. NORMAL requests leave `reserve` tokens untouched, and wait while any CANCEL is
+    queued, so pulling orders is never held up behind new ones.
+    """
+
+    def __init__(self, limit=60, reserve=5):
+        self.condition = threading.Condition()
+        self.limit = limit
+        self.reserve = reserve
+        self.tokens = float(limit)
+        self.updated = time.time()
+        self.hold_until = 0.  # no requests at all before this, e.g. after a 429
+        self.urgent = 0  # CANCEL callers currently waiting
+        # Stats
+        self.requests = 0
+        self.deferred = 0
+        self.waited = 0.
+
+    def acquire(self, priority=NORMAL):
+        """Take a token, blocking until one is available. Returns the seconds spent waiting."""
+        start = time.time()
+        with self.condition:
+            if priority == CANCEL:
+                self.urgent += 1
+            try:
+                wait = self.__take(priority)
+                while wait:
+                    self.condition.wait(wait)
+                    wait = self.__take(priority)
+            finally:
+                if priority == CANCEL:
+                    self.urgent -= 1
+                    self.condition.notify_all()
+            waited = time.time() - start
+            if waited > 0.001:
+                self.deferred += 1
+                self.waited += waited
+            return waited
+
+    def try_acquire(self, priority=NORMAL):
+        """Take a token if one is free. Returns 0 if taken, otherwise how many seconds to wait before retrying.
+
+        For callers that can't block the thread (e.g. an asyncio loop); they should report the time they
+        spent waiting with record_wait().
+        """
+        with self.condition:
+            return self.__take(priority)
+
+    def record_wait(self, seconds):
+        with self.condition:
+            self.deferred += 1
+            self.waited += seconds
+
+    def update(self, headers):
+        """Correct the bucket from the X-RateLimit-* headers of a response."""
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        with self.condition:
+            self.__refill()
+            self.limit = int(headers.get('X-RateLimit-Limit', self.limit))
+            self.tokens = min(float(headers['X-RateLimit-Remaining']), self.limit)
+            self.condition.notify_all()
+
+    def hold(self, until):
+        """Let no request through before `until` (unix time), e.g. the X-RateLimit-Reset of a 429."""
+        with self.condition:
+            self.__refill()  # so the time before the hold isn't credited again later
+            self.tokens = 0.
+            self.hold_until = max(self.hold_until, until)
+
+    def stats(self):
+        with self.condition:
+            self.__refill()
+            return {'tokens': int(self.tokens), 'limit': self.limit, 'requests': self.requests,
+                    'deferred': self.deferred, 'waited': self.waited}
+
+    def __refill(self):
+        now = time.time()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / 60.)
+        self.updated = now
+
+    def __take(self, priority):
+        """Take a token if allowed and return 0, or return how long to wait. Called with the lock held."""
+        self.__refill()
+        now = self.updated
+        if now < self.hold_until:
+            return self.hold_until - now
+        floor = 1 if priority == CANCEL else 1 + self.reserve
+        if priority != CANCEL and self.urgent:
+            return 60. / self.limit  # woken early by notify_all once the cancels are through
+        if self.tokens >= floor:
+            self.tokens -= 1
+            self.requests += 1
+            return 0
+        return (floor - self.tokens) * 60. / self.limit
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_limiter(apiKey, **kwargs):
+    """The RateLimiter for an API key, shared by every client in this process using that key."""
+    with _shared_lock:
+        if apiKey not in _shared:
+            _shared[apiKey] = RateLimiter(**kwargs)
+        return _shared[apiKey]
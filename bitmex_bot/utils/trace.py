@@ -0,0 +1,201 @@
+"""Latency tracing for the hot path, from a websocket frame arriving to our order's REST response.
+
+Each stage records how long it took into a log-linear histogram (HDR style): values are bucketed
+exactly below 2**SIGNIFICANT_BITS nanoseconds, and above that into 2**(SIGNIFICANT_BITS - 1) buckets
+per power of two, so any value is known to within about 3% at a fixed memory cost, with no allocation
+per sample. Stages:
+
+    ws.parse            decoding a frame                          (websocket thread)
+    ws.apply            applying it to the tables or order book
+    ws.bar              folding trades into the candle series
+    bot.trade_to_check  the last trade print's age when a check starts  (bot thread)
+    bot.indicator       bringing the MACD up to date
+    bot.check           a strategy's whole sanity check, orders included
+    bot.trade_to_entry  trade print to the decision to enter at market
+    rest.ratelimit      waiting for ratelimit room
+    rest.sign           preparing and signing a request, once there is room
+    rest.http           sending a request until its response is in
+    bot.trade_to_order  trade print to the market entry's response
+
+Tracing is off unless enable() is called (settings.TRACE). Call sites check the module level `on`
+first, so all it costs when off is that one test:
+
+    started = trace.now() if trace.on else 0
+    ...
+    if trace.on:
+        trace.record('ws.parse', started)
+
+Once enabled, the histograms are logged every `interval` seconds, on SIGUSR1, and by dump().
+"""
+import signal
+import logging
+import threading
+from time import perf_counter_ns
+
+logger = logging.getLogger('root')
+
+SIGNIFICANT_BITS = 6
+_HALF = 1 << (SIGNIFICANT_BITS - 1)
+# Longest value tracked precisely; anything longer goes into the last bucket. 2**40ns is about 18 minutes.
+MAX_MAGNITUDE = 40
+
+# Set by enable(); call sites skip all tracing while it is False.
+on = False
+now = perf_counter_ns
+
+_histograms = {}  # stage -> Histogram
+_marks = {}  # name -> perf_counter_ns of the latest event of that kind, e.g. 'trade'
+_lock = threading.Lock()
+_dumper = None
+
+
+class Histogram(object):
+    """Log-linear histogram of nanosecond durations. Records in O(1) without allocating.
+
+    Stages are recorded from several threads (websocket, bot, REST callers), and `+=` is not atomic, so
+    updates go under the histogram's own lock.
+    """
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_MAGNITUDE - SIGNIFICANT_BITS + 2) * _HALF + _HALF)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        shift = value.bit_length() - SIGNIFICANT_BITS
+        index = value if shift <= 0 else shift * _HALF + (value >> shift)
+        counts = self.counts
+        if index >= len(counts):
+            index = -1
+        with self.lock:
+            counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """The value below which `q` percent of the recorded values fall, to within a bucket."""
+        if not self.count:
+            return 0
+        target = max(1, int(round(self.count * q / 100.)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.max, _bucket_top(index))
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def merge(self, other):
+        # Take a consistent copy of `other` first; holding both locks at once could deadlock two merges.
+        with other.lock:
+            counts = list(other.counts)
+            count, total, maximum = other.count, other.total, other.max
+        with self.lock:
+            for index, n in enumerate(counts):
+                if n:
+                    self.counts[index] += n
+            self.count += count
+            self.total += total
+            self.max = max(self.max, maximum)
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.merge(self)
+        return histogram
+
+
+def _bucket_top(index):
+    """Largest value that falls into bucket `index`."""
+    if index < 2 * _HALF:
+        return index
+    shift = index // _HALF - 1
+    return ((index - shift * _HALF + 1) << shift) - 1
+
+
+def histogram(stage):
+    """The histogram of a stage, created on first use."""
+    h = _histograms.get(stage)
+    if h is None:
+        with _lock:
+            h = _histograms.setdefault(stage, Histogram())
+    return h
+
+
+def record(stage, started, ended=None):
+    """Record the time from `started` (a now() value) to `ended`, or to now, for a stage."""
+    histogram(stage).record((now() if ended is None else ended) - started)
+
+
+def mark(name, when=None):
+    """Note when the latest event called `name` happened, for since()."""
+    _marks[name] = now() if when is None else when
+
+
+def since(stage, name):
+    """Record the time since the latest mark(name) for a stage. Does nothing before the first mark."""
+    when = _marks.get(name)
+    if when is not None:
+        record(stage, when)
+
+
+def snapshot():
+    """Copies of every stage's histogram, by stage."""
+    with _lock:
+        stages = list(_histograms.items())
+    return dict((stage, h.copy()) for stage, h in stages)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _marks.clear()
+
+
+def report(histograms=None):
+    """The histograms as a table, in microseconds."""
+    histograms = snapshot() if histograms is None else histograms
+    lines = ["%-20s %9s %10s %10s %10s %10s %10s %10s" %
+             ('stage', 'count', 'mean', 'p50', 'p90', 'p99', 'p99.9', 'max')]
+    for stage in sorted(histograms):
+        h = histograms[stage]
+        lines.append("%-20s %9d %10.1f %10.1f %10.1f %10.1f %10.1f %10.1f" %
+                     (stage, h.count, h.mean() / 1e3, h.percentile(50) / 1e3, h.percentile(90) / 1e3,
+                      h.percentile(99) / 1e3, h.percentile(99.9) / 1e3, h.max / 1e3))
+    return "\n".join(lines)
+
+
+def dump(*args):
+    """Log the histograms. Also the SIGUSR1 handler, hence the ignored arguments."""
+    logger.info("Latency by stage, in microseconds:\n%s" % report())
+
+
+def enable(interval=None):
+    """Start tracing. Histograms are dumped on SIGUSR1 and, if given, every `interval` seconds."""
+    global on, _dumper
+    on = True
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, dump)
+    if interval and _dumper is None:
+        _dumper = threading.Thread(target=_dump_every, args=(interval,), name='trace-dump')
+        _dumper.daemon = True
+        _dumper.start()
+
+
+def disable():
+    global on
+    on = False
+
+
+def _dump_every(interval):
+    stopped = threading.Event()
+    while not stopped.wait(interval):
+        if on:
+            dump()
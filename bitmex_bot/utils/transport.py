@@ -0,0 +1,127 @@
+"""HTTP transport shared by the REST clients.
+
+new_session() returns a requests.Session whose connection pools are sized for how many requests we
+have in flight, so connections are kept alive and reused instead of being opened (TCP + TLS) per
+request. Connection failures are retried by the adapter; nothing else is, since BitMEX._curl_bitmex
+decides itself what is safe to resend.
+
+Every response gets a `timings` dict with the seconds spent on TCP connect, the TLS handshake and
+waiting for the first byte, and whether a kept-alive connection was reused (connect/tls are 0 then).
+The totals are kept on the adapter: session.get_adapter(url).stats().
+"""
+import threading
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('root')
+
+# Connect/TLS times of the connection opened by the request in progress, per thread.
+_connecting = threading.local()
+
+
+class _TimedConnection(object):
+    """Mixin for urllib3 connections that records how long connecting and the TLS handshake took."""
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super(_TimedConnection, self)._new_conn()
+        _connecting.tcp = time.perf_counter() - start
+        return sock
+
+    def connect(self):
+        _connecting.tcp = 0.
+        start = time.perf_counter()
+        super(_TimedConnection, self).connect()
+        total = time.perf_counter() - start
+        _connecting.connect = _connecting.tcp
+        _connecting.tls = max(0., total - _connecting.tcp)
+
+
+class TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that times each request (see module docstring) and keeps running totals."""
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.totals = {'requests': 0, 'connections': 0, 'connect': 0., 'tls': 0., 'ttfb': 0.}
+        super(TimedHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        _connecting.connect = None
+        start = time.perf_counter()
+        response = super(TimedHTTPAdapter, self).send(request, **kwargs)
+        elapsed = time.perf_counter() - start
+        reused = _connecting.connect is None
+        connect = 0. if reused else _connecting.connect
+        tls = 0. if reused else _connecting.tls
+        # The body isn't read yet (requests does that later), so this is up to the response headers
+        ttfb = max(0., elapsed - connect - tls)
+        response.timings = {'connect': connect, 'tls': tls, 'ttfb': ttfb, 'reused': reused}
+        with self.lock:
+            totals = self.totals
+            totals['requests'] += 1
+            totals['connections'] += 0 if reused else 1
+            totals['connect'] += connect
+            totals['tls'] += tls
+            totals['ttfb'] += ttfb
+        return response
+
+    def stats(self):
+        """Request and new connection counts, and total seconds spent connecting, on TLS and waiting."""
+        with self.lock:
+            return dict(self.totals)
+
+
+def new_session(pool_size=10, retries=2, backoff=0.2, headers=None):
+    """A requests.Session with keep-alive connection pools of `pool_size` and timed requests.
+
+    `retries` only covers failures to connect, where the request never left us, so it is safe for
+    POSTs too.
+    """
+    retry = Retry(total=retries, connect=retries, read=0, status=0, redirect=0, other=0,
+                  backoff_factor=backoff, raise_on_status=False)
+    adapter = TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def prewarm(session, url, timeout=5):
+    """Open a connection to `url`'s host ahead of time, so the first real request doesn't pay for it."""
+    try:
+        response = session.head(url, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        logger.warning("Unable to pre-warm connection to %s: %s" % (url, e))
+        return None
+    timings = response.timings
+    logger.info("Connected to %s: connect %.1fms, TLS %.1fms, first byte %.1fms" %
+                (url, timings['connect'] * 1000, timings['tls'] * 1000, timings['ttfb'] * 1000))
+    return timings
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+# Columnar storage for tick streams (trades, quotes) and the series built from them, like the live candles.
+# Each column is a preallocated NumPy array with ring semantics, so appending a tick never allocates
+# and indicator code can work on plain contiguous arrays instead of lists of dicts.
+#
+# Every column is stored twice over (length 2 * capacity) and each value is written to both halves.
+# That way the most recent N values (N <= capacity) always sit in one contiguous slice, and `column()`
+# can hand out a view instead of stitching the two ends of the ring together.
+class ColumnStore(object):
+
+    def __init__(self, columns, capacity):
+        if capacity < 1:
+            raise ValueError("ColumnStore capacity must be at least 1")
+        self.capacity = capacity
+        self.names = [name for name, dtype in columns]
+        self._columns = dict((name, np.zeros(2 * capacity, dtype=dtype)) for name, dtype in columns)
+        self._total = 0  # values ever appended
+
+    def append(self, **values):
+        '''Append one row given as column=value keyword arguments.'''
+        self.extend(**dict((name, [value]) for name, value in values.items()))
+
+    def extend(self, **columns):
+        '''Append a batch of rows given as column=sequence keyword arguments, all of the same length.'''
+        count = len(columns[self.names[0]])
+        if not count:
+            return
+        skip = max(0, count - self.capacity)  # only the newest `capacity` rows can survive anyway
+        slots = (self._total + skip + np.arange(count - skip)) % self.capacity
+        for name in self.names:
+            values = np.asarray(columns[name])[skip:]
+            column = self._columns[name]
+            column[slots] = values
+            column[slots + self.capacity] = values
+        self._total += count
+
+    def column(self, name, count=None):
+        '''Return a contiguous, read-only view of the newest `count` values of a column, oldest first.'''
+        size = len(self)
+        count = size if count is None else max(0, min(count, size))
+        end = (self._total - 1) % self.capacity + 1 + self.capacity
+        view = self._columns[name][end - count:end]
+        view.flags.writeable = False
+        return view
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def __len__(self):
+        return min(self._total, self.capacity)
+
+    def __repr__(self):
+        return "ColumnStore(columns=%r, rows=%d)" % (self.names, len(self))
+
+
+TRADE_COLUMNS = [
+    ('timestamp', np.int64),  # ns since epoch
+    ('price', np.float64),
+    ('size', np.int64),
+    ('side', np.int8),  # 1 for Buy, -1 for Sell
+]
+
+QUOTE_COLUMNS = [
+    ('timestamp', np.int64),  # ns since epoch
+    ('bidPrice', np.float64),
+    ('askPrice', np.float64),
+    ('bidSize', np.int64),
+    ('askSize', np.int64),
+]
+
+
+def parse_timestamps(timestamps):
+    '''Convert BitMEX ISO 8601 timestamps ("2018-01-01T00:00:00.000Z") to int64 ns since epoch.'''
+    # numpy parses naive ISO strings; BitMEX timestamps are always UTC, so just drop the 'Z'.
+    return np.array([t.rstrip('Z') for t in timestamps], dtype='datetime64[ns]').astype(np.int64)
+
+
+def trade_columns(rows):
+    '''Turn a batch of websocket trade rows into TRADE_COLUMNS arrays.'''
+    return {
+        'timestamp': parse_timestamps([r['timestamp'] for r in rows]),
+        'price': np.array([r['price'] for r in rows], dtype=np.float64),
+        'size': np.array([r['size'] for r in rows], dtype=np.int64),
+        'side': np.array([1 if r['side'] == 'Buy' else -1 for r in rows], dtype=np.int8),
+    }
+
+
+def quote_columns(rows):
+    '''Turn a batch of websocket quote rows into QUOTE_COLUMNS arrays. Missing prices become NaN.'''
+    return {
+        'timestamp': parse_timestamps([r['timestamp'] for r in rows]),
+        'bidPrice': np.array([r['bidPrice'] for r in rows], dtype=np.float64),
+        'askPrice': np.array([r['askPrice'] for r in rows], dtype=np.float64),
+        'bidSize': np.array([r['bidSize'] or 0 for r in rows], dtype=np.int64),
+        'askSize': np.array([r['askSize'] or 0 for r in rows], dtype=np.int64),
+    }
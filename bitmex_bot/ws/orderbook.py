@@ -0,0 +1,173 @@
+import bisect
+from time import sleep
+
+
+# Price levels of one symbol's orderBookL2 (or orderBookL2_25) table, kept sorted as the WS streams them.
+#
+# BitMEX identifies a level by (symbol, id, side). Inserts carry the price, but updates and deletes only
+# the id, so we map id -> (side, price). Each side keeps a {price: size} dict and an ascending list of its
+# prices: a size update is a dict write, and a level coming or going is a bisect into the price list. The
+# best levels are at the end of the bid list and the start of the ask list, so reads slice or walk the
+# list from there and never sort or rebuild it.
+#
+# The WS thread writes while the bot reads. Rather than lock, the book is a seqlock: the writer bumps
+# `version` before and after applying a message (it is odd while a message is half applied), and readers
+# retry whenever the version moved under them, so every answer comes from one consistent book.
+class OrderBookL2(object):
+
+    SIDES = ('Buy', 'Sell')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.version = 0
+        self._ids = {}  # id -> (side, price)
+        self._sizes = {'Buy': {}, 'Sell': {}}  # side -> {price: size}
+        self._prices = {'Buy': [], 'Sell': []}  # side -> ascending prices
+
+    #
+    # Writing, from the WS thread
+    #
+    def apply(self, action, rows):
+        '''Apply one partial/insert/update/delete message's rows for this symbol.'''
+        self.version += 1
+        try:
+            if action == 'partial':
+                self._ids.clear()
+                for side in self.SIDES:
+                    self._sizes[side] = {}
+                    self._prices[side] = []
+                action = 'insert'
+            for row in rows:
+                if action == 'insert':
+                    self.__insert(row)
+                elif action == 'update':
+                    self.__update(row)
+                elif action == 'delete':
+                    self.__delete(row)
+                else:
+                    raise Exception("Unknown action: %s" % action)
+        finally:
+            self.version += 1
+
+    def __insert(self, row):
+        side, price = row['side'], row['price']
+        old = self._ids.get(row['id'])
+        if old is not None:
+            self.__drop(*old)
+        self._ids[row['id']] = (side, price)
+        sizes = self._sizes[side]
+        if price not in sizes:
+            bisect.insort(self._prices[side], price)
+        sizes[price] = row['size']
+
+    def __update(self, row):
+        level = self._ids.get(row['id'])
+        if level is None:
+            return  # not in our image; BitMEX resends it with an insert if it matters
+        side, price = level
+        if row.get('side', side) != side:
+            self.__drop(side, price)
+            side = row['side']
+            self._ids[row['id']] = (side, price)
+            prices = self._prices[side]
+            at = bisect.bisect_left(prices, price)
+            if at == len(prices) or prices[at] != price:  # the level may already be on this side
+                prices.insert(at, price)
+        self._sizes[side][price] = row['size']
+
+    def __delete(self, row):
+        level = self._ids.pop(row['id'], None)
+        if level is not None:
+            self.__drop(*level)
+
+    def __drop(self, side, price):
+        if self._sizes[side].pop(price, None) is not None:
+            prices = self._prices[side]
+            del prices[bisect.bisect_left(prices, price)]
+
+    #
+    # Reading, from any thread
+    #
+    def best(self, side, count=1):
+        '''The best `count` (price, size) levels on a side of the book ('Buy': bids, 'Sell': asks), best first.'''
+        return self.__read(self.__best, side, count)
+
+    def depth_at(self, side, price):
+        '''Size resting at exactly `price` on a side of the book, 0 if there is no level there.'''
+        return self.__read(self.__depth_at, side, price)
+
+    def depth_to(self, side, price):
+        '''Total size on a side of the book from the best level up to and including `price`.'''
+        return self.__read(self.__depth_to, side, price)
+
+    def vwap(self, side, quantity):
+        '''Average price a market order on `side` for `quantity` would fill at: a 'Buy' takes the asks.
+
+        Returns (price, filled). `filled` is less than `quantity` if the book runs out first, and price is
+        None if that side is empty.
+        '''
+        return self.__read(self.__vwap, side, quantity)
+
+    def slippage(self, side, quantity):
+        '''(vwap, best, filled) for a market order: its average fill price, and the touch price it takes.'''
+        return self.__read(self.__slippage, side, quantity)
+
+    def is_empty(self):
+        return not self._ids
+
+    def __read(self, fn, *args):
+        while True:
+            version = self.version
+            if not version % 2:
+                try:
+                    result = fn(*args)
+                except (IndexError, KeyError, RuntimeError):
+                    if self.version == version:
+                        raise
+                else:
+                    if self.version == version:
+                        return result
+            sleep(0)  # let the writer finish the message
+
+    def __levels(self, side):
+        '''(price, size) levels of a side of the book, best first, read straight off the sorted prices.'''
+        prices, sizes = self._prices[side], self._sizes[side]
+        indices = range(len(prices) - 1, -1, -1) if side == 'Buy' else range(len(prices))
+        for i in indices:
+            price = prices[i]
+            yield price, sizes[price]
+
+    def __best(self, side, count):
+        prices, sizes = self._prices[side], self._sizes[side]
+        best = prices[:-count - 1:-1] if side == 'Buy' else prices[:count]
+        return [(price, sizes[price]) for price in best]
+
+    def __depth_at(self, side, price):
+        return self._sizes[side].get(price, 0)
+
+    def __depth_to(self, side, price):
+        prices, sizes = self._prices[side], self._sizes[side]
+        if side == 'Buy':
+            levels = prices[bisect.bisect_left(prices, price):]
+        else:
+            levels = prices[:bisect.bisect_right(prices, price)]
+        return sum(sizes[p] for p in levels)
+
+    def __vwap(self, side, quantity):
+        filled = cost = 0
+        for price, size in self.__levels('Sell' if side == 'Buy' else 'Buy'):
+            take = min(size, quantity - filled)
+            filled += take
+            cost += take * price
+            if filled >= quantity:
+                break
+        return (cost / filled if filled else None), filled
+
+    def __slippage(self, side, quantity):
+        price, filled = self.__vwap(side, quantity)
+        best = self.__best('Sell' if side == 'Buy' else 'Buy', 1)
+        return price, best[0][0] if best else None, filled
+
+    def __repr__(self):
+        return "OrderBookL2(%s, bids=%d, asks=%d)" % (self.symbol, len(self._prices['Buy']),
+                                                      len(self._prices['Sell']))
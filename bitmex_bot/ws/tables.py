@@ -0,0 +1,305 @@
+
+# Storage for websocket tables that BitMEX identifies by primary key.
+# The 'partial' for a table tells us which fields make up the key (e.g. ['orderID'] for orders,
+# ['account', 'symbol', 'currency'] for positions). Rows are indexed by that key tuple so that
+# 'update' and 'delete' messages can find their row without scanning the table.
+#
+# Insertion order is preserved, and the object quacks enough like a list (iteration, len, indexing)
+# that existing callers of `ws.data[table]` keep working.
+#
+# Secondary indexes (e.g. on 'symbol') can be requested for fields that callers filter on. They are
+# maintained incrementally as rows come and go, so `lookup('symbol', 'XBTUSD')` never scans the table.
+#
+# The WS thread writes while the bot reads, so the table is copy-on-write. Writes go to a private working
+# copy and only become visible to readers on publish(), which the WS thread calls once per message. A
+# published snapshot is never changed afterwards: rows are replaced rather than updated in place, and
+# the first write after a publish copies the row map (and each index bucket it touches) before changing
+# it. Readers never lock and never see half of a message applied, or half of a row update.
+class KeyedTable(object):
+
+    def __init__(self, keys, rows=(), indexes=()):
+        self.keys = list(keys)
+        self._rows = {}  # key -> row; dicts keep insertion order, and copy much faster than OrderedDicts
+        self._indexes = dict((field, {}) for field in indexes)
+        self._owned = None  # index buckets copied since the last publish; None until the first write after it
+        self._snapshot = None
+        self.extend(rows)
+        self.publish()
+
+    def keyOf(self, data):
+        '''Return the primary key tuple for a row, or for the key fields of an update/delete.'''
+        return tuple(data[key] for key in self.keys)
+
+    def snapshot(self):
+        '''The last published state, as a KeyedSnapshot that will not change. Reads of ws.data go here.'''
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def publish(self):
+        '''Make everything written since the last publish visible to readers, in one step.'''
+        if self._owned is None and self._snapshot is not None:
+            return self._snapshot
+        self._snapshot = KeyedSnapshot(self, self._rows, self._indexes,
+                                       self._snapshot.version + 1 if self._snapshot else 0)
+        self._owned = None
+        return self._snapshot
+
+    def find(self, matchData, latest=False):
+        '''Return the row whose key matches matchData, or None.
+
+        Pass latest=True from the writing thread to see writes that aren't published yet.
+        '''
+        if latest:
+            return self._rows.get(self.keyOf(matchData))
+        return self._snapshot.find(matchData)
+
+    def lookup(self, field, value):
+        '''Return the rows whose indexed `field` equals `value`, in insertion order.'''
+        return self._snapshot.lookup(field, value)
+
+    def append(self, row):
+        key = self.keyOf(row)
+        if key in self._rows:
+            # BitMEX may re-send a row we already hold; treat it as a full replacement.
+            self.discard(row)
+        self.__own()
+        self._rows[key] = row
+        self.__index(key, row)
+
+    def update(self, item, updateData):
+        '''Replace a row held by this table with a copy that has updateData applied, and return the copy.
+
+        Readers holding the old row keep an unchanged row.
+        '''
+        key = self.keyOf(item)
+        old = self._rows[key]
+        row = dict(old)
+        row.update(updateData)
+        self.__own()
+        self._rows[key] = row
+        moved = [field for field in self._indexes if field in updateData and updateData[field] != old.get(field)]
+        self.__unindex(key, old, moved)
+        self.__index(key, row)
+        return row
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def discard(self, matchData):
+        '''Remove and return the row whose key matches matchData, if present.'''
+        key = self.keyOf(matchData)
+        if key not in self._rows:
+            return None
+        self.__own()
+        item = self._rows.pop(key)
+        self.__unindex(key, item)
+        return item
+
+    def remove(self, item):
+        '''List-compatible removal. Raises ValueError if the row is not in the table.'''
+        if self.discard(item) is None:
+            raise ValueError("KeyedTable.remove(x): x not in table")
+
+    def __iadd__(self, rows):
+        self.extend(rows)
+        return self
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def __getitem__(self, index):
+        return self._snapshot[index]
+
+    def __own(self):
+        '''Before the first write since a publish, copy the structures the published snapshot shares.'''
+        if self._owned is None:
+            self._rows = self._rows.copy()
+            self._indexes = dict((field, buckets.copy()) for field, buckets in self._indexes.items())
+            self._owned = set()
+
+    def __bucket(self, field, value):
+        '''The working index bucket for field == value, copied first if the published snapshot shares it.'''
+        buckets = self._indexes[field]
+        if (field, value) not in self._owned:
+            buckets[value] = dict(buckets.get(value, ()))
+            self._owned.add((field, value))
+        return buckets[value]
+
+    def __index(self, key, row, fields=None):
+        for field in fields or self._indexes:
+            self.__bucket(field, row.get(field))[key] = row
+
+    def __unindex(self, key, row, fields=None):
+        for field in self._indexes if fields is None else fields:
+            if row.get(field) not in self._indexes[field]:
+                continue
+            bucket = self.__bucket(field, row.get(field))
+            bucket.pop(key, None)
+            if not bucket:
+                del self._indexes[field][row.get(field)]
+
+    def __repr__(self):
+        return "KeyedTable(keys=%r, rows=%d, version=%d)" % (self.keys, len(self._rows), self.version)
+
+
+class KeyedSnapshot(object):
+    '''One published, immutable state of a KeyedTable. Hold on to it to read several things consistently.'''
+    __slots__ = ('keyOf', 'version', '_rows', '_indexes', '_list')
+
+    def __init__(self, table, rows, indexes, version):
+        self.keyOf = table.keyOf
+        self.version = version
+        self._rows = rows
+        self._indexes = indexes
+        self._list = None
+
+    def find(self, matchData):
+        return self._rows.get(self.keyOf(matchData))
+
+    def lookup(self, field, value):
+        return list(self._indexes[field].get(value, {}).values())
+
+    def rows(self):
+        '''All rows, in insertion order, as a list built once per snapshot. Don't modify it.'''
+        if self._list is None:
+            self._list = list(self._rows.values())
+        return self._list
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def __getitem__(self, index):
+        return self.rows()[index]
+
+    def __repr__(self):
+        return "KeyedSnapshot(rows=%d, version=%d)" % (len(self._rows), self.version)
+
+
+# Fixed-capacity storage for append-only streams (trade, quote, execution).
+# Rows are written into a preallocated circular buffer, so once the table is full each insert evicts
+# the oldest row in O(1) instead of periodically copying half the table away.
+#
+# Every row gets a sequence number as it is appended; row `seq` lives at slot `seq % capacity` and is
+# valid while it is within `capacity` of the newest row. Views returned by `tail()` are defined in
+# terms of sequence numbers, so they stay stable while the stream keeps flowing.
+#
+# Like KeyedTable, appended rows only become visible to readers on publish(). snapshot() copies rows out
+# without locking, seqlock style: the writer claims a slot before overwriting it, and a reader whose copy
+# raced with the writer lapping it (the oldest rows it copied were claimed meanwhile) simply copies again.
+class RingTable(object):
+
+    def __init__(self, capacity, rows=()):
+        if capacity < 1:
+            raise ValueError("RingTable capacity must be at least 1")
+        self.capacity = capacity
+        self._buf = [None] * capacity
+        self._total = 0  # rows ever appended; the next row gets this sequence number
+        self._claimed = 0  # slots handed to the writer; runs one ahead of _total while a row is being stored
+        self._published = 0  # rows readers can see
+        self.extend(rows)
+        self.publish()
+
+    def append(self, row):
+        self._claimed = self._total + 1
+        self._buf[self._total % self.capacity] = row
+        self._total += 1
+
+    def publish(self):
+        '''Make the rows appended since the last publish visible to readers.'''
+        self._published = self._total
+
+    @property
+    def version(self):
+        return self._published
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def tail(self, count=None):
+        '''Return a view over the most recent `count` rows (all rows if None), without copying them.
+
+        Iterating a view raises IndexError if the writer evicts rows it hasn't got to yet; use snapshot()
+        for a copy that is consistent even while the stream is being written.
+        '''
+        end = self._published
+        size = min(end, self.capacity)
+        count = size if count is None else max(0, min(count, size))
+        return RingView(self, end - count, end)
+
+    def snapshot(self, count=None):
+        '''Return the most recent `count` published rows (all if None) as a tuple, oldest first.'''
+        buf, capacity = self._buf, self.capacity
+        while True:
+            end = self._published
+            size = min(end, capacity)
+            start = end - (size if count is None else max(0, min(count, size)))
+            rows = tuple([buf[seq % capacity] for seq in range(start, end)])
+            if start >= self._claimed - capacity:
+                return rows
+
+    def rowAt(self, seq):
+        '''Return the row with sequence number seq. Raises IndexError once it has been evicted.'''
+        if not self._claimed - self.capacity <= seq < self._published:
+            raise IndexError("RingTable row %d is no longer held" % seq)
+        row = self._buf[seq % self.capacity]
+        if seq < self._claimed - self.capacity:
+            raise IndexError("RingTable row %d is no longer held" % seq)  # overwritten while we read it
+        return row
+
+    def __iadd__(self, rows):
+        self.extend(rows)
+        return self
+
+    def __len__(self):
+        return min(self._published, self.capacity)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __getitem__(self, index):
+        return self.tail()[index]
+
+    def __repr__(self):
+        return "RingTable(capacity=%d, rows=%d)" % (self.capacity, len(self))
+
+
+class RingView(object):
+    '''A read-only window onto a RingTable, covering sequence numbers [start, end).'''
+
+    def __init__(self, table, start, end):
+        self.table = table
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        for seq in range(self.start, self.end):
+            yield self.table.rowAt(seq)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return RingView(self.table, self.start + start, self.start + max(start, stop))
+            return [self.table.rowAt(self.start + i) for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("RingView index out of range")
+        return self.table.rowAt(self.start + index)
+
+    def __repr__(self):
+        return "RingView(rows=%d)" % len(self)
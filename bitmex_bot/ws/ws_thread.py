@@ -4,13 +4,21 @@ import threading
 import traceback
 import ssl
 from time import sleep
-import json
 import decimal
 import logging
+import numpy as np
 from bitmex_bot.settings import settings
-from bitmex_bot.auth.APIKeyAuth import generate_nonce, generate_signature
+from bitmex_bot.auth.APIKeyAuth import generate_nonce
+from bitmex_bot.auth.RequestSigner import RequestSigner
 from bitmex_bot.utils.log import setup_custom_logger
 from bitmex_bot.utils.math import toNearest
+from bitmex_bot.utils.events import EventBoard
+from bitmex_bot.utils import codec
+from bitmex_bot.utils import errors
+from bitmex_bot.utils import trace
+from bitmex_bot.ws.tables import KeyedTable, RingTable
+from bitmex_bot.ws.orderbook import OrderBookL2
+from bitmex_bot.ws import columns
 from future.utils import iteritems
 from future.standard_library import hooks
 with hooks():  # Python 2/3 compat
@@ -28,61 +36,130 @@ with hooks():  # Python 2/3 compat
 class BitMEXWebsocket():
 
     # Don't grow a table larger than this amount. Helps cap memory usage.
+    # Per-table capacities can be set with settings.TABLE_CAPACITY; this is the default.
     MAX_TABLE_LEN = 200
 
+    # Tick streams that are also kept as NumPy columns, per symbol, for indicator code.
+    COLUMN_TABLES = {
+        'trade': (columns.TRADE_COLUMNS, columns.trade_columns),
+        'quote': (columns.QUOTE_COLUMNS, columns.quote_columns),
+    }
+
+    # Order book tables, kept per symbol as sorted price levels (see orderbook.py) instead of in self.data.
+    BOOK_TABLES = ('orderBookL2', 'orderBookL2_25')
+
+    # Secondary indexes kept on keyed tables, for the fields our data methods filter on.
+    TABLE_INDEXES = {
+        'order': ['symbol'],
+        'position': ['symbol'],
+    }
+
     def __init__(self):
         self.logger = logging.getLogger('root')
+        self.ws = None
+        self.listeners = {}
+        # Set to a capture.CaptureWriter to record every frame as it arrives
+        self.capture = None
+        # Every applied table change is published here under the table's name
+        self.events = EventBoard()
         self.__reset()
 
     def __del__(self):
         self.exit()
 
-    def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True):
-        '''Connect to the websocket and initialize data stores.'''
+    def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True, apiKey=None, signer=None):
+        '''Connect to the websocket and initialize data stores.
+
+        `symbol` may be a list, to stream several symbols over this one connection. Pass the owning
+        client's apiKey and RequestSigner so both sides authenticate with the same credentials; without
+        them the ones in settings are used.
+        '''
 
         self.logger.debug("Connecting WebSocket.")
-        self.symbol = symbol
+
+        # Get WS URL and connect.
+        wsURL = self.realtime_url(endpoint, symbol, shouldAuth)
+        self.logger.info("Connecting to %s" % wsURL)
+        self.__connect(wsURL, apiKey, signer)
+        self.logger.info('Connected to WS. Waiting for data images, this may take a moment...')
+
+        # Connected. Wait for partials
+        while not self.has_partials():
+            sleep(0.1)
+        self.logger.info('Got all market data. Starting.')
+
+    def realtime_url(self, endpoint, symbol, shouldAuth=True):
+        '''Build the /realtime URL for a REST endpoint, subscribing to everything we use for symbol(s).'''
+        self.symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        self.symbol = self.symbols[0]
         self.shouldAuth = shouldAuth
+        self.bookTable = settings.ORDERBOOK_TABLE or None
 
         # We can subscribe right in the connection querystring, so let's build that.
-        # Subscribe to all pertinent endpoints
-        subscriptions = [sub + ':' + symbol for sub in ["quote", "trade"]]
+        # Subscribe to all pertinent endpoints, once per symbol for the ones that are filtered by symbol
+        subscriptions = [sub + ':' + symbol for symbol in self.symbols for sub in ["quote", "trade"]]
+        if self.bookTable:
+            subscriptions += [self.bookTable + ':' + symbol for symbol in self.symbols]
         subscriptions += ["instrument"]  # We want all of them
         if self.shouldAuth:
-            subscriptions += [sub + ':' + symbol for sub in ["order", "execution"]]
+            subscriptions += [sub + ':' + symbol for symbol in self.symbols for sub in ["order", "execution"]]
             subscriptions += ["margin", "position"]
 
-        # Get WS URL and connect.
         urlParts = list(urlparse(endpoint))
         urlParts[0] = urlParts[0].replace('http', 'ws')
         urlParts[2] = "/realtime?subscribe=" + ",".join(subscriptions)
-        wsURL = urlunparse(urlParts)
-        self.logger.info("Connecting to %s" % wsURL)
-        self.__connect(wsURL)
-        self.logger.info('Connected to WS. Waiting for data images, this may take a moment...')
+        return urlunparse(urlParts)
 
-        # Connected. Wait for partials
-        self.__wait_for_symbol(symbol)
+    def auth_headers(self, apiKey=None, apiSecret=None, signer=None):
+        '''Return auth headers. Will use API Keys if present in settings, unless others are given.
+
+        Pass the client's RequestSigner to sign with it instead of keying a new one for apiSecret.
+        '''
+
+        if self.shouldAuth is False:
+            return []
+
+        self.logger.info("Authenticating with API Key.")
+        # To auth to the WS using an API key, we generate a signature of a nonce and
+        # the WS API endpoint.
+        nonce = generate_nonce()
+        signer = signer or RequestSigner(apiSecret or settings.API_SECRET)
+        return [
+            "api-nonce: " + str(nonce),
+            "api-signature: " + signer.sign('GET', '/realtime', nonce),
+            "api-key:" + (apiKey or settings.API_KEY)
+        ]
+
+    def has_partials(self):
+        '''True once the initial images of every table we subscribed to have arrived, for every symbol.'''
+        tables = ['trade', 'quote']
+        if self.bookTable:
+            tables += [self.bookTable]
         if self.shouldAuth:
-            self.__wait_for_account()
-        self.logger.info('Got all market data. Starting.')
+            tables += ['order']
+        needed = [(table, symbol) for table in tables for symbol in self.symbols] + [('instrument', None)]
+        if self.shouldAuth:
+            needed += [('margin', None), ('position', None)]
+        # A partial without a symbol filter covers every symbol
+        return all(part in self.partials or (part[0], None) in self.partials for part in needed)
+
+    def process_message(self, message):
+        '''Apply one raw websocket frame, as if it had arrived on our own connection.'''
+        self.__on_message(self.ws, message)
 
     #
     # Data methods
     #
     def get_instrument(self, symbol):
-        instruments = self.data['instrument']
-        matchingInstruments = [i for i in instruments if i['symbol'] == symbol]
-        if len(matchingInstruments) == 0:
+        # The instrument table is keyed on symbol, and 'tickLog' is kept current as tickSize changes.
+        instrument = self.__find_item('instrument', {'symbol': symbol})
+        if not instrument:
             raise Exception("Unable to find instrument or index with symbol: " + symbol)
-        instrument = matchingInstruments[0]
-        # Turn the 'tickSize' into 'tickLog' for use in rounding
-        # http://stackoverflow.com/a/6190291/832202
-        instrument['tickLog'] = decimal.Decimal(str(instrument['tickSize'])).as_tuple().exponent * -1
         return instrument
 
     def get_ticker(self, symbol):
-        '''Return a ticker object. Generated from instrument.'''
+        '''Return a ticker object. Generated from instrument, with the top of the order book when we have one,
+        or else the latest quote.'''
 
         instrument = self.get_instrument(symbol)
 
@@ -94,6 +171,17 @@ class BitMEXWebsocket():
         else:
             bid = instrument['bidPrice'] or instrument['lastPrice']
             ask = instrument['askPrice'] or instrument['lastPrice']
+            book = self.books.get(symbol)
+            quotes = self.columns['quote'].get(symbol)
+            if book is not None:
+                bids, asks = book.best('Buy'), book.best('Sell')
+                bid = bids[0][0] if bids else bid
+                ask = asks[0][0] if asks else ask
+            elif quotes:
+                # Quotes are pushed as the top of the book changes; the instrument's bid and ask lag behind.
+                quoteBid, quoteAsk = quotes.column('bidPrice', 1)[0], quotes.column('askPrice', 1)[0]
+                bid = bid if np.isnan(quoteBid) else float(quoteBid)
+                ask = ask if np.isnan(quoteAsk) else float(quoteAsk)
             ticker = {
                 "last": instrument['lastPrice'],
                 "buy": bid,
@@ -108,24 +196,42 @@ class BitMEXWebsocket():
         return self.data['margin'][0]
 
     def market_depth(self, symbol):
-        raise NotImplementedError('orderBook is not subscribed; use askPrice and bidPrice on instrument')
-        # return self.data['orderBook25'][0]
+        '''The symbol's order book, an OrderBookL2. Empty until its partial arrives.'''
+        if not self.bookTable:
+            raise errors.BookNotSubscribedError('orderBook is not subscribed; set ORDERBOOK_TABLE')
+        return self.books.setdefault(symbol, OrderBookL2(symbol))
 
-    def open_orders(self, clOrdIDPrefix):
-        orders = self.data['order']
+    def open_orders(self, clOrdIDPrefix, symbol=None):
+        orders = self.data['order'] if symbol is None else self.__rows_by('order', 'symbol', symbol)
         # Filter to only open orders (leavesQty > 0) and those that we actually placed
         return [o for o in orders if str(o['clOrdID']).startswith(clOrdIDPrefix) and o['leavesQty'] > 0]
 
+    def executions(self, symbol=None):
+        '''Our most recent executions, oldest first. The table keeps the last TABLE_CAPACITY['execution'].'''
+        return list(self.data['execution']) if symbol is None else self.__rows_by('execution', 'symbol', symbol)
+
     def position(self, symbol):
-        positions = self.data['position']
-        pos = [p for p in positions if p['symbol'] == symbol]
+        pos = self.__rows_by('position', 'symbol', symbol)
         if len(pos) == 0:
             # No position found; stub it
             return {'avgCostPrice': 0, 'avgEntryPrice': 0, 'currentQty': 0, 'symbol': symbol}
         return pos[0]
 
-    def recent_trades(self):
-        return self.data['trade']
+    def recent_trades(self, count=None):
+        '''Most recent trades, oldest first, copied out of the trade ring buffer at one point in time.'''
+        return self.data['trade'].snapshot(count)
+
+    def add_listener(self, table, callback):
+        '''Call callback(table, action, rows) from the WS thread after each change applied to a table.'''
+        self.listeners.setdefault(table, []).append(callback)
+
+    def trade_columns(self, symbol):
+        '''Trades for a symbol as a ColumnStore: timestamp, price, size and side arrays.'''
+        return self.__column_store('trade', symbol)
+
+    def quote_columns(self, symbol):
+        '''Quotes for a symbol as a ColumnStore: timestamp, bid/ask price and bid/ask size arrays.'''
+        return self.__column_store('quote', symbol)
 
     #
     # Lifecycle methods
@@ -137,13 +243,14 @@ class BitMEXWebsocket():
 
     def exit(self):
         self.exited = True
-        self.ws.close()
+        if self.ws:
+            self.ws.close()
 
     #
     # Private methods
     #
 
-    def __connect(self, wsURL):
+    def __connect(self, wsURL, apiKey=None, signer=None):
         '''Connect to the websocket in a thread.'''
         self.logger.debug("Starting thread")
 
@@ -154,7 +261,7 @@ class BitMEXWebsocket():
                                          on_close=self.__on_close,
                                          on_open=self.__on_open,
                                          on_error=self.__on_error,
-                                         header=self.__get_auth()
+                                         header=self.auth_headers(apiKey, signer=signer)
                                          )
 
         setup_custom_logger('websocket', log_level=settings.LOG_LEVEL)
@@ -174,48 +281,27 @@ class BitMEXWebsocket():
             self.exit()
             sys.exit(1)
 
-    def __get_auth(self):
-        '''Return auth headers. Will use API Keys if present in settings.'''
-
-        if self.shouldAuth is False:
-            return []
-
-        self.logger.info("Authenticating with API Key.")
-        # To auth to the WS using an API key, we generate a signature of a nonce and
-        # the WS API endpoint.
-        nonce = generate_nonce()
-        return [
-            "api-nonce: " + str(nonce),
-            "api-signature: " + generate_signature(settings.API_SECRET, 'GET', '/realtime', nonce, ''),
-            "api-key:" + settings.API_KEY
-        ]
-
-    def __wait_for_account(self):
-        '''On subscribe, this data will come down. Wait for it.'''
-        # Wait for the keys to show up from the ws
-        while not {'margin', 'position', 'order'} <= set(self.data):
-            sleep(0.1)
-
-    def __wait_for_symbol(self, symbol):
-        '''On subscribe, this data will come down. Wait for it.'''
-        while not {'instrument', 'trade', 'quote'} <= set(self.data):
-            sleep(0.1)
-
     def __send_command(self, command, args):
         '''Send a raw command.'''
-        self.ws.send(json.dumps({"op": command, "args": args or []}))
+        self.ws.send(codec.dumps({"op": command, "args": args or []}))
 
     def __on_message(self, ws, message):
         '''Handler for parsing WS messages.'''
-        message = json.loads(message)
-        self.logger.debug(json.dumps(message))
+        received = trace.now() if trace.on else 0
+        if self.capture is not None:
+            self.capture.write_frame(message)
+        message = codec.loads(message)
+        if trace.on:
+            parsed = trace.now()
+            trace.record('ws.parse', received, parsed)
+        self.logger.debug('%s', codec.lazy(message))
 
         table = message['table'] if 'table' in message else None
         action = message['action'] if 'action' in message else None
         try:
             if 'subscribe' in message:
                 if message['success']:
-                    self.logger.debug("Subscribed to %s." % message['subscribe'])
+                    self.logger.debug("Subscribed to %s.", message['subscribe'])
                 else:
                     self.error("Unable to subscribe to %s. Error: \"%s\" Please check and restart." %
                                (message['request']['args'][0], message['error']))
@@ -224,10 +310,15 @@ class BitMEXWebsocket():
                     self.error(message['error'])
                 if message['status'] == 401:
                     self.error("API Key incorrect, please check and restart.")
+            elif action and table in self.BOOK_TABLES:
+                self.__apply_book(table, action, message)
+                if trace.on:
+                    trace.record('ws.apply', parsed)
+                self.__notify(table, action, message['data'])
             elif action:
 
                 if table not in self.data:
-                    self.data[table] = []
+                    self.data[table] = self.__new_table(table)
 
                 if table not in self.keys:
                     self.keys[table] = []
@@ -238,25 +329,30 @@ class BitMEXWebsocket():
                 # 'update'  - update row
                 # 'delete'  - delete row
                 if action == 'partial':
-                    self.logger.debug("%s: partial" % table)
-                    self.data[table] += message['data']
+                    self.logger.debug("%s: partial", table)
+                    self.partials.add((table, (message.get('filter') or {}).get('symbol')))
                     # Keys are communicated on partials to let you know how to uniquely identify
-                    # an item. We use it for updates.
+                    # an item. We use them to index the table so updates and deletes are O(1).
                     self.keys[table] = message['keys']
+                    if self.keys[table] and not self.__is_stream(table):
+                        self.data[table] = KeyedTable(self.keys[table], self.data[table],
+                                                      indexes=self.TABLE_INDEXES.get(table, ()))
+                    self.__derive_fields(table, message['data'])
+                    self.data[table] += message['data']
+                    self.__append_columns(table, message['data'])
                 elif action == 'insert':
-                    self.logger.debug('%s: inserting %s' % (table, message['data']))
+                    self.logger.debug('%s: inserting %s', table, message['data'])
+                    self.__derive_fields(table, message['data'])
+                    # Stream tables are ring buffers that evict their oldest rows as they fill up, and
+                    # keyed tables (like orders) are bounded by their key space, so there is no trimming here.
                     self.data[table] += message['data']
-
-                    # Limit the max length of the table to avoid excessive memory usage.
-                    # Don't trim orders because we'll lose valuable state if we do.
-                    if table != 'order' and len(self.data[table]) > BitMEXWebsocket.MAX_TABLE_LEN:
-                        self.data[table] = self.data[table][(BitMEXWebsocket.MAX_TABLE_LEN // 2):]
+                    self.__append_columns(table, message['data'])
 
                 elif action == 'update':
-                    self.logger.debug('%s: updating %s' % (table, message['data']))
+                    self.logger.debug('%s: updating %s', table, message['data'])
                     # Locate the item in the collection and update it.
                     for updateData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], updateData)
+                        item = self.__find_item(table, updateData, latest=True)
                         if not item:
                             continue  # No item found to update. Could happen before push
 
@@ -271,24 +367,123 @@ class BitMEXWebsocket():
                                              (item['side'], contExecuted, item['symbol'],
                                               instrument['tickLog'], item['price']))
 
-                        # Update this item.
-                        item.update(updateData)
+                        # Update this item. Keyed tables hand back a new row rather than changing this one.
+                        item = self.__update_item(table, item, updateData)
 
                         # Remove canceled / filled orders
                         if table == 'order' and item['leavesQty'] <= 0:
-                            self.data[table].remove(item)
+                            self.__remove_item(table, item)
 
                 elif action == 'delete':
-                    self.logger.debug('%s: deleting %s' % (table, message['data']))
+                    self.logger.debug('%s: deleting %s', table, message['data'])
                     # Locate the item in the collection and remove it.
                     for deleteData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], deleteData)
-                        self.data[table].remove(item)
+                        item = self.__find_item(table, deleteData, latest=True)
+                        if not item:
+                            continue  # Already gone, e.g. removed when its leavesQty hit zero
+                        self.__remove_item(table, item)
                 else:
                     raise Exception("Unknown action: %s" % action)
+
+                # Readers on other threads see the whole message applied from here on, never part of it
+                self.data[table].publish()
+                if trace.on:
+                    trace.record('ws.apply', parsed)
+                    if table == 'trade':
+                        trace.mark('trade', received)  # stages after this one count from here
+
+                self.__notify(table, action, message['data'])
         except:
             self.logger.error(traceback.format_exc())
 
+    def __notify(self, table, action, rows):
+        for listener in self.listeners.get(table, ()):
+            listener(table, action, rows)
+        self.events.publish(table)
+
+    def __apply_book(self, table, action, message):
+        '''Apply an order book message to the books of the symbols it has rows for.'''
+        bySymbol = {}
+        if action == 'partial':
+            symbol = (message.get('filter') or {}).get('symbol')
+            self.partials.add((table, symbol))
+            if symbol is not None:
+                bySymbol[symbol] = []  # an empty image still clears the book
+        for row in message['data']:
+            bySymbol.setdefault(row['symbol'], []).append(row)
+        for symbol, rows in iteritems(bySymbol):
+            self.books.setdefault(symbol, OrderBookL2(symbol)).apply(action, rows)
+
+    def __is_stream(self, table):
+        '''Append-only tables with a configured capacity are kept in ring buffers even if they have keys.'''
+        return table in (settings.TABLE_CAPACITY or {})
+
+    def __new_table(self, table):
+        '''Tables start out as ring buffers. Keyed, non-stream tables are converted on their partial.'''
+        capacity = (settings.TABLE_CAPACITY or {}).get(table, BitMEXWebsocket.MAX_TABLE_LEN)
+        return RingTable(capacity)
+
+    def __column_store(self, table, symbol):
+        if symbol not in self.columns[table]:
+            capacity = (settings.COLUMN_CAPACITY or {}).get(table, BitMEXWebsocket.MAX_TABLE_LEN)
+            self.columns[table][symbol] = columns.ColumnStore(self.COLUMN_TABLES[table][0], capacity)
+        return self.columns[table][symbol]
+
+    def __append_columns(self, table, rows):
+        '''Feed tick rows into the per-symbol column stores.'''
+        if table not in self.COLUMN_TABLES or not rows:
+            return
+        toColumns = self.COLUMN_TABLES[table][1]
+        bySymbol = {}
+        for row in rows:
+            bySymbol.setdefault(row['symbol'], []).append(row)
+        for symbol, symbolRows in iteritems(bySymbol):
+            self.__column_store(table, symbol).extend(**toColumns(symbolRows))
+
+    def __find_item(self, table, matchData, latest=False):
+        '''Locate a row by its keys. Keyed tables use their index; anything else falls back to a scan.
+
+        Readers see the last published rows; the WS thread passes latest=True to see its own pending writes.
+        '''
+        rows = self.data[table]
+        if isinstance(rows, KeyedTable):
+            return rows.find(matchData, latest)
+        return findItemByKeys(self.keys[table], rows, matchData)
+
+    def __rows_by(self, table, field, value):
+        '''Rows of a table whose field equals value, using a secondary index when there is one.'''
+        rows = self.data[table]
+        if isinstance(rows, KeyedTable) and field in self.TABLE_INDEXES.get(table, ()):
+            return rows.lookup(field, value)
+        return [r for r in rows if r[field] == value]
+
+    def __update_item(self, table, item, updateData):
+        '''Apply an update to a row and return the updated row, which is a new one for keyed tables.'''
+        rows = self.data[table]
+        if isinstance(rows, KeyedTable):
+            item = rows.update(item, updateData)
+        else:
+            item.update(updateData)
+        if 'tickSize' in updateData:
+            self.__derive_fields(table, [item])
+        return item
+
+    def __derive_fields(self, table, rows):
+        '''Compute fields we derive from the raw data once, when the data arrives, instead of on every read.'''
+        if table != 'instrument':
+            return
+        for instrument in rows:
+            # Turn the 'tickSize' into 'tickLog' for use in rounding
+            # http://stackoverflow.com/a/6190291/832202
+            if instrument.get('tickSize') is not None:
+                instrument['tickLog'] = decimal.Decimal(str(instrument['tickSize'])).as_tuple().exponent * -1
+
+    def __remove_item(self, table, item):
+        rows = self.data[table]
+        # Ring buffers are append-only; their rows age out instead of being deleted.
+        if isinstance(rows, KeyedTable):
+            rows.discard(item)
+
     def __on_open(self, ws):
         self.logger.debug("Websocket Opened.")
 
@@ -303,6 +498,9 @@ class BitMEXWebsocket():
     def __reset(self):
         self.data = {}
         self.keys = {}
+        self.partials = set()  # (table, symbol) of the table images received; symbol is None if unfiltered
+        self.books = {}  # symbol -> OrderBookL2
+        self.columns = dict((table, {}) for table in self.COLUMN_TABLES)
         self.exited = False
         self._error = None
 
@@ -13,7 +13,8 @@ setup(name='bitmex-market-maker',
       author_email='sam@bitmex.com',
       url='',
       install_requires=[
-          'requests',
+          'requests>=2.25.1',
+          'urllib3>=1.26',
           'websocket-client',
           'future'
       ]
@@ -0,0 +1,80 @@
+"""AsyncBitMEX against the local simulator: websocket tables, concurrent REST calls and cancels."""
+import time
+import asyncio
+import pytest
+from bitmex_bot.simulator.server import Simulator
+
+pytest.importorskip('aiohttp')
+from bitmex_bot.bitmex_async import AsyncBitMEX  # noqa: E402
+
+
+@pytest.fixture
+def simulator():
+    sim = Simulator(ratelimit=6000).start()
+    yield sim
+    sim.stop()
+
+
+async def wait_for(condition, timeout=5.):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out waiting for the websocket"
+        await asyncio.sleep(0.01)
+
+
+def test_orders_in_flight_together(simulator):
+    async def session():
+        client = AsyncBitMEX(base_url=simulator.url, symbol='XBTUSD', apiKey='async-key', apiSecret='secret')
+        await client.connect(timeout=10)
+        try:
+            assert client.instrument('XBTUSD')['symbol'] == 'XBTUSD'
+            buy, sell = await asyncio.gather(client.buy(quantity=100, orderType='Limit', price=9000.),
+                                             client.sell(quantity=100, orderType='Limit', price=11000.))
+            assert (buy['side'], buy['price'], sell['side'], sell['price']) == ('Buy', 9000., 'Sell', 11000.)
+            placed = {buy['orderID'], sell['orderID']}
+
+            await wait_for(lambda: {o['orderID'] for o in client.open_orders()} == placed)
+            assert {o['orderID'] for o in await client.http_open_orders()} == placed
+
+            canceled = await client.cancel(sorted(placed))
+            assert {o['ordStatus'] for o in canceled} == {'Canceled'}
+            await wait_for(lambda: not client.open_orders())
+        finally:
+            await client.close()
+        assert client.ws.exited
+
+    asyncio.run(session())
+
+
+def test_retries_a_503_on_a_get(simulator):
+    async def session():
+        client = AsyncBitMEX(base_url=simulator.url, symbol='XBTUSD', apiKey='async-key-503', apiSecret='secret')
+        await client.connect(timeout=10)
+        try:
+            order = await client.buy(quantity=10, orderType='Limit', price=9000.)
+            simulator.fault_503 = 1.
+            asyncio.get_running_loop().call_later(0.5, setattr, simulator, 'fault_503', 0.)
+            started = time.time()
+            # GETs are retried after a 503 and its 3s pause; POSTs are not, as they may not be idempotent
+            assert [o['orderID'] for o in await client.http_open_orders()] == [order['orderID']]
+            assert time.time() - started >= 3
+        finally:
+            await client.close()
+
+    asyncio.run(session())
+
+
+def test_retries_when_the_api_cannot_be_reached(simulator):
+    async def session():
+        client = AsyncBitMEX(base_url=simulator.url, symbol='XBTUSD', apiKey='async-key-down', apiSecret='secret')
+        await client.connect(timeout=10)
+        try:
+            client.base_url = 'http://127.0.0.1:1/api/v1/'  # nothing listens there
+            started = time.time()
+            with pytest.raises(Exception, match='Max retries'):
+                await client.http_open_orders()
+            assert time.time() - started >= 3  # three retries, a second apart
+        finally:
+            await client.close()
+
+    asyncio.run(session())
@@ -0,0 +1,169 @@
+"""SymbolStrategy against the local simulator: a trade is only over once the websocket has shown it."""
+import time
+import pytest
+from bitmex_bot.simulator.server import Simulator, TRADER_ACCOUNT
+from bitmex_bot.simulator.market import MarketGenerator, MARKET_ACCOUNT
+from bitmex_bot.bitmex import BitMEX
+from bitmex_bot.bitmex_bot import ExchangeInterface, OrderManager, SymbolStrategy
+from bitmex_bot.utils import errors
+from bitmex_bot.settings import settings
+
+
+@pytest.fixture
+def exchange():
+    sim = Simulator(ratelimit=6000).start()
+    market = MarketGenerator(sim.engine, rate=20, seed=1)
+    market.start()
+    client = BitMEX(base_url=sim.url, symbol='XBTUSD', apiKey='strategy-key', apiSecret='secret')
+    exchange = ExchangeInterface(client=client, historical=None)
+    exchange.simulator = sim
+    exchange.market = market
+    yield exchange
+    client.exit()
+    market.stop()
+    sim.stop()
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out waiting for the websocket"
+        time.sleep(0.01)
+
+
+def market_orders(sim):
+    return [o for o in sim.engine.find_orders(TRADER_ACCOUNT, count=1000) if o['ordType'] == 'Market']
+
+
+def test_no_second_entry_before_the_websocket_shows_the_first(exchange, monkeypatch):
+    sim = exchange.simulator
+    strategy = SymbolStrategy(exchange)
+    strategy.init()
+    monkeypatch.setattr(strategy, 'macd_check', lambda: setattr(strategy, 'macd_signal', strategy.UP))
+
+    strategy.sanity_check()
+    assert strategy.is_trade and strategy.close_order
+    assert len(market_orders(sim)) == 1
+
+    # Checks wake up on websocket events, so the next one can run before the websocket shows the fill or
+    # the bracket orders. That is not a flat position.
+    with monkeypatch.context() as lagging:
+        lagging.setattr(exchange, 'get_position', lambda symbol=None: 0)
+        lagging.setattr(exchange, 'get_orders', lambda: [])
+        strategy.sanity_check()
+        strategy.sanity_check()
+    assert strategy.is_trade and not strategy.position_seen
+    assert len(market_orders(sim)) == 1
+
+    wait_for(lambda: exchange.get_position() != 0 and len(exchange.get_orders()) == 2)
+    strategy.sanity_check()
+    assert strategy.is_trade and strategy.position_seen
+    assert len(market_orders(sim)) == 1
+
+    # Once the position is really closed, the trade is over and the next signal enters again
+    exchange.cancel_all_orders()
+    exchange.close_position()
+    wait_for(lambda: exchange.get_position() == 0 and not exchange.get_orders())
+    strategy.sanity_check()
+    assert not strategy.is_trade and not strategy.position_seen
+    strategy.sanity_check()
+    assert strategy.is_trade
+    assert len(market_orders(sim)) == 3  # two entries and the close
+
+
+def test_bracket_is_priced_off_the_fill(exchange, monkeypatch):
+    strategy = SymbolStrategy(exchange)
+    strategy.init()
+    monkeypatch.setattr(strategy, 'macd_check', lambda: setattr(strategy, 'macd_signal', strategy.UP))
+    place_order = exchange.place_order
+    entries = []
+
+    def market_without_price(**kwargs):
+        order = place_order(**kwargs)
+        entries.append(order)
+        return dict(order, price=None)  # BitMEX leaves the price of a market order out; avgPx is the fill
+
+    monkeypatch.setattr(exchange, 'place_order', market_without_price)
+    strategy.sanity_check()
+    fill = entries[0]['avgPx']
+    assert strategy.stop_price == pytest.approx(fill * (1 - settings.STOP_LOSS_FACTOR))
+    assert strategy.profit_price == pytest.approx(fill * (1 + settings.STOP_PROFIT_FACTOR))
+    wait_for(lambda: len(exchange.get_orders()) == 2)
+    assert sorted(o['price'] for o in exchange.get_orders()) == [int(strategy.stop_price), int(strategy.profit_price)]
+
+
+def test_reversal_cools_down_without_blocking(exchange, monkeypatch):
+    sim = exchange.simulator
+    strategy = SymbolStrategy(exchange)
+    strategy.init()
+    signal = [strategy.UP]
+    monkeypatch.setattr(strategy, 'macd_check', lambda: setattr(strategy, 'macd_signal', signal[0]))
+    now = [1000.]
+    monkeypatch.setattr(exchange, 'clock', lambda: now[0])
+
+    strategy.sanity_check()
+    wait_for(lambda: exchange.get_position() != 0 and len(exchange.get_orders()) == 2)
+    signal[0] = strategy.DOWN
+    started = time.time()
+    strategy.sanity_check()  # closes the long
+    strategy.sanity_check()  # still cooling down: no short yet
+    assert time.time() - started < 2  # the one loop thread, which the other symbols share, isn't held up
+    assert not strategy.is_trade
+    assert len(market_orders(sim)) == 2  # the entry and the close
+
+    now[0] += SymbolStrategy.REVERSAL_COOLDOWN
+    strategy.sanity_check()
+    assert strategy.is_trade and strategy.sequence == strategy.SELL
+    assert len(market_orders(sim)) == 3
+
+
+def test_bracket_fill_between_checks_ends_the_trade(exchange, monkeypatch):
+    sim = exchange.simulator
+    strategy = SymbolStrategy(exchange)
+    strategy.init()
+    monkeypatch.setattr(strategy, 'macd_check', lambda: setattr(strategy, 'macd_signal', strategy.UP))
+    strategy.sanity_check()
+    wait_for(lambda: len(exchange.get_orders()) == 2)
+
+    # The take profit fills before the next check has seen the position at all
+    exchange.market.stop()
+    time.sleep(0.2)
+    engine = sim.engine
+    with engine.lock:
+        engine.cancel(MARKET_ACCOUNT, [o['orderID'] for o in engine.open_orders(MARKET_ACCOUNT)
+                                       if o['side'] == 'Sell' and o['price'] <= strategy.profit_price])
+        engine.place(MARKET_ACCOUNT, {'side': 'Sell', 'orderQty': 1, 'ordType': 'Limit',
+                                      'price': int(strategy.profit_price) + 1000})  # keep an ask in the book
+        engine.place(MARKET_ACCOUNT, {'side': 'Buy', 'orderQty': strategy.amount, 'ordType': 'Limit',
+                                      'price': int(strategy.profit_price)})
+    wait_for(lambda: exchange.get_position() == 0 and len(exchange.get_orders()) == 1)
+    assert not strategy.position_seen
+
+    # A reversal now must not try to close the flat position, which BitMEX rejects
+    monkeypatch.setattr(strategy, 'macd_check', lambda: setattr(strategy, 'macd_signal', strategy.DOWN))
+    monkeypatch.setattr(exchange, 'close_position', lambda: pytest.fail("closed a flat position"))
+    strategy.sanity_check()
+    assert not strategy.is_trade
+    wait_for(lambda: not exchange.get_orders())  # the stop loss left over is canceled
+    assert len(market_orders(sim)) == 1
+
+
+@pytest.mark.parametrize('error', [errors.MarketEmptyError("Orderbook is empty, cannot quote"),
+                                   ValueError("bad response")])
+def test_one_symbol_failing_does_not_stop_the_others(exchange, monkeypatch, error):
+    sim = exchange.simulator
+    failing, healthy = SymbolStrategy(exchange), SymbolStrategy(exchange)
+    failing.init()
+    healthy.init()
+
+    def fail():
+        raise error
+    monkeypatch.setattr(failing, 'macd_check', fail)
+    monkeypatch.setattr(healthy, 'macd_check', lambda: setattr(healthy, 'macd_signal', healthy.UP))
+    manager = OrderManager.__new__(OrderManager)
+    manager.strategies = [failing, healthy]
+
+    manager.sanity_check()
+    assert not failing.is_trade
+    assert healthy.is_trade
+    assert len(market_orders(sim)) == 1
@@ -0,0 +1,124 @@
+"""BulkDownloader against a canned trade/bucketed endpoint, including resuming an interrupted download."""
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+import pytest
+import requests
+from bitmex_bot.bulk_download import BulkDownloader, load_candles
+from bitmex_bot.candles import NS_PER_SECOND
+
+MINUTE = 60 * NS_PER_SECOND
+START = int(np.datetime64('2018-01-01T00:01', 'ns').astype(np.int64))
+BARS = 3500  # four pages of up to 1000 bars
+
+
+def has_bar(timestamp):
+    return (timestamp - START) // MINUTE % 97 != 5  # BitMEX leaves out bins with no trades
+
+
+class BucketedHandler(BaseHTTPRequestHandler):
+    """Serves GET /api/v1/trade/bucketed with a made up 1m series: close is the bar's index."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        server = self.server
+        with server.lock:
+            server.requests.append(params)
+            fail = params.get('startTime') in server.fail
+        if url.path != '/api/v1/trade/bucketed' or fail:
+            return self.__reply(500, {'error': {'message': 'Internal error', 'name': 'HTTPError'}})
+        start = int(np.datetime64(params['startTime'], 'ns').astype(np.int64))
+        rows = []
+        for i in range(int(params['count'])):
+            timestamp = start + i * MINUTE
+            if not has_bar(timestamp):
+                continue
+            index = (timestamp - START) // MINUTE
+            rows.append({'timestamp': str(np.datetime64(timestamp, 'ns').astype('datetime64[ms]')) + 'Z',
+                         'symbol': params['symbol'], 'open': index, 'high': index + 1, 'low': index - 1,
+                         'close': float(index), 'volume': 10})
+        self.__reply(200, rows)
+
+    def __reply(self, status, result):
+        payload = json.dumps(result).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), BucketedHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.fail = set()
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    httpd.url = 'http://127.0.0.1:%d/api/v1/' % httpd.server_address[1]
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def downloader(server, directory, **kwargs):
+    return BulkDownloader('XBTUSD', '1m', START, START + (BARS - 1) * MINUTE, directory=str(directory),
+                          per_minute=60000, base_url=server.url, **kwargs)
+
+
+def expected():
+    timestamps = START + np.arange(BARS, dtype=np.int64) * MINUTE
+    return timestamps[[has_bar(t) for t in timestamps]]
+
+
+def test_downloads_every_page_onto_the_grid(server, tmp_path):
+    path = downloader(server, tmp_path).run()
+    assert len(server.requests) == 4
+    bars = load_candles(path)
+    np.testing.assert_array_equal(bars['timestamp'], expected())
+    np.testing.assert_array_equal(bars['close'], (expected() - START) // MINUTE)
+    grid = load_candles(path, mmap_mode=None)
+    assert len(grid['timestamp']) == BARS
+    assert not grid['timestamp'][5] and grid['timestamp'][6]
+
+
+def test_resumes_from_the_pages_done(server, tmp_path):
+    # The third page fails and the run is interrupted; pages already on disk are marked in pages.npy
+    server.fail.add(str(np.datetime64(START + 2000 * MINUTE, 'ns').astype('datetime64[ms]')))
+    with pytest.raises(requests.exceptions.HTTPError):
+        downloader(server, tmp_path, workers=1, max_retries=0).run()
+    done = np.load(os.path.join(str(tmp_path), 'XBTUSD-1m', 'pages.npy'))
+    assert list(done[:3]) == [True, True, False]
+
+    server.fail.clear()
+    del server.requests[:]
+    path = downloader(server, tmp_path, workers=1).run()
+    fetched = sorted(int(np.datetime64(r['startTime'], 'ns').astype(np.int64)) for r in server.requests)
+    assert fetched == [START + page * 1000 * MINUTE for page in range(4) if not done[page]]
+    assert np.load(os.path.join(path, 'pages.npy')).all()
+    np.testing.assert_array_equal(load_candles(path)['timestamp'], expected())
+
+
+def test_stops_fetching_once_a_page_fails(server, tmp_path):
+    # The second page fails; of the two after it, at most the one already being fetched goes out
+    server.fail.add(str(np.datetime64(START + 1000 * MINUTE, 'ns').astype('datetime64[ms]')))
+    with pytest.raises(requests.exceptions.HTTPError):
+        downloader(server, tmp_path, workers=1, max_retries=0).run()
+    assert len(server.requests) <= 3
+
+
+def test_refuses_to_resume_a_different_download(server, tmp_path):
+    downloader(server, tmp_path).run()
+    with pytest.raises(ValueError):
+        BulkDownloader('XBTUSD', '1m', START, START + BARS * MINUTE, directory=str(tmp_path),
+                       base_url=server.url).run()
@@ -0,0 +1,97 @@
+"""Live candles: built from the websocket's trade columns against the local simulator, and across threads."""
+import sys
+import time
+import threading
+import numpy as np
+from bitmex_bot.simulator.server import Simulator
+from bitmex_bot.simulator.market import MarketGenerator
+from bitmex_bot.bitmex import BitMEX
+from bitmex_bot.candles import CandleAggregator, NS_PER_SECOND
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out waiting for the websocket"
+        time.sleep(0.01)
+
+
+def test_candles_from_the_trade_columns_match_candles_from_the_rows():
+    sim = Simulator(ratelimit=6000).start()
+    market = MarketGenerator(sim.engine, rate=50, seed=1)
+    client = BitMEX(base_url=sim.url, symbol='XBTUSD', apiKey='key', apiSecret='secret')
+    try:
+        trades = client.trade_columns()
+        fromColumns = CandleAggregator('XBTUSD', ('1m',), trades=trades)
+        fromRows = CandleAggregator('XBTUSD', ('1m',))
+        client.ws.add_listener('trade', fromColumns.on_trades)
+        client.ws.add_listener('trade', fromRows.on_trades)
+        market.start()
+        wait_for(lambda: len(trades) >= 50)
+        market.stop()
+
+        rows = [r for r in client.recent_trades() if r['symbol'] == 'XBTUSD']
+        assert trades.column('timestamp').dtype == np.int64
+        assert trades.column('side').dtype == np.int8
+        np.testing.assert_array_equal(trades.column('price', len(rows)), [r['price'] for r in rows])
+        np.testing.assert_array_equal(trades.column('size', len(rows)), [r['size'] for r in rows])
+
+        fromColumns.roll(int(time.time() * 1e9) + 60 * 10 ** 9)
+        fromRows.roll(int(time.time() * 1e9) + 60 * 10 ** 9)
+        for name in ('timestamp', 'open', 'high', 'low', 'close', 'volume'):
+            np.testing.assert_array_equal(fromColumns.series['1m'].bars.column(name),
+                                          fromRows.series['1m'].bars.column(name))
+        assert fromColumns.series['1m'].bars.column('volume').sum() > 0
+
+        # Without an order book, the ticker's bid and ask come from the newest quote
+        quotes = client.quote_columns()
+        assert len(quotes)
+        client.ws.books.clear()
+        ticker = client.ws.get_ticker('XBTUSD')
+        assert (ticker['buy'], ticker['sell']) == (quotes.column('bidPrice', 1)[0], quotes.column('askPrice', 1)[0])
+    finally:
+        market.stop()
+        client.exit()
+        sim.stop()
+
+
+def test_trades_and_rolls_from_two_threads():
+    # Every trade lands in a new 1m bin, and the roller keeps completing the bar the trades are building.
+    candles = CandleAggregator('XBTUSD', ('1m',))
+    width = candles.series['1m'].width
+    start = 1500000000 * NS_PER_SECOND
+    latest = [start]
+    done = threading.Event()
+    errors = []
+
+    def trade():
+        try:
+            for i in range(20000):
+                latest[0] = start + i * width
+                candles.add_trades([latest[0]], [100. + i % 7], [1])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def roll():
+        try:
+            while not done.is_set():
+                candles.roll(latest[0] + width)
+        except Exception as e:
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=trade), threading.Thread(target=roll)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert not errors
+    ends = candles.series['1m'].bars.column('timestamp')
+    assert len(ends) and np.all(np.diff(ends) == width)
@@ -0,0 +1,104 @@
+"""The streaming indicators must continue exactly the series their batch counterparts give."""
+import numpy as np
+import pytest
+from bitmex_bot import indicators
+
+METHODS = indicators.EMA_METHODS
+
+
+def closes(count=300, seed=7):
+    return 10000. + np.cumsum(np.random.RandomState(seed).normal(0, 15, count))
+
+
+def stream_ema(values, period, method, warm):
+    streaming = indicators.StreamingEMA(period, method)
+    out = list(streaming.warmup(values[:warm]))
+    out.extend(streaming.update(value) for value in values[warm:])
+    return np.array(out)
+
+
+@pytest.mark.parametrize('method', METHODS)
+@pytest.mark.parametrize('warm', [21, 50, 299])
+def test_streaming_ema_matches_batch(method, warm):
+    values = closes()
+    np.testing.assert_allclose(stream_ema(values, 20, method, warm), indicators.ema(values, 20, method),
+                               rtol=1e-10)
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_streaming_macd_matches_batch(method):
+    values = closes()
+    streaming = indicators.StreamingMACD(method=method)
+    out = list(streaming.warmup(values[:60]))
+    out.extend(streaming.update(close) for close in values[60:])
+    np.testing.assert_allclose(out, indicators.macd(values, method=method), rtol=1e-8, atol=1e-9)
+    assert streaming.value == out[-1]
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_streaming_macd_needs_more_than_slow_period_to_warm_up(method):
+    streaming = indicators.StreamingMACD(method=method)
+    assert streaming.warmup(closes(26)) is None
+    assert not streaming.ready
+    assert indicators.macd(closes(26), method=method) is None
+    assert len(streaming.warmup(closes(27))) == 27
+    assert streaming.ready
+
+
+def test_legacy_ema_needs_more_than_period_to_warm_up():
+    with pytest.raises(ValueError):
+        indicators.StreamingEMA(20, 'legacy').warmup(closes(20))
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_update_before_warmup_raises(method):
+    with pytest.raises(ValueError):
+        indicators.StreamingEMA(20, method).update(1.)
+
+
+def test_unknown_method_raises():
+    with pytest.raises(ValueError):
+        indicators.StreamingEMA(20, 'simple')
+    with pytest.raises(ValueError):
+        indicators.ema(closes(), 20, 'simple')
+
+
+def test_recursive_ema_leading_nans_seed_on_first_value():
+    values = closes(60)
+    values[:10] = np.nan
+    batch = indicators.ema(values, 20)
+    assert np.isnan(batch[:10]).all()
+    # Warming up on nothing but NaNs leaves the EMA NaN; the first real value seeds it.
+    np.testing.assert_allclose(stream_ema(values, 20, 'recursive', 5), batch, rtol=1e-10)
+    np.testing.assert_allclose(stream_ema(values, 20, 'recursive', 10), batch, rtol=1e-10)
+
+
+def test_recursive_ema_holds_across_gaps():
+    values = closes(80)
+    values[[30, 31, 32, 55]] = np.nan
+    batch = indicators.ema(values, 20)
+    assert batch[32] == batch[29]
+    np.testing.assert_allclose(stream_ema(values, 20, 'recursive', 31), batch, rtol=1e-10)
+
+
+def test_legacy_ema_nan_leaves_with_the_window():
+    values = closes(80)
+    values[50] = np.nan
+    batch = indicators.ema(values, 20, 'legacy')
+    assert np.isnan(batch[50:70]).all() and not np.isnan(batch[70:]).any()
+    np.testing.assert_allclose(stream_ema(values, 20, 'legacy', 40), batch, rtol=1e-10)
+
+
+@pytest.mark.parametrize('warm', [0, 1, 100])
+def test_streaming_heikin_ashi_matches_batch(warm):
+    c = closes(200)
+    o = np.concatenate([[c[0]], c[:-1]])
+    h = np.maximum(o, c) + 5
+    l = np.minimum(o, c) - 5
+    streaming = indicators.StreamingHeikinAshi()
+    out = [list(column) for column in streaming.warmup(o[:warm], h[:warm], l[:warm], c[:warm])]
+    for bar in zip(o[warm:], h[warm:], l[warm:], c[warm:]):
+        for column, value in zip(out, streaming.update(*bar)):
+            column.append(value)
+    for column, expected in zip(out, indicators.heikin_ashi(o, h, l, c)):
+        np.testing.assert_allclose(column, expected, rtol=1e-12)
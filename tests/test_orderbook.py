@@ -0,0 +1,66 @@
+"""OrderBookL2 checked against a plain dict of the book's rows, and the websocket handing it out."""
+import random
+import pytest
+from bitmex_bot.ws.orderbook import OrderBookL2
+from bitmex_bot.ws.ws_thread import BitMEXWebsocket
+from bitmex_bot.utils import errors
+
+
+def row(id, side, price=None, size=None):
+    r = {'symbol': 'XBTUSD', 'id': id, 'side': side}
+    if price is not None:
+        r['price'] = price
+    if size is not None:
+        r['size'] = size
+    return r
+
+
+def test_side_flip_onto_a_level_already_on_that_side():
+    book = OrderBookL2('XBTUSD')
+    book.apply('partial', [row(1, 'Buy', 100., 5), row(2, 'Sell', 100., 7), row(3, 'Sell', 101., 9)])
+    book.apply('update', [row(1, 'Sell', size=6)])
+    assert book.best('Sell', 5) == [(100., 6), (101., 9)]
+    assert book.best('Buy', 5) == []
+
+    book.apply('delete', [row(1, 'Sell')])
+    assert book.best('Sell', 5) == [(101., 9)]
+    assert book.depth_to('Sell', 101.) == 9
+
+
+def test_matches_a_reference_book():
+    rng = random.Random(1)
+    book = OrderBookL2('XBTUSD')
+    book.apply('partial', [])
+    reference = {}  # id -> (side, price, size)
+    for _ in range(5000):
+        op = rng.random()
+        if op < .4 or not reference:
+            price = rng.randint(1, 400)
+            id = 10 ** 6 - price
+            if id in reference:
+                continue
+            side = 'Buy' if price < 200 else 'Sell'
+            size = rng.randint(1, 100)
+            book.apply('insert', [row(id, side, float(price), size)])
+            reference[id] = (side, float(price), size)
+        elif op < .8:
+            id = rng.choice(list(reference))
+            side, price, _ = reference[id]
+            size = rng.randint(1, 100)
+            book.apply('update', [row(id, side, size=size)])
+            reference[id] = (side, price, size)
+        else:
+            id = rng.choice(list(reference))
+            book.apply('delete', [row(id, reference.pop(id)[0])])
+
+    bids = sorted(((p, s) for side, p, s in reference.values() if side == 'Buy'), reverse=True)
+    asks = sorted((p, s) for side, p, s in reference.values() if side == 'Sell')
+    assert book.best('Buy', len(bids) + 1) == bids
+    assert book.best('Sell', len(asks) + 1) == asks
+
+
+def test_unsubscribed_book_raises_a_specific_error():
+    ws = BitMEXWebsocket()
+    ws.bookTable = None
+    with pytest.raises(errors.BookNotSubscribedError):
+        ws.market_depth('XBTUSD')
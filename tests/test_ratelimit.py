@@ -0,0 +1,60 @@
+"""RateLimiter bookkeeping, and the REST clients taking a token before they sign a request."""
+import time
+import asyncio
+import pytest
+from bitmex_bot.simulator.server import Simulator
+from bitmex_bot.bitmex import BitMEX
+from bitmex_bot.utils.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def simulator():
+    sim = Simulator(ratelimit=6000).start()
+    yield sim
+    sim.stop()
+
+
+def test_hold_does_not_credit_the_time_before_it():
+    limiter = RateLimiter(limit=60, reserve=0)
+    limiter.tokens = 0.
+    limiter.updated = time.time() - 30  # nothing taken or refilled for half a minute
+    limiter.hold(time.time() + 1)
+    assert limiter.stats()['tokens'] <= 1
+    assert limiter.try_acquire() > 0
+
+
+def test_signs_after_the_ratelimit_wait(simulator, monkeypatch):
+    client = BitMEX(base_url=simulator.url, symbol='XBTUSD', apiKey='order-key', apiSecret='secret')
+    try:
+        calls = []
+        acquire, sign = client.ratelimit.acquire, client.signer.sign
+        monkeypatch.setattr(client.ratelimit, 'acquire', lambda *a: calls.append('acquire') or acquire(*a))
+        monkeypatch.setattr(client.signer, 'sign', lambda *a: calls.append('sign') or sign(*a))
+        client.http_open_orders()
+        assert calls == ['acquire', 'sign']
+    finally:
+        client.exit()
+
+
+def test_async_signs_after_the_ratelimit_wait(simulator, monkeypatch):
+    pytest.importorskip('aiohttp')
+    from bitmex_bot.bitmex_async import AsyncBitMEX
+
+    async def session():
+        client = AsyncBitMEX(base_url=simulator.url, symbol='XBTUSD', apiKey='async-order-key', apiSecret='secret')
+        await client.connect(timeout=10)
+        try:
+            calls = []
+            acquire, sign_url = client._acquire_ratelimit, client.signer.sign_url
+
+            async def acquire_spy(priority):
+                calls.append('acquire')
+                await acquire(priority)
+            monkeypatch.setattr(client, '_acquire_ratelimit', acquire_spy)
+            monkeypatch.setattr(client.signer, 'sign_url', lambda *a: calls.append('sign') or sign_url(*a))
+            await client.http_open_orders()
+            assert calls == ['acquire', 'sign']
+        finally:
+            await client.close()
+
+    asyncio.run(session())
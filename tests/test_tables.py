@@ -0,0 +1,126 @@
+"""Copy-on-write websocket tables under a writer thread and reader threads reading the way the bot does.
+
+The writer applies order, position, instrument and trade messages as fast as it can; fields that each
+message changes together must always agree in what the readers see.
+"""
+import sys
+import json
+import time
+import logging
+import threading
+from bitmex_bot.ws.ws_thread import BitMEXWebsocket
+
+SECONDS = 2.
+READERS = 2
+SYMBOLS = ['XBTUSD', 'ETHUSD', 'XRPUSD']
+
+
+class Counter(logging.Handler):
+    """Counts the errors logged by one thread; websockets left over from other tests may log their own."""
+
+    def __init__(self, threadName):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.threadName = threadName
+        self.count = 0
+
+    def emit(self, record):
+        if record.threadName == self.threadName:
+            self.count += 1
+
+
+def frame(table, action, data, keys=None):
+    message = {'table': table, 'action': action, 'data': data}
+    if keys is not None:
+        message['keys'] = keys
+    return json.dumps(message)
+
+
+def websocket():
+    ws = BitMEXWebsocket()
+    ws.realtime_url('https://localhost/api/v1/', SYMBOLS, True)
+    ws.process_message(frame('instrument', 'partial', [
+        {'symbol': s, 'tickSize': 0.5, 'bidPrice': 100., 'askPrice': 101., 'midPrice': 100.5} for s in SYMBOLS],
+        ['symbol']))
+    ws.process_message(frame('position', 'partial', [
+        {'account': 1, 'symbol': s, 'currentQty': 0, 'check': 0} for s in SYMBOLS], ['account', 'symbol']))
+    ws.process_message(frame('order', 'partial', [], ['orderID']))
+    ws.process_message(frame('trade', 'partial', [], []))
+    return ws
+
+
+def write(ws, stop, writes):
+    seq = 0
+    while not stop.is_set():
+        seq += 1
+        symbol = SYMBOLS[seq % len(SYMBOLS)]
+        orderID = 'o%d' % seq
+        bid = 100. + seq % 50
+        ws.process_message(frame('instrument', 'update', [
+            {'symbol': symbol, 'bidPrice': bid, 'askPrice': bid + 1, 'midPrice': bid + .5}]))
+        ws.process_message(frame('position', 'update', [
+            {'account': 1, 'symbol': symbol, 'currentQty': seq, 'check': -seq}]))
+        ws.process_message(frame('order', 'insert', [
+            {'orderID': orderID, 'clOrdID': 'mm_' + orderID, 'symbol': symbol, 'side': 'Buy', 'price': bid,
+             'orderQty': 100, 'cumQty': 0, 'leavesQty': 100}]))
+        ws.process_message(frame('order', 'update', [
+            {'orderID': orderID, 'cumQty': 40, 'leavesQty': 60, 'symbol': SYMBOLS[(seq + 1) % len(SYMBOLS)]}]))
+        ws.process_message(frame('order', 'update', [{'orderID': 'o%d' % (seq - 20), 'cumQty': 100,
+                                                      'leavesQty': 0}]))
+        ws.process_message(frame('trade', 'insert', [
+            {'symbol': symbol, 'trdMatchID': seq * 3 + i, 'price': bid, 'size': 1, 'side': 'Buy',
+             'timestamp': '2018-01-01T00:00:00.000Z'} for i in range(3)]))
+        writes[0] += 6
+
+
+def read(ws, stop, reads, violations):
+    count = 0
+    while not stop.is_set():
+        try:
+            for symbol in SYMBOLS:
+                instrument = ws.get_instrument(symbol)
+                if instrument['askPrice'] != instrument['bidPrice'] + 1 or \
+                        instrument['midPrice'] != instrument['bidPrice'] + .5:
+                    violations.append(('instrument', dict(instrument)))
+                position = ws.position(symbol)
+                if position['currentQty'] != -position['check']:
+                    violations.append(('position', dict(position)))
+                for order in ws.open_orders('mm_', symbol):
+                    if order['cumQty'] + order['leavesQty'] != order['orderQty'] or order['symbol'] != symbol:
+                        violations.append(('order', dict(order)))
+            orders = ws.open_orders('mm_')
+            if len(orders) != len(list(orders)) or any(o['leavesQty'] <= 0 for o in orders):
+                violations.append(('orders', len(orders)))
+            ids = [t['trdMatchID'] for t in ws.recent_trades()]
+            if ids and ids != list(range(ids[0], ids[0] + len(ids))):
+                violations.append(('trades', ids[:3]))
+        except Exception as e:
+            violations.append(('exception', repr(e)))
+        count += 1
+    reads.append(count)
+
+
+def test_readers_never_see_a_message_half_applied():
+    ws = websocket()
+    errors = Counter('tables-writer')
+    logger = logging.getLogger('root')
+    logger.addHandler(errors)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible, to give races every chance
+    stop = threading.Event()
+    writes, reads, violations = [0], [], []
+    threads = [threading.Thread(target=write, args=(ws, stop, writes), name='tables-writer')] + \
+        [threading.Thread(target=read, args=(ws, stop, reads, violations)) for _ in range(READERS)]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(SECONDS)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+        logger.removeHandler(errors)
+
+    assert writes[0] and len(reads) == READERS and all(reads)
+    assert violations == []
+    assert errors.count == 0  # nothing failed in the writer either